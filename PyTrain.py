@@ -1,24 +1,15 @@
-import sentry_sdk as sentry
-sentry.init(
-    dsn="https://ae6f5c44a2035014c194291036202913@o4506723665313792.ingest.sentry.io/4506757166727168",
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-)
+import subprocess
+import argparse
+import getpass
+import json
+import sys
 import os
-import multiprocessing
 os.makedirs("library/ssl/", exist_ok=True)
-from library.server import ftps
+from library.server import ftps, settings_file
 from library.userman import userman
-
-def get_thread(name):
-    for thread in multiprocessing.active_children():
-        if thread.name == name:
-            return thread
+from library.telemetry import telemetry
+from library.storage import storage
+from library.jmod import jmod
 
 colours = {
     "red": "\033[91m",
@@ -36,8 +27,11 @@ class PyTrain:
         """
         Main function that starts the FTP server and handles user commands.
         """
-        # Starts the FTP server in a thread
-        FTPS_THREAD = ftps.run()
+        # Off unless "telemetry_enabled" is set, in which case sentry_sdk is loaded
+        telemetry.init("console")
+
+        # Starts the FTP server process(es)
+        FTPS_POOL = ftps.run()
 
         # Main loop
         while True:
@@ -60,36 +54,386 @@ class PyTrain:
                 elif command == "help":
                     PyTrain.print_help_msg()
                 elif command == "status":
-                    is_alive = get_thread("FTPServer").is_alive()
-                    if is_alive:
+                    alive_count = FTPS_POOL.alive_count()
+                    total = len(FTPS_POOL.workers)
+                    if alive_count == total and total > 0:
                         alive_msg = f"{colours['green']}The FTP server is running.{colours['end']}"
+                    elif alive_count > 0:
+                        alive_msg = f"{colours['yellow']}The FTP server is running, but only {alive_count} of {total} workers are alive.{colours['end']}"
                     else:
-                        alive_msg = f"{colours['red']}The FTP server is not running.{colours['end']}"                    
+                        alive_msg = f"{colours['red']}The FTP server is not running.{colours['end']}"
+                    if total > 1:
+                        alive_msg += f" ({alive_count}/{total} workers on port {FTPS_POOL.port}, {FTPS_POOL.restarts} restarts)"
                     print(alive_msg)
+                    draining = FTPS_POOL.draining_count()
+                    if draining:
+                        print(f"{colours['yellow']}{draining} drained server process(es) are still finishing their sessions.{colours['end']}")
                 elif command == "start" or command == "run":
-                    try:
-                        if get_thread("FTPServer").pid != None:
-                            print(f"{colours['yellow']}The FTP server is already running.{colours['end']}")
-                    except AttributeError:
-                        FTPS_THREAD = ftps.run()
+                    if FTPS_POOL.is_alive():
+                        print(f"{colours['yellow']}The FTP server is already running.{colours['end']}")
+                    else:
+                        FTPS_POOL.start()
+                        print(f"{colours['green']}The FTP server has been started.{colours['end']}")
+                elif command == "restart":
+                    if FTPS_POOL.is_alive():
+                        sessions = PyTrain.sessions_left(FTPS_POOL.restart())
+                        print(f"{colours['green']}The FTP server has been restarted. The old server is finishing {sessions}.{colours['end']}")
+                    else:
+                        FTPS_POOL.start()
                         print(f"{colours['green']}The FTP server has been started.{colours['end']}")
-                elif command == "stop" or command == "kill":
-                    try:
-                        if get_thread("FTPServer").pid != None:
-                            FTPS_THREAD.kill()
-                            print(f"{colours['green']}The FTP server has been stopped.{colours['end']}")
-                    except AttributeError:
+                elif command == "kill":
+                    if FTPS_POOL.is_alive() or FTPS_POOL.draining_count():
+                        FTPS_POOL.kill()
+                        print(f"{colours['green']}The FTP server has been stopped.{colours['end']}")
+                    else:
+                        print(f"{colours['yellow']}The FTP server is not running.{colours['end']}")
+                elif command == "sessions" or command == "who":
+                    PyTrain.print_sessions(FTPS_POOL)
+                elif command == "stats":
+                    PyTrain.print_stats(FTPS_POOL)
+                elif command.startswith("kick"):
+                    target = command[len("kick"):].strip()
+                    if not target:
+                        print(f"{colours['yellow']}Usage: kick <username or session ID>{colours['end']}")
+                        continue
+                    replies = PyTrain.request(FTPS_POOL, "kick", target=target)
+                    kicked = sum(reply["kicked"] for reply in replies)
+                    print(f"{colours['green'] if kicked else colours['yellow']}Disconnected {kicked} session(s) of '{target}'.{colours['end']}")
+                elif command == "reload":
+                    replies = PyTrain.request(FTPS_POOL, "reload-users")
+                    reloaded = [reply for reply in replies if "users" in reply]
+                    if len(reloaded) < len(replies):
+                        # reload_users leaves the current users in place when the settings can't be read
+                        print(f"{colours['yellow']}{len(replies) - len(reloaded)} server process(es) could not read the settings, and kept their current users.{colours['end']}")
+                    if reloaded:
+                        print(f"{colours['green']}The FTP server has reloaded its {reloaded[0]['users']} users and settings.{colours['end']}")
+                elif command == "drain" or command == "stop":
+                    if FTPS_POOL.is_alive():
+                        sessions = PyTrain.sessions_left(FTPS_POOL.drain())
+                        print(f"{colours['green']}The FTP server has stopped accepting connections, and will stop once {sessions} have ended.{colours['end']}")
+                    else:
                         print(f"{colours['yellow']}The FTP server is not running.{colours['end']}")
+                elif command == "shutdown":
+                    if FTPS_POOL.is_alive():
+                        FTPS_POOL.shutdown()
+                        print(f"{colours['green']}The FTP server has disconnected its clients and stopped.{colours['end']}")
+                    else:
+                        print(f"{colours['yellow']}The FTP server is not running.{colours['end']}")
+                elif command == "cert":
+                    PyTrain.cert_status()
+                elif command == "cert renew":
+                    PyTrain.cert_renew()
                 elif command in ["userman", "usermanager", "user manager", 'user', 'u']:
                     userman.CLI()
+                    # Pushes the changes to the server, rather than waiting for it to notice the settings file changed
+                    if FTPS_POOL.is_alive():
+                        PyTrain.request(FTPS_POOL, "reload-users")
                 elif command == "":
                     continue # Captures empty input
                 else:
                     print(f"{colours['yellow']}Invalid command. Please try again.{colours['end']}")
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, EOFError):
+                # EOFError is the end of input, e.g. a closed pipe
                 print("Exiting. Thank you for using PyTrain!")
-                FTPS_THREAD.kill()
+                FTPS_POOL.kill()
                 exit()
+            except Exception as err:
+                # Leaving the loop would leave the server processes running without their console
+                print(f"{colours['red']}The command failed: {err!r}{colours['end']}")
+
+    def cert_status():
+        """
+        Prints when the TLS certificate expires.
+        """
+        cert_manager = ftps.cert_manager()
+        expires = cert_manager.expires()
+        if expires is None:
+            print(f"{colours['yellow']}There is no TLS certificate yet. It will be generated when the FTP server starts, or with 'cert renew'.{colours['end']}")
+        elif cert_manager.needs_renewal():
+            print(f"{colours['yellow']}The TLS certificate expires on {expires:%Y-%m-%d %H:%M} UTC, and will be renewed soon.{colours['end']}")
+        else:
+            print(f"{colours['green']}The TLS certificate expires on {expires:%Y-%m-%d %H:%M} UTC.{colours['end']}")
+
+    def cert_renew():
+        """
+        Generates a new TLS certificate, under the same lock the server processes renew it with.
+        """
+        ftps.cert_manager().renew(force=True)
+        print(f"{colours['green']}A new TLS certificate has been generated. Running servers will start using it shortly.{colours['end']}")
+        PyTrain.cert_status()
+
+    def cert_command(args) -> int:
+        """
+        Runs a "cert" subcommand: shows when the TLS certificate expires, or renews it.
+
+        Args:
+            args (argparse.Namespace): The parsed command line.
+        Returns:
+            int: The exit code.
+        """
+        try:
+            if args.cert_command == "status":
+                PyTrain.cert_status()
+            elif args.cert_command == "renew":
+                PyTrain.cert_renew()
+        except (TimeoutError, OSError) as err:
+            print(f"{colours['red']}Could not renew the TLS certificate: {err}{colours['end']}")
+            return 1
+        return 0
+
+    def users_command(args) -> int:
+        """
+        Runs a "users" subcommand, for scripts that manage users without the interactive user manager.
+        A running FTP server picks up the changes when it next checks the settings file.
+
+        Args:
+            args (argparse.Namespace): The parsed command line.
+        Returns:
+            int: The exit code.
+        """
+        try:
+            if args.users_command == "import":
+                users = userman.read_users_file(args.file)
+                result = userman.bulk_upsert(users, workers=args.workers)
+                print(f"{colours['green']}Imported {len(users)} user(s): {len(result['added'])} added, {len(result['updated'])} updated.{colours['end']}")
+            elif args.users_command == "add":
+                password = args.password
+                if args.password_stdin:
+                    password = sys.stdin.readline().rstrip("\r\n")
+                elif password is None and sys.stdin.isatty():
+                    password = getpass.getpass(f"Password for {args.username} (leave empty to keep the current one): ") or None
+                user = {
+                    "username": args.username,
+                    "password": password,
+                    "home_dir": args.home,
+                    "permissions": args.perm,
+                    "permission_set": args.permission_set,
+                }
+                result = userman.bulk_upsert([user])
+                print(f"{colours['green']}User {args.username} {'added' if result['added'] else 'updated'}.{colours['end']}")
+            elif args.users_command == "remove":
+                removed = userman.bulk_remove(args.usernames)
+                missing = [username for username in args.usernames if username not in removed]
+                print(f"{colours['green']}Removed {len(removed)} user(s).{colours['end']}")
+                if missing:
+                    print(f"{colours['yellow']}No such user(s): {', '.join(missing)}{colours['end']}")
+                    return 1
+            elif args.users_command == "list":
+                user_list = userman.list_users()
+                if args.json:
+                    # Passwords are left out, hashed or not
+                    print(json.dumps({username: {key: value for key, value in user.items() if key != "password"} for username, user in user_list.items()}, indent=4))
+                else:
+                    for username, user in user_list.items():
+                        print(f"{username}\t{user.get('permissions')}\t{user.get('home_dir')}")
+        except ValueError as err:
+            print(f"{colours['red']}{err}{colours['end']}")
+            return 1
+        except OSError as err:
+            print(f"{colours['red']}{err}{colours['end']}")
+            return 1
+        return 0
+
+    def storage_command(args) -> int:
+        """
+        Runs a "storage" subcommand: shows where the settings are kept, or copies them to or from another file.
+        Exporting to settings.db (and removing settings.json) moves the settings to SQLite.
+
+        Args:
+            args (argparse.Namespace): The parsed command line.
+        Returns:
+            int: The exit code.
+        """
+        store = jmod.store(settings_file)
+        try:
+            if args.storage_command == "status":
+                path = storage.path(store)
+                users = userman.list_users()
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                print(f"Settings are stored with {storage.backend(settings_file)} in \"{path}\" ({PyTrain.format_bytes(size)}), with {len(users)} user(s).")
+            elif args.storage_command == "export":
+                counts = storage.copy(store, storage.open_file(args.file))
+                print(f"{colours['green']}Exported {counts['settings']} setting(s) and {counts['users']} user(s) to {args.file}.{colours['end']}")
+            elif args.storage_command == "import":
+                counts = storage.copy(storage.open_file(args.file), store)
+                print(f"{colours['green']}Imported {counts['settings']} setting(s) and {counts['users']} user(s) from {args.file}.{colours['end']}")
+        except (ValueError, OSError) as err:
+            print(f"{colours['red']}{err}{colours['end']}")
+            return 1
+        return 0
+
+    def parser() -> argparse.ArgumentParser:
+        """
+        Returns:
+            argparse.ArgumentParser: The command line's parser. With no subcommand, the console starts.
+        """
+        parser = argparse.ArgumentParser(prog="PyTrain", description="Sending your files on the fast track.")
+        parser.add_argument("--import-profile", action="store_true", help="print how long starting up spends importing modules, and exit")
+        parser.add_argument("--storage", choices=("json", "sqlite", "snapshot"), help="where the settings are kept: settings.json, settings.db, or a read-only snapshot of either (default: $PYTRAIN_STORAGE, or whichever file exists)")
+        commands = parser.add_subparsers(dest="command")
+        users = commands.add_parser("users", help="manage users without the interactive user manager")
+        users_commands = users.add_subparsers(dest="users_command", required=True)
+
+        import_parser = users_commands.add_parser("import", help="add or update users from a CSV or JSON file, all at once")
+        import_parser.add_argument("file", help="CSV with a header row (username,password,home_dir,permissions,...), a .json file, or - for CSV on stdin")
+        import_parser.add_argument("--workers", type=int, default=None, help="threads hashing passwords and making home directories (default: one per CPU core)")
+
+        add_parser = users_commands.add_parser("add", help="add a user, or update an existing one")
+        add_parser.add_argument("username")
+        add_parser.add_argument("--password", help="the password. Prefer --password-stdin, as other users can see command lines")
+        add_parser.add_argument("--password-stdin", action="store_true", help="read the password from the first line of stdin")
+        add_parser.add_argument("--home", help="the home directory. 'local' is ftp_dir/<username> (the default for new users)")
+        add_parser.add_argument("--perm", help="pyftpdlib permissions, e.g. elr (read only) or elradfmw (read and write)")
+        add_parser.add_argument("--permission-set", help="a saved permission set, whose permissions and limits the user gets")
+
+        remove_parser = users_commands.add_parser("remove", help="remove users")
+        remove_parser.add_argument("usernames", nargs="+")
+
+        list_parser = users_commands.add_parser("list", help="list users")
+        list_parser.add_argument("--json", action="store_true", help="print the users as JSON, without their passwords")
+
+        storage_parser = commands.add_parser("storage", help="show where the settings are kept, or move them between JSON and SQLite")
+        storage_commands = storage_parser.add_subparsers(dest="storage_command", required=True)
+        storage_commands.add_parser("status", help="show the storage backend, its file and how many users it has")
+        export_parser = storage_commands.add_parser("export", help="copy the settings to a file, replacing its contents")
+        export_parser.add_argument("file", help="a .json file, or a .db/.sqlite file for SQLite")
+        import_parser = storage_commands.add_parser("import", help="replace the settings with those of a file")
+        import_parser.add_argument("file", help="a .json file, or a .db/.sqlite file for SQLite")
+
+        cert_parser = commands.add_parser("cert", help="show when the TLS certificate expires, or renew it")
+        cert_commands = cert_parser.add_subparsers(dest="cert_command", required=True)
+        cert_commands.add_parser("status", help="show when the TLS certificate expires")
+        cert_commands.add_parser("renew", help="generate a new TLS certificate now. Running servers start using it shortly")
+        return parser
+
+    # What --import-profile imports, as the console, the server processes and the user manager do
+    import_stages = {
+        "console": "import PyTrain",
+        "server process": "import PyTrain, library.authorizer, pyftpdlib.handlers, pyftpdlib.servers",
+        "userman": "import library.userman",
+    }
+
+    def import_profile(top=12) -> None:
+        """
+        Prints how long each stage of starting PyTrain spends importing modules, and its slowest
+        imports, from python -X importtime run in a fresh interpreter.
+
+        Args:
+            top (int): The number of imports listed for each stage, slowest (with what they import) first.
+        """
+        project_dir = os.path.dirname(os.path.abspath(__file__))
+        for stage, code in PyTrain.import_stages.items():
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", code],
+                cwd=project_dir, capture_output=True, text=True
+            )
+            imports = []
+            for line in result.stderr.splitlines():
+                if not line.startswith("import time:") or "[us]" in line:
+                    continue
+                self_us, cumulative_us, name = line[len("import time:"):].split("|")
+                depth = (len(name) - len(name.lstrip())) // 2
+                imports.append((int(cumulative_us), int(self_us), depth, name.strip()))
+            if result.returncode != 0:
+                print(f"{colours['red']}{stage}: {result.stderr.strip().splitlines()[-1]}{colours['end']}")
+                continue
+            total = sum(cumulative for cumulative, _, depth, _ in imports if depth == 0)
+            print(f"{colours['cyan']}{stage}: {total / 1000:.1f} ms importing {len(imports)} modules{colours['end']}")
+            print(f"{'CUMULATIVE':>12}{'SELF':>10}  MODULE")
+            for cumulative, self_us, depth, name in sorted(imports, reverse=True)[:top]:
+                print(f"{cumulative / 1000:>10.1f}ms{self_us / 1000:>8.1f}ms  {'  ' * depth}{name}")
+
+    def format_bytes(count) -> str:
+        """
+        Formats a byte count with a binary unit, e.g. "1.5M".
+        """
+        for unit in ("B", "K", "M", "G"):
+            if count < 1024:
+                return f"{count:.0f}{unit}" if unit == "B" else f"{count:.1f}{unit}"
+            count /= 1024
+        return f"{count:.1f}T"
+
+    def format_duration(seconds) -> str:
+        """
+        Formats seconds as "1h02m", "3m05s" or "12s".
+        """
+        seconds = int(seconds)
+        if seconds >= 3600:
+            return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+        if seconds >= 60:
+            return f"{seconds // 60}m{seconds % 60:02d}s"
+        return f"{seconds}s"
+
+    def request(pool, command, **args) -> list:
+        """
+        Sends a command to every server process, printing the errors of those that failed.
+
+        Returns:
+            list: The replies of the processes that succeeded.
+        """
+        if not pool.is_alive():
+            print(f"{colours['yellow']}The FTP server is not running.{colours['end']}")
+            return []
+        replies = []
+        for reply in pool.request(command, **args):
+            if reply["ok"]:
+                replies.append(reply)
+            else:
+                print(f"{colours['yellow']}Worker {reply['worker_id']}: {reply['error']}{colours['end']}")
+        return replies
+
+    def sessions_left(replies) -> str:
+        """
+        Returns:
+            str: How many sessions drained server processes have left, e.g. "its 3 session(s)".
+        """
+        replies = [reply for reply in replies if reply["ok"]]
+        if any("sessions" not in reply for reply in replies):
+            # A prefork server is drained by a signal, so it doesn't say
+            return "its sessions"
+        return f"its {sum(reply['sessions'] for reply in replies)} session(s)"
+
+    def print_stats(pool):
+        """
+        Prints each server process' totals, and the server's.
+        """
+        replies = PyTrain.request(pool, "stats")
+        if not replies:
+            return
+        keys = ("connections", "sessions", "logged_in", "transfers", "bytes_in", "bytes_out")
+        print(f"{'WORKER':<8}{'PID':>8}{'UPTIME':>8}{'CONNS':>8}{'OPEN':>6}{'USERS':>7}{'XFERS':>7}{'IN':>9}{'OUT':>9}")
+        rows = [(str(reply["worker_id"]) if reply["worker_id"] is not None else "-", str(reply["pid"]), reply["stats"]) for reply in replies]
+        if len(rows) > 1:
+            total = {key: sum(stats[key] for _, _, stats in rows) for key in keys}
+            total["uptime"] = max(stats["uptime"] for _, _, stats in rows)
+            rows.append(("total", "", total))
+        for worker, pid, stats in rows:
+            print(
+                f"{worker:<8}{pid:>8}{PyTrain.format_duration(stats['uptime']):>8}{stats['connections']:>8}"
+                f"{stats['sessions']:>6}{stats['logged_in']:>7}{stats['transfers']:>7}"
+                f"{PyTrain.format_bytes(stats['bytes_in']):>9}{PyTrain.format_bytes(stats['bytes_out']):>9}"
+            )
+
+    def print_sessions(pool):
+        """
+        Prints who is connected to the FTP server, asking each server process for its sessions.
+        """
+        sessions = []
+        for reply in PyTrain.request(pool, "sessions"):
+            sessions += reply["sessions"]
+        if not sessions:
+            print("No one is connected.")
+            return
+        print(f"{'ID':<8}{'USER':<16}{'ADDRESS':<22}{'TIME':>7}{'IDLE':>7}{'IN':>8}{'OUT':>8}  ACTIVITY")
+        for session in sorted(sessions, key=lambda session: session["started"]):
+            address = f"{session['remote_ip']}:{session['remote_port']}"
+            print(
+                f"{session['id']:<8}{session['username'] or '-':<16}{address:<22}"
+                f"{PyTrain.format_duration(session['duration']):>7}{PyTrain.format_duration(session['idle']):>7}"
+                f"{PyTrain.format_bytes(session['bytes_in']):>8}{PyTrain.format_bytes(session['bytes_out']):>8}"
+                f"  {session['transfer'] or session['command'] or ''}"
+            )
+        print(f"{len(sessions)} session(s).")
 
     def print_help_msg():
         print("Commands:")
@@ -98,8 +442,36 @@ class PyTrain:
         print("help - Displays this message")
         print("status - Checks the status of the FTP server")
         print("start - Starts the FTP server")
-        print("stop - Stops the FTP server")
+        print("stop, drain - Stops accepting connections, and stops the FTP server once its transfers have finished")
+        print("restart - Restarts the FTP server with the current settings, letting transfers finish and refusing no one")
+        print("kill - Stops the FTP server at once, cutting off transfers")
+        print("shutdown - Disconnects every client and stops the FTP server")
+        print("sessions - Shows who is connected and what they are transferring")
+        print("stats - Shows connection and transfer totals of each server process")
+        print("kick <user or session ID> - Disconnects a user's sessions, or one session")
+        print("reload - Makes the FTP server reload its users and settings now")
+        print("cert - Shows when the TLS certificate expires")
+        print("cert renew - Generates a new TLS certificate")
         print("userman - Opens the user manager")
 
 if __name__ == "__main__":
-    PyTrain.main()
\ No newline at end of file
+    args = PyTrain.parser().parse_args()
+    if args.storage:
+        # Set for the whole process, so the server processes it starts use the same storage
+        os.environ["PYTRAIN_STORAGE"] = args.storage
+    try:
+        storage.backend(settings_file)
+    except ValueError as err:
+        # Checked once here, as every settings read (and every server process) would fail with it
+        print(f"{colours['red']}{err}{colours['end']}")
+        sys.exit(2)
+    if args.import_profile:
+        PyTrain.import_profile()
+    elif args.command == "users":
+        sys.exit(PyTrain.users_command(args))
+    elif args.command == "storage":
+        sys.exit(PyTrain.storage_command(args))
+    elif args.command == "cert":
+        sys.exit(PyTrain.cert_command(args))
+    else:
+        PyTrain.main()
\ No newline at end of file
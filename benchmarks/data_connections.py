@@ -0,0 +1,91 @@
+"""
+Benchmark of FTPS data connections, like those of a directory-heavy sync client.
+
+The server is started in a scratch directory with each TLS profile below, and a client lists a
+directory LISTINGS times. With resumption the client offers the control connection's TLS session
+for every data connection, as FileZilla and lftp do.
+
+Run from the project root with: python -m benchmarks.data_connections [listings]
+"""
+from library.jmod import jmod, data_tables
+from library.server import ftps
+import tempfile
+import ftplib
+import socket
+import time
+import ssl
+import sys
+import os
+
+LISTINGS = 200
+
+profiles = {
+    "no resumption": {"tls_session_cache": False, "tls_tickets": False},
+    "resumption": {"tls_session_cache": True, "tls_tickets": True},
+    "lazy listings": {"tls_lazy_listings": True},
+}
+
+class ResumingFTP_TLS(ftplib.FTP_TLS):
+    """
+    An FTP_TLS client that resumes the control connection's TLS session on data connections.
+    """
+    resumed = 0
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+        if self._prot_p:
+            conn = self.context.wrap_socket(conn, server_hostname=self.host, session=self.sock.session)
+            self.resumed += conn.session_reused
+        return conn, size
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def run_profile(settings, count):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        for i in range(20):
+            with open(f"file{i}.txt", "w") as f:
+                f.write("data")
+        port = free_port()
+        jmod.store("settings.json").write(dict(data_tables.SETTINGS_DT, port=port, autofind_port=False, RootPassword="bench", **settings))
+
+        pool = ftps.run()
+        try:
+            context = ssl._create_unverified_context()
+            client = ResumingFTP_TLS(context=context)
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    client.connect("127.0.0.1", port, timeout=10)
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.2)
+            client.login("root", "bench")
+            # Without PROT P the data connections stay plaintext, which lazy listings allow
+            if not settings.get("tls_lazy_listings"):
+                client.prot_p()
+
+            start = time.perf_counter()
+            for _ in range(count):
+                client.nlst()
+            elapsed = time.perf_counter() - start
+            client.quit()
+            return elapsed / count * 1000, client.resumed
+        finally:
+            pool.kill()
+            os.chdir("/")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else LISTINGS
+    results = [(name, *run_profile(settings, count)) for name, settings in profiles.items()]
+    print(f"{'profile':<16}{'ms/listing':>12}{'resumed':>10}")
+    for name, per_listing, resumed in results:
+        print(f"{name:<16}{per_listing:>12.2f}{resumed:>7}/{count}")
+
+if __name__ == "__main__":
+    main()
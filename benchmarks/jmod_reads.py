@@ -0,0 +1,57 @@
+"""
+Micro-benchmark for jmod reads on a large settings file.
+
+Compares reads/sec when every call re-parses the file (the old behaviour, forced by
+invalidating the JsonStore before each read) with reads served from the cache.
+
+Run from the project root with: python -m benchmarks.jmod_reads
+"""
+from library.jmod import jmod, data_tables
+import tempfile
+import time
+import os
+
+USER_COUNT = 10000
+DURATION = 2.0
+
+def make_settings(json_dir, user_count):
+    settings = dict(data_tables.SETTINGS_DT)
+    settings["PyTrain_users"] = {
+        f"user{i}": data_tables.NEW_USER_DT(f"user{i}", "password123", "elradfmw", None)
+        for i in range(user_count)
+    }
+    jmod.store(json_dir).write(settings)
+
+def reads_per_sec(read):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        read()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_dir = os.path.join(tmp_dir, "settings.json")
+        make_settings(json_dir, USER_COUNT)
+        store = jmod.store(json_dir)
+
+        cases = {
+            "port": lambda: jmod.getvalue("port", json_dir),
+            "one user": lambda: jmod.getvalue("PyTrain_users.user5000", json_dir),
+            "user table (copied)": lambda: jmod.getvalue("PyTrain_users", json_dir),
+            "user table (copy=False)": lambda: jmod.getvalue("PyTrain_users", json_dir, copy=False),
+        }
+
+        print(f"Settings file with {USER_COUNT} users, {os.path.getsize(json_dir) // 1024} KiB")
+        print(f"{'read':<26}{'uncached/s':>14}{'cached/s':>14}{'speedup':>10}")
+        for name, read in cases.items():
+            def uncached():
+                store.invalidate()
+                read()
+            before = reads_per_sec(uncached)
+            after = reads_per_sec(read)
+            print(f"{name:<26}{before:>14,.0f}{after:>14,.0f}{after / before:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Benchmark for password checks at login, with and without the verified-credential cache.
+
+A small set of users with hashed passwords log in over and over, like sync clients that
+reconnect for every transfer.
+
+Run from the project root with: python -m benchmarks.logins
+"""
+from library.authorizer import PyTrainAuthorizer
+from library.passwords import hash_password
+import itertools
+import tempfile
+import time
+import os
+
+USER_COUNT = 50
+DURATION = 2.0
+
+def logins_per_sec(authorizer, usernames):
+    count = 0
+    users = itertools.cycle(usernames)
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        authorizer.validate_authentication(next(users), "password123", None)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def main():
+    print(f"{'algorithm':<12}{'no cache/s':>14}{'cached/s':>14}{'speedup':>10}")
+    for algorithm in ("pbkdf2", "scrypt"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            usernames = [f"user{i}" for i in range(USER_COUNT)]
+            results = []
+            for cache_size in (0, 4096):
+                authorizer = PyTrainAuthorizer(os.path.join(tmp_dir, f"users{cache_size}.db"), verify_cache_size=cache_size)
+                with authorizer.user_table.batch():
+                    for username in usernames:
+                        authorizer.add_user(username, hash_password("password123", algorithm), tmp_dir)
+                results.append(logins_per_sec(authorizer, usernames))
+            before, after = results
+            print(f"{algorithm:<12}{before:>14,.0f}{after:>14,.0f}{after / before:>9.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Load benchmark for the server engines selected by "server_mode".
+
+For each mode the server is started in a scratch directory, SESSIONS clients log in over TLS
+and stay connected (like idle sync clients), and the resident memory of the server processes
+and their workers is measured. Linux only, as RSS is read from /proc.
+
+Run from the project root with: python -m benchmarks.server_modes [sessions]
+"""
+from library.jmod import jmod, data_tables
+from library.server import ftps
+import tempfile
+import socket
+import ssl
+import time
+import sys
+import os
+
+SESSIONS = 500
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def process_tree_rss(pid):
+    """
+    Returns the summed VmRSS in KiB of a process and all of its descendants.
+    """
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except OSError:
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+def pool_rss(pool):
+    return sum(process_tree_rss(process.pid) for process in pool.workers.values())
+
+def login(port):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+    reader = sock.makefile("rb")
+    reader.readline()
+    sock.sendall(b"AUTH TLS\r\n")
+    if not reader.readline().startswith(b"234"):
+        raise ConnectionError("AUTH TLS refused")
+    # The server's certificate is self-signed
+    sock = ssl._create_unverified_context().wrap_socket(sock)
+    reader = sock.makefile("rb")
+    for line, expected in ((b"USER root\r\n", b"331"), (b"PASS bench\r\n", b"230")):
+        sock.sendall(line)
+        while True:
+            reply = reader.readline()
+            # Multi-line replies use "230-" until the last line
+            if reply[3:4] != b"-":
+                break
+        if not reply.startswith(expected):
+            raise ConnectionError(reply)
+    return sock, reader
+
+def run_mode(mode, sessions):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        port = free_port()
+        settings = dict(data_tables.SETTINGS_DT, port=port, autofind_port=False, server_mode=mode, server_workers=4, RootPassword="bench")
+        jmod.store("settings.json").write(settings)
+
+        pool = ftps.run()
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                login(port)[0].close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+
+        idle_rss = pool_rss(pool)
+        clients, failed = [], 0
+        start = time.perf_counter()
+        for _ in range(sessions):
+            try:
+                clients.append(login(port))
+            except (OSError, ConnectionError):
+                failed += 1
+        elapsed = time.perf_counter() - start
+        time.sleep(0.5)
+        loaded_rss = pool_rss(pool)
+
+        for sock, reader in clients:
+            reader.close()
+            sock.close()
+        pool.kill()
+        # Prefork workers notice their parent is gone within a second, and exit
+        time.sleep(1.5)
+        os.chdir("/")
+        return len(clients), failed, elapsed, idle_rss, loaded_rss
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else SESSIONS
+    print(f"{'mode':<10}{'sessions':>10}{'failed':>8}{'logins/s':>10}{'idle RSS':>12}{'loaded RSS':>12}{'KiB/session':>13}")
+    for mode in ("threaded", "async", "prefork", "pool"):
+        ok, failed, elapsed, idle_rss, loaded_rss = run_mode(mode, sessions)
+        per_session = (loaded_rss - idle_rss) / ok if ok else 0
+        print(f"{mode:<10}{ok:>10}{failed:>8}{ok / elapsed:>10,.0f}{idle_rss:>10,}Ki{loaded_rss:>10,}Ki{per_session:>13,.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark of the settings storage backends on a large user table.
+
+For the JSON file and the SQLite database, times the user manager's own calls (adding one
+user, changing one user's password and removing one user, with passwords hashed beforehand so
+only the storage is timed), and the server syncing its user index after another process
+changed one user (a second store stands in for the server's).
+
+Run from the project root with: python -m benchmarks.storage_backends
+"""
+from library.jmod import jmod, data_tables
+from library.storage import storage, users_key
+from library.userman import userman, settings_file
+from library.authorizer import PyTrainAuthorizer
+from library.usersync import UserSync
+from library import passwords
+import tempfile
+import time
+import os
+
+USER_COUNT = 20000
+ROUNDS = 20
+
+def make_settings(user_count, password):
+    settings = dict(data_tables.SETTINGS_DT)
+    settings[users_key] = {
+        f"user{i}": data_tables.NEW_USER_DT(f"user{i}", password, "elradfmw", None)
+        for i in range(user_count)
+    }
+    return settings
+
+def per_op(operation):
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        operation(i)
+    return (time.perf_counter() - start) / ROUNDS
+
+def main():
+    hashed = passwords.hash_password("password123")
+    changed = passwords.hash_password("password456")
+    print(f"{USER_COUNT} users, ms per operation")
+    print(f"{'backend':<10}{'add user':>12}{'set password':>14}{'remove user':>13}{'reload':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            for name in ("json", "sqlite"):
+                os.makedirs(os.path.join(tmp_dir, name))
+                os.chdir(os.path.join(tmp_dir, name))
+                os.environ["PYTRAIN_STORAGE"] = name
+                # Made again for each backend, as a JSON store keeps (and changes) the document it is given
+                jmod.store(settings_file).write(make_settings(USER_COUNT, hashed))
+                reader = storage.open_store(settings_file)
+                user_sync = UserSync(PyTrainAuthorizer("users.db"))
+                user_sync.sync(reader)
+
+                def add_user(i):
+                    userman.bulk_upsert([{"username": f"new{i}", "password": hashed, "permissions": "elr"}])
+
+                def set_password(i):
+                    userman.bulk_upsert([{"username": f"user{i}", "password": hashed}])
+
+                def remove_user(i):
+                    userman.bulk_remove([f"new{i}"])
+
+                def reload(i):
+                    userman.bulk_upsert([{"username": f"user{i}", "password": changed}])
+                    start = time.perf_counter()
+                    changes = user_sync.sync(reader)
+                    elapsed = time.perf_counter() - start
+                    assert changes["password"] == [f"user{i}"]
+                    return elapsed
+
+                add = per_op(add_user)
+                change = per_op(set_password)
+                remove = per_op(remove_user)
+                reload_seconds = sum(reload(i) for i in range(ROUNDS)) / ROUNDS
+                print(f"{name:<10}{add * 1000:>12.2f}{change * 1000:>14.2f}{remove * 1000:>13.2f}{reload_seconds * 1000:>10.2f}")
+        finally:
+            os.environ.pop("PYTRAIN_STORAGE", None)
+            os.chdir("/")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Fairness benchmark of the server-wide download limit.
+
+CLIENTS clients download a file of SIZE_MB at once under a "download_limit" of LIMIT_MB per
+second, and again while a bulk client downloads with several connections at the same time.
+Each client's rate, the total (which includes the limit's one second burst), and Jain's
+fairness index (1.0 when every client gets the same share) are printed.
+
+Run from the project root with: python -m benchmarks.throttling [clients]
+"""
+from library.jmod import jmod, data_tables
+from library.server import ftps
+import threading
+import tempfile
+import ftplib
+import socket
+import time
+import ssl
+import sys
+import os
+
+CLIENTS = 4
+SIZE_MB = 8
+LIMIT_MB = 16
+BULK_CONNECTIONS = 4
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def connect(port):
+    client = ftplib.FTP_TLS(context=ssl._create_unverified_context())
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            client.connect("127.0.0.1", port, timeout=60)
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+    client.login("root", "bench")
+    client.prot_p()
+    return client
+
+def download(port, results, index):
+    client = connect(port)
+    start = time.perf_counter()
+    client.retrbinary("RETR big.bin", lambda data: None)
+    results[index] = SIZE_MB / (time.perf_counter() - start)
+    client.quit()
+
+def fairness(rates):
+    return sum(rates) ** 2 / (len(rates) * sum(rate ** 2 for rate in rates))
+
+def run(clients, bulk):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        with open("big.bin", "wb") as f:
+            f.write(os.urandom(SIZE_MB * 1024 * 1024))
+        port = free_port()
+        jmod.store("settings.json").write(dict(data_tables.SETTINGS_DT, port=port, autofind_port=False, RootPassword="bench",
+                                               server_mode="async", download_limit=LIMIT_MB * 1024 * 1024))
+        pool = ftps.run()
+        try:
+            connect(port).quit()
+            results = [0.0] * (clients + bulk)
+            threads = [threading.Thread(target=download, args=(port, results, i)) for i in range(clients + bulk)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            total = SIZE_MB * (clients + bulk) / (time.perf_counter() - start)
+            return results[:clients], results[clients:], total
+        finally:
+            pool.kill()
+            os.chdir("/")
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else CLIENTS
+    print(f"download_limit {LIMIT_MB} MB/s, {SIZE_MB} MB each")
+    print(f"{'run':<22}{'client MB/s':>28}{'total':>8}{'fairness':>10}")
+    for name, bulk in (("clients", 0), (f"+ bulk x{BULK_CONNECTIONS}", BULK_CONNECTIONS)):
+        rates, bulk_rates, total = run(clients, bulk)
+        listed = " ".join(f"{rate:.1f}" for rate in rates)
+        print(f"{name:<22}{listed:>28}{total:>8.1f}{fairness(rates + bulk_rates):>10.3f}")
+
+if __name__ == "__main__":
+    main()
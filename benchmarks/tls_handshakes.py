@@ -0,0 +1,62 @@
+"""
+Benchmark of full TLS handshakes with each key type CertManager can generate.
+
+Both ends of the handshake run in memory (ssl.MemoryBIO), so only the CPU cost of the
+handshake is measured, which is what limits how many clients a worker can log in.
+
+Run from the project root with: python -m benchmarks.tls_handshakes [handshakes]
+"""
+from library.certs import CertManager, key_types
+import tempfile
+import time
+import ssl
+import sys
+import os
+
+HANDSHAKES = 300
+
+def handshake(server_ctx, client_ctx):
+    server_in, server_out = ssl.MemoryBIO(), ssl.MemoryBIO()
+    client_in, client_out = ssl.MemoryBIO(), ssl.MemoryBIO()
+    server = server_ctx.wrap_bio(server_in, server_out, server_side=True)
+    client = client_ctx.wrap_bio(client_in, client_out)
+    done = {server: False, client: False}
+    while not all(done.values()):
+        for conn in (client, server):
+            if not done[conn]:
+                try:
+                    conn.do_handshake()
+                    done[conn] = True
+                except ssl.SSLWantReadError:
+                    pass
+        # Pass everything written by one side to the other
+        server_in.write(client_out.read())
+        client_in.write(server_out.read())
+
+def run_key_type(key_type, count):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        certs = CertManager(os.path.join(tmp_dir, "cert.pem"), os.path.join(tmp_dir, "key.pem"), key_type=key_type)
+        start = time.perf_counter()
+        certs.generate()
+        generate_time = time.perf_counter() - start
+
+        server_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_ctx.load_cert_chain(certs.certfile, certs.keyfile)
+        # Tickets would let the client resume, and only full handshakes are measured here
+        server_ctx.num_tickets = 0
+        client_ctx = ssl._create_unverified_context()
+
+        start = time.perf_counter()
+        for _ in range(count):
+            handshake(server_ctx, client_ctx)
+        return generate_time, count / (time.perf_counter() - start)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else HANDSHAKES
+    print(f"{'key type':<10}{'generate':>12}{'handshakes/s':>15}")
+    for key_type in key_types:
+        generate_time, rate = run_key_type(key_type, count)
+        print(f"{key_type:<10}{generate_time * 1000:>10.1f}ms{rate:>15,.0f}")
+
+if __name__ == "__main__":
+    main()
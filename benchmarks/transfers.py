@@ -0,0 +1,116 @@
+"""
+Throughput benchmark of large downloads over each data path.
+
+A file of SIZE_MB is downloaded from (or uploaded to) a server started in a scratch directory:
+- plain, sent with sendfile() (a user in "plain_data_users"),
+- plain, sent through Python's buffers ("use_sendfile" off),
+- TLS, with kernel TLS if the kernel and OpenSSL support it, otherwise encrypted by OpenSSL,
+each with pyftpdlib's default 64 KiB buffers and with 1 MiB ones ("transfer_buffer_size").
+The CPU time of the server process is read from /proc, so this is Linux only.
+
+Run from the project root with: python -m benchmarks.transfers [size_mb]
+"""
+from library.jmod import jmod, data_tables
+from library.server import ftps
+import tempfile
+import ftplib
+import socket
+import time
+import ssl
+import sys
+import os
+
+SIZE_MB = 256
+
+SMALL_BUFFERS = {"transfer_buffer_size": 65536, "read_ahead_size": 65536}
+BIG_BUFFERS = {"transfer_buffer_size": 1048576, "read_ahead_size": 4194304}
+
+# name: (settings, use TLS, upload)
+paths = {
+    "plain sendfile": ({"plain_data_users": ["root"]}, False, False),
+    "plain copy": ({"plain_data_users": ["root"], "use_sendfile": False, **SMALL_BUFFERS}, False, False),
+    "plain copy 1M": ({"plain_data_users": ["root"], "use_sendfile": False, **BIG_BUFFERS}, False, False),
+    "tls": (SMALL_BUFFERS, True, False),
+    "tls 1M": (BIG_BUFFERS, True, False),
+    "tls upload": (SMALL_BUFFERS, True, True),
+    "tls upload 1M": (BIG_BUFFERS, True, True),
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime, in clock ticks
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def kernel_tls_available() -> bool:
+    try:
+        with open("/proc/sys/net/ipv4/tcp_available_ulp") as f:
+            return "tls" in f.read().split()
+    except OSError:
+        return False
+
+def run_path(settings, use_tls, upload, size):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        with open("big.bin", "wb") as f:
+            chunk = os.urandom(1024 * 1024)
+            for _ in range(size // len(chunk)):
+                f.write(chunk)
+        port = free_port()
+        jmod.store("settings.json").write(dict(data_tables.SETTINGS_DT, port=port, autofind_port=False, RootPassword="bench", **settings))
+
+        pool = ftps.run()
+        try:
+            client = ftplib.FTP_TLS(context=ssl._create_unverified_context())
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    client.connect("127.0.0.1", port, timeout=30)
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.2)
+            client.login("root", "bench")
+            if use_tls:
+                client.prot_p()
+
+            received = 0
+            def count(data):
+                nonlocal received
+                received += len(data)
+
+            server_pid = next(iter(pool.workers.values())).pid
+            cpu_start = cpu_seconds(server_pid)
+            start = time.perf_counter()
+            if upload:
+                with open("big.bin", "rb") as f:
+                    client.storbinary("STOR upload.bin", f, blocksize=1024 * 1024)
+                received = os.path.getsize("upload.bin")
+            else:
+                client.retrbinary("RETR big.bin", count, blocksize=256 * 1024)
+            elapsed = time.perf_counter() - start
+            cpu = cpu_seconds(server_pid) - cpu_start
+            client.quit()
+            if received != size:
+                raise RuntimeError(f"Transferred {received} of {size} bytes")
+            return size / elapsed / 1024 ** 2, cpu / (size / 1024 ** 3)
+        finally:
+            pool.kill()
+            os.chdir("/")
+
+def main():
+    size = (int(sys.argv[1]) if len(sys.argv) > 1 else SIZE_MB) * 1024 * 1024
+    results = [(name, *run_path(settings, use_tls, upload, size)) for name, (settings, use_tls, upload) in paths.items()]
+    print(f"Kernel TLS available: {'yes' if kernel_tls_available() else 'no'}")
+    print(f"{'path':<16}{'MB/s':>10}{'CPU s/GB':>10}")
+    for name, rate, cpu_per_gb in results:
+        print(f"{name:<16}{rate:>10,.0f}{cpu_per_gb:>10.2f}")
+
+if __name__ == "__main__":
+    main()
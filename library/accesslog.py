@@ -0,0 +1,246 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import multiprocessing
+import threading
+import logging
+import json
+import gzip
+import time
+import os
+
+class AccessLogger:
+    """
+    Logs a server process' sessions and transfers to the console's access log.
+
+    Records go on a multiprocessing Queue through a QueueHandler, which only builds the record.
+    The writing is done by the console's AccessLog, so the serving loop never waits for the disk.
+    """
+    def __init__(self, queue=None, worker_id=None):
+        """
+        Args:
+            queue (multiprocessing.Queue): The console's AccessLog.queue. None logs nothing.
+            worker_id (int): The pool worker the process is, or None.
+        """
+        self.worker_id = worker_id
+        self.logger = None
+        if queue is not None:
+            self.logger = logging.getLogger(f"pytrain.access.{os.getpid()}")
+            self.logger.handlers = [QueueHandler(queue)]
+            self.logger.setLevel(logging.INFO)
+            # The records are only for the access log, not the console
+            self.logger.propagate = False
+
+    def log(self, event, handler, **fields) -> None:
+        """
+        Logs an event of a session.
+
+        Args:
+            event (str): What happened, e.g. "connect", "login", "login_failed", "transfer" or "disconnect".
+            handler (FTPHandler): The session's control connection.
+            **fields: The event's details.
+        """
+        if self.logger is None:
+            return
+        session = getattr(handler, "session", None)
+        record = {
+            "time": time.time(),
+            "event": event,
+            "session": session.id if session is not None else None,
+            "worker_id": self.worker_id,
+            "remote_ip": handler.remote_ip,
+            "remote_port": handler.remote_port,
+            "username": handler.username or None,
+            **fields,
+        }
+        self.logger.info(event, extra={"access": record})
+
+    def transfer(self, handler, cmd, filename, receive, completed, elapsed, bytes) -> None:
+        """
+        Logs a finished or aborted file transfer, with what xferlog lines need.
+        """
+        self.log(
+            "transfer", handler,
+            command=cmd,
+            file=filename,
+            direction="upload" if receive else "download",
+            completed=bool(completed),
+            seconds=elapsed,
+            bytes=bytes,
+            type="ascii" if getattr(handler, "_current_type", "i") == "a" else "binary",
+            anonymous=handler.username == "anonymous",
+            secure=bool(getattr(handler, "_prot", False)),
+        )
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats access log records as JSON lines.
+    """
+    def format(self, record):
+        return json.dumps(record.access, separators=(",", ":"), default=str)
+
+class XferlogFormatter(logging.Formatter):
+    """
+    Formats transfer records as lines of wu-ftpd's xferlog, which log analysers read.
+    """
+    def format(self, record):
+        access = record.access
+        return " ".join((
+            time.strftime("%a %b %d %H:%M:%S %Y", time.localtime(access["time"])),
+            str(round(access["seconds"])),
+            access["remote_ip"],
+            str(access["bytes"]),
+            # Fields are separated by spaces, so they can't have any
+            "_".join(str(access["file"]).split()) or "_",
+            "a" if access["type"] == "ascii" else "b",
+            "_",
+            "i" if access["direction"] == "upload" else "o",
+            "a" if access["anonymous"] else "r",
+            access["username"] or "*",
+            "ftp",
+            "0",
+            "*",
+            "c" if access["completed"] else "i",
+        ))
+
+def transfers_only(record) -> bool:
+    return record.access["event"] == "transfer"
+
+class RotatingAccessLogHandler(RotatingFileHandler):
+    """
+    Writes a log file, rotated once it reaches max_bytes or is interval seconds old, whichever is first.
+
+    Rotated files are named like RotatingFileHandler's ("access.log.1" is the newest), with ".gz"
+    added when they are compressed.
+    """
+    def __init__(self, filename, max_bytes=0, interval=0, backup_count=0, compress=True):
+        """
+        Args:
+            filename (str): The log file.
+            max_bytes (int): Size to rotate at. 0 doesn't rotate by size.
+            interval (int): Seconds to rotate after. 0 doesn't rotate by time.
+            backup_count (int): Rotated files kept. Rotation needs at least 1.
+            compress (bool): Gzip rotated files.
+        """
+        if not backup_count:
+            # There is nowhere to rotate to, so the file just grows
+            max_bytes = interval = 0
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.interval = interval
+        self.compress = compress
+        self.rollover_at = self._next_rollover()
+
+    def _next_rollover(self):
+        if not self.interval:
+            return None
+        try:
+            # The file's age counts, so restarts don't put off its rotation
+            started = os.stat(self.baseFilename).st_mtime
+        except OSError:
+            started = time.time()
+        return min(started, time.time()) + self.interval
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at and self.backupCount:
+            if os.path.isfile(self.baseFilename) and os.path.getsize(self.baseFilename):
+                return True
+            self.rollover_at = time.time() + self.interval
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+    def rotation_filename(self, default_name):
+        return default_name + ".gz" if self.compress else default_name
+
+    def rotate(self, source, dest):
+        if not self.compress:
+            super().rotate(source, dest)
+            return
+        if os.path.exists(source):
+            with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+                while chunk := f_in.read(1024 * 1024):
+                    f_out.write(chunk)
+            os.remove(source)
+
+class AccessLog:
+    """
+    The access and transfer log the console writes for every server process.
+
+    Server processes are given queue when they start, and log to it with an AccessLogger. A
+    QueueListener thread in the console writes the records to the file, so rotating and
+    compressing it happens here, and once, rather than in each server process.
+    """
+    # Settings keys, and the start() argument each one sets
+    settings = {
+        "access_log": "path",
+        "access_log_format": "log_format",
+        "access_log_max_bytes": "max_bytes",
+        "access_log_rotate_interval": "interval",
+        "access_log_backups": "backup_count",
+        "access_log_compress": "compress",
+    }
+    formats = {
+        "json": JSONFormatter,
+        "xferlog": XferlogFormatter,
+    }
+
+    def __init__(self):
+        self.queue = multiprocessing.Queue()
+        self.config = None
+        self._listener = None
+        self._handler = None
+
+    def start(self, path="", log_format="json", max_bytes=0, interval=0, backup_count=0, compress=True) -> None:
+        """
+        Starts writing the log, or starts over with new settings. Records queued meanwhile are kept.
+
+        Args:
+            path (str): The log file. "" writes nothing, and drops the records.
+            log_format (str): A key of formats. "xferlog" only has transfers.
+            max_bytes, interval, backup_count, compress: See RotatingAccessLogHandler.
+        """
+        config = (path, log_format, max_bytes, interval, backup_count, compress)
+        if self._listener is not None and config == self.config:
+            return
+        self.stop()
+        self.config = config
+        if log_format not in self.formats:
+            print(f"Unknown access_log_format '{log_format}'. Expected one of {', '.join(self.formats)}. Using 'json'.")
+            log_format = "json"
+        if path:
+            directory = os.path.dirname(path)
+            try:
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                handler = RotatingAccessLogHandler(path, max_bytes, interval, backup_count, compress)
+            except OSError as err:
+                print(f"Could not open the access log {path}: {err}")
+                handler = logging.NullHandler()
+            handler.setFormatter(self.formats[log_format]())
+            if log_format == "xferlog":
+                handler.addFilter(transfers_only)
+        else:
+            handler = logging.NullHandler()
+        self._handler = handler
+        self._listener = QueueListener(self.queue, handler)
+        self._listener.start()
+
+    def stop(self, timeout=5.0) -> None:
+        """
+        Writes the records already queued, and stops.
+
+        Args:
+            timeout (float): Seconds to wait for the records to be written.
+        """
+        listener, self._listener = self._listener, None
+        if listener is None:
+            return
+        # A server process killed while putting a record can leave the queue unreadable, which mustn't hang the console
+        stopper = threading.Thread(target=listener.stop, daemon=True)
+        stopper.start()
+        stopper.join(timeout)
+        if stopper.is_alive():
+            self.queue = multiprocessing.Queue()
+        self._handler.close()
+        self._handler = None
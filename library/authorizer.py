@@ -0,0 +1,234 @@
+from library.passwords import VerifyCache, hash_password, is_hashed
+from collections import OrderedDict
+import collections.abc
+import contextlib
+import threading
+import sqlite3
+import json
+import os
+
+from pyftpdlib.authorizers import DummyAuthorizer, AuthenticationFailed
+
+class UserIndex(collections.abc.MutableMapping):
+    """
+    A user table for pyftpdlib authorizers, stored in SQLite instead of in memory.
+
+    It behaves like the dict DummyAuthorizer keeps in user_table, keyed by username, but rows
+    are only loaded when a user is looked up (usually when they log in), through a primary
+    key lookup. The most recently used records are kept in an LRU cache.
+
+    It also keeps small values in a meta table (see get_meta()), e.g. UserSync's token of the
+    settings it last synced, so a restarted server only applies what changed meanwhile.
+
+    The database is only readable by its owner (0600). SQLite makes its -wal and -shm files
+    with the same mode.
+    """
+    def __init__(self, index_file, cache_size=1024):
+        """
+        Args:
+            index_file (str): The file path of the SQLite database.
+            cache_size (int): How many user records to keep in memory.
+        """
+        self.index_file = index_file
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # SQLite connections can't be shared between threads, and ThreadedFTPServer logs users in from many
+        self._local = threading.local()
+        self._batch_depth = 0
+
+        parent_dir = os.path.dirname(index_file)
+        if parent_dir != "":
+            os.makedirs(parent_dir, exist_ok=True)
+        os.close(os.open(index_file, os.O_RDWR | os.O_CREAT, 0o600))
+        for path in (index_file, f"{index_file}-wal", f"{index_file}-shm"):
+            # Indexes made before this were world readable
+            try:
+                os.chmod(path, 0o600)
+            except FileNotFoundError:
+                pass
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "username TEXT PRIMARY KEY, record TEXT NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID")
+        # Old versions of pages stay in the WAL until it is checkpointed. Done on start, so rows replaced last time are gone
+        self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # A connection must not be used from a forked worker, so each process opens its own
+            conn = sqlite3.connect(self.index_file)
+            self._local.pid = os.getpid()
+            # WAL lets the login threads read while the IO loop thread writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Overwrites deleted rows, so replaced passwords don't linger in free pages
+            conn.execute("PRAGMA secure_delete=ON")
+            self._local.conn = conn
+        return conn
+
+    def _commit(self):
+        if self._batch_depth == 0:
+            self._connect().commit()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Commits every change made inside the with block in a single SQLite transaction.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._connect().rollback()
+                with self._cache_lock:
+                    self._cache.clear()
+            raise
+        self._batch_depth -= 1
+        self._commit()
+
+    def __getitem__(self, username):
+        with self._cache_lock:
+            record = self._cache.get(username)
+            if record is not None:
+                self._cache.move_to_end(username)
+                return record
+
+        row = self._connect().execute("SELECT record FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            raise KeyError(username)
+        record = json.loads(row[0])
+
+        with self._cache_lock:
+            self._cache[username] = record
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return record
+
+    def __setitem__(self, username, record):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO users (username, record) VALUES (?, ?)",
+            (username, json.dumps(record))
+        )
+        self._commit()
+        with self._cache_lock:
+            self._cache.pop(username, None)
+
+    def __delitem__(self, username):
+        cursor = self._connect().execute("DELETE FROM users WHERE username = ?", (username,))
+        self._commit()
+        with self._cache_lock:
+            self._cache.pop(username, None)
+        if cursor.rowcount == 0:
+            raise KeyError(username)
+
+    def __contains__(self, username):
+        with self._cache_lock:
+            if username in self._cache:
+                return True
+        row = self._connect().execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        for row in self._connect().execute("SELECT username FROM users"):
+            yield row[0]
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def items(self):
+        """
+        Iterates over every (username, record) pair with one query, without filling the cache.
+        """
+        for username, record in self._connect().execute("SELECT username, record FROM users"):
+            yield username, json.loads(record)
+
+    def forget(self, usernames=None):
+        """
+        Drops users from the cache, e.g. after another process sharing the index changed their records.
+
+        Args:
+            usernames: The usernames to drop. None drops every user.
+        """
+        with self._cache_lock:
+            if usernames is None:
+                self._cache.clear()
+                return
+            for username in usernames:
+                self._cache.pop(username, None)
+
+    def get_meta(self, key, default=None):
+        """
+        Returns a value saved with set_meta(), or default if there is none.
+        """
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def set_meta(self, key, value):
+        """
+        Saves a JSON value under a key, with the next commit of a batch() if inside one.
+        """
+        self._connect().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        self._commit()
+
+class PyTrainAuthorizer(DummyAuthorizer):
+    """
+    A DummyAuthorizer whose user table is a UserIndex, so it scales to a large number of users.
+
+    The index persists between restarts, so the server doesn't need to re-add every user when
+    it starts. Only password hashes are stored in it: plaintext passwords (e.g. RootPassword, or
+    users from before hashing was supported) are hashed by add_user() and stored_password().
+    Successful logins are remembered in a VerifyCache so clients that log in over and over
+    don't pay for the slow hash each time.
+    """
+    def __init__(self, index_file, cache_size=1024, verify_cache_size=4096, verify_cache_ttl=300, hash_algorithm="pbkdf2"):
+        """
+        Args:
+            index_file (str): The file path of the SQLite user index.
+            cache_size (int): How many user records to keep in memory.
+            verify_cache_size (int): How many verified logins to remember. 0 disables the cache.
+            verify_cache_ttl (float): Seconds a verified login is remembered.
+            hash_algorithm (str): How plaintext passwords are hashed, "pbkdf2" or "scrypt".
+        """
+        super().__init__()
+        self.user_table = UserIndex(index_file, cache_size=cache_size)
+        self.verify_cache = VerifyCache(max_size=verify_cache_size, ttl=verify_cache_ttl)
+        self.hash_algorithm = hash_algorithm
+
+    def stored_password(self, password) -> str:
+        """
+        Returns:
+            str: What is stored in the index for a password: the password itself if it is already hashed, or else its hash.
+        """
+        password = str(password)
+        if password == "" or is_hashed(password):
+            # The anonymous user has no password
+            return password
+        return hash_password(password, algorithm=self.hash_algorithm)
+
+    def add_user(self, username, password, homedir, perm='elr', msg_login="Login successful.", msg_quit="Goodbye."):
+        """
+        Adds a user like DummyAuthorizer.add_user, storing a hash of a plaintext password.
+        """
+        super().add_user(username, self.stored_password(password), homedir, perm, msg_login, msg_quit)
+
+    def validate_authentication(self, username, password, handler):
+        """
+        Raises AuthenticationFailed if the password doesn't match the stored (hashed or plaintext) one.
+        """
+        msg = "Authentication failed."
+        try:
+            user = self.user_table[username]
+        except KeyError:
+            if username == 'anonymous':
+                msg = "Anonymous access not allowed."
+            raise AuthenticationFailed(msg)
+        if username != 'anonymous':
+            if not self.verify_cache.verify(username, user['pwd'], password):
+                raise AuthenticationFailed(msg)
@@ -0,0 +1,267 @@
+from library.watcher import SettingsWatcher
+from library.jmod import FileLock
+import datetime
+import tempfile
+import logging
+import time
+import os
+
+# The key types generate() can make. ECDSA P-256 and Ed25519 keys make TLS handshakes much cheaper than RSA
+key_types = ("ecdsa", "ed25519", "rsa")
+
+def _write_atomic(path, data, mode):
+    """
+    Writes a file through a temporary file and a rename, so it is never seen half written.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class CertManager:
+    """
+    Looks after the server's self-signed TLS certificate and private key.
+
+    The certificate is generated when it is missing, and again once it is within renew_days of
+    expiring. refresh() is meant to be called on a timer by the FTP server: it renews the
+    certificate when due, and loads a new certificate into the handler (made by this or any
+    other process) without restarting the server. Connections that are already open keep
+    the certificate they started with.
+
+    cryptography is only imported to generate a certificate, or to read the expiry of one that
+    hasn't been read before. The expiry is kept in a stamp file next to the certificate, which is
+    used for as long as the certificate file is unchanged, so starting up doesn't need it.
+    """
+    def __init__(self, certfile, keyfile, key_type="ecdsa", valid_days=365, renew_days=30, check_interval=3600, hostname="localhost", profile=None):
+        """
+        Args:
+            certfile (str): The file path of the certificate.
+            keyfile (str): The file path of the private key.
+            key_type (str): "ecdsa" (P-256), "ed25519" or "rsa" (2048 bit), used for new keys.
+            valid_days (int): How many days a new certificate is valid for.
+            renew_days (int): How many days before it expires the certificate is renewed.
+            check_interval (float): The minimum number of seconds between two expiry checks in refresh().
+            hostname (str): The common name of the certificate.
+            profile (TLSProfile): The TLS settings applied to the contexts made by make_context().
+        """
+        if key_type not in key_types:
+            raise ValueError(f"Unknown key type '{key_type}'. Use one of {', '.join(key_types)}.")
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.key_type = key_type
+        self.valid_days = valid_days
+        self.renew_days = renew_days
+        self.check_interval = check_interval
+        self.hostname = hostname
+        self.profile = profile
+        self._last_check = time.monotonic()
+        self._watcher = None
+
+    def _make_dirs(self):
+        for path in (self.certfile, self.keyfile):
+            parent_dir = os.path.dirname(path)
+            if parent_dir != "":
+                os.makedirs(parent_dir, exist_ok=True)
+
+    def _make_key(self):
+        from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+        if self.key_type == "ed25519":
+            return ed25519.Ed25519PrivateKey.generate()
+        elif self.key_type == "rsa":
+            return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        return ec.generate_private_key(ec.SECP256R1())
+
+    def generate(self) -> None:
+        """
+        Generates a new private key and self-signed certificate, replacing the current ones.
+        """
+        from cryptography.hazmat.primitives import serialization, hashes
+        from cryptography.x509.oid import NameOID
+        from cryptography import x509
+
+        key = self._make_key()
+        name = x509.Name([
+            x509.NameAttribute(NameOID.COMMON_NAME, u"{}".format(self.hostname)),
+        ])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = x509.CertificateBuilder().subject_name(
+            name
+        ).issuer_name(
+            name
+        ).public_key(
+            key.public_key()
+        ).serial_number(
+            x509.random_serial_number()
+        ).not_valid_before(
+            now
+        ).not_valid_after(
+            now + datetime.timedelta(days=self.valid_days)
+        ).sign(key, None if self.key_type == "ed25519" else hashes.SHA256()) # Ed25519 signs without a separate hash
+
+        self._make_dirs()
+        # The key is written first, so a process that sees the new certificate always finds its key
+        _write_atomic(self.keyfile, key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        ), 0o600)
+        _write_atomic(self.certfile, cert.public_bytes(serialization.Encoding.PEM), 0o644)
+        # Certificates keep whole seconds
+        self._write_stamp((now + datetime.timedelta(days=self.valid_days)).replace(microsecond=0))
+
+    def _stamp_key(self):
+        # The certificate file's identity, which a stamp is only valid for
+        stat = os.stat(self.certfile)
+        return f"{stat.st_mtime_ns} {stat.st_size}"
+
+    def _write_stamp(self, expires):
+        try:
+            _write_atomic(f"{self.certfile}.expires", f"{self._stamp_key()} {expires.timestamp()}".encode(), 0o644)
+        except OSError:
+            # Only a cache. The certificate is read again next time
+            pass
+
+    def _read_stamp(self):
+        try:
+            with open(f"{self.certfile}.expires") as f:
+                key, _, timestamp = f.read().strip().rpartition(" ")
+            if key != self._stamp_key():
+                return None
+            return datetime.datetime.fromtimestamp(float(timestamp), datetime.timezone.utc)
+        except (OSError, ValueError):
+            return None
+
+    def expires(self) -> datetime.datetime:
+        """
+        Returns:
+            datetime.datetime: When the current certificate expires (UTC), or None if it is missing or unreadable.
+        """
+        expires = self._read_stamp()
+        if expires is not None:
+            return expires
+        from cryptography import x509
+
+        try:
+            with open(self.certfile, "rb") as f:
+                cert = x509.load_pem_x509_certificate(f.read())
+        except (OSError, ValueError):
+            return None
+        expires = getattr(cert, "not_valid_after_utc", None)
+        if expires is None:
+            # cryptography before 42 only has the naive datetime
+            expires = cert.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+        self._write_stamp(expires)
+        return expires
+
+    def needs_renewal(self) -> bool:
+        """
+        Whether the certificate or key is missing, or the certificate expires within renew_days.
+        """
+        if not os.path.isfile(self.keyfile):
+            return True
+        expires = self.expires()
+        if expires is None:
+            return True
+        return expires - datetime.datetime.now(datetime.timezone.utc) <= datetime.timedelta(days=self.renew_days)
+
+    def renew(self, force=False) -> bool:
+        """
+        Generates a new certificate while holding the certificate lock, so it never races another process renewing it.
+
+        Args:
+            force (bool): Generate one even if the current certificate isn't due for renewal.
+        Returns:
+            bool: True if a new certificate was generated.
+        Raises:
+            TimeoutError: If another process held the lock for too long.
+        """
+        self._make_dirs()
+        lock = FileLock(f"{self.certfile}.lock")
+        with lock.hold(exclusive=True):
+            # Another process may have renewed it while we waited for the lock
+            if not force and not self.needs_renewal():
+                return False
+            print(f"Generating a new {self.key_type.upper()} TLS certificate...", flush=True)
+            self.generate()
+        return True
+
+    def ensure(self) -> bool:
+        """
+        Generates a new certificate if needs_renewal().
+        Several processes may call this at once, only one of them generates it.
+
+        Returns:
+            bool: True if a new certificate was generated.
+        """
+        if not self.needs_renewal():
+            return False
+        return self.renew()
+
+    def make_context(self, handler):
+        """
+        Makes a pyOpenSSL context with the current certificate, for a TLS_FTPHandler.
+
+        Args:
+            handler: The TLS_FTPHandler class, whose ssl_protocol and ssl_options are used.
+        Returns:
+            OpenSSL.SSL.Context: The context.
+        """
+        from OpenSSL import SSL
+
+        context = SSL.Context(handler.ssl_protocol)
+        context.use_certificate_chain_file(self.certfile)
+        context.use_privatekey_file(self.keyfile)
+        context.check_privatekey()
+        if handler.ssl_options:
+            context.set_options(handler.ssl_options)
+        if self.profile is not None:
+            self.profile.apply(context)
+        return context
+
+    def load(self, handler) -> None:
+        """
+        Sets the handler's ssl_context to the current certificate.
+        """
+        # Started before loading, so a certificate replaced in between is picked up by the next refresh()
+        self._watcher = SettingsWatcher(self.certfile)
+        handler.ssl_context = self.make_context(handler)
+
+    def refresh(self, handler) -> bool:
+        """
+        Renews the certificate if it is due, and loads it into the handler if the certificate file changed.
+
+        Args:
+            handler: The TLS_FTPHandler class given to load().
+        Returns:
+            bool: True if a new certificate was loaded.
+        """
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            try:
+                self.ensure()
+            except (OSError, TimeoutError) as err:
+                logging.error(f"Could not renew the TLS certificate: {err}")
+
+        if self._watcher is None or not self._watcher.changed():
+            return False
+        from OpenSSL import SSL
+        try:
+            handler.ssl_context = self.make_context(handler)
+        except (OSError, SSL.Error) as err:
+            # Keep serving with the current certificate, and try again when the file next changes
+            logging.error(f"Could not load the new TLS certificate: {err}")
+            return False
+        logging.info(f"Loaded a new TLS certificate, which expires on {self.expires()}.")
+        return True
@@ -0,0 +1,159 @@
+import multiprocessing
+import threading
+import logging
+
+class ControlServer:
+    """
+    Answers the console's requests inside a server process.
+
+    The console and each server process share a multiprocessing Pipe, made when the process is
+    started. Requests are dicts with a "command" key and the command's arguments, and each gets
+    one reply dict with "ok" set, and "error" set when it is False. A daemon thread waits for
+    requests, so a busy server loop doesn't hold up the console. Commands are called on that
+    thread, unless they are registered to run on the server loop, which they must be if they
+    change the server or its connections.
+    """
+    # Seconds to wait for the server loop to run a command. It wakes at least every poll interval
+    loop_timeout = 4.0
+
+    def __init__(self, conn, ioloop, worker_id=None):
+        """
+        Args:
+            conn (multiprocessing.connection.Connection): The server process' end of the pipe.
+            ioloop (pyftpdlib.ioloop.IOLoop): The server loop, which runs commands registered with on_loop.
+            worker_id (int): The pool worker the process is, or None.
+        """
+        self.conn = conn
+        self.ioloop = ioloop
+        self.worker_id = worker_id
+        self.commands = {}
+        self._thread = None
+        # Held while a request is answered
+        self._busy = threading.Lock()
+
+    def register(self, name, function, on_loop=False) -> None:
+        """
+        Adds a command.
+
+        Args:
+            name (str): The command's name.
+            function (callable): Called with the request's other keys. Returns a dict merged into the reply.
+            on_loop (bool): Run it on the server loop rather than the control thread.
+        """
+        self.commands[name] = (function, on_loop)
+
+    def _run_on_loop(self, function, args):
+        done = threading.Event()
+        result = {}
+
+        def run():
+            try:
+                result["reply"] = function(**args)
+            except Exception as err:
+                result["error"] = err
+            finally:
+                done.set()
+
+        self.ioloop.call_later(0, run)
+        if not done.wait(self.loop_timeout):
+            raise TimeoutError("The server loop didn't get to the command in time")
+        if "error" in result:
+            raise result["error"]
+        return result["reply"]
+
+    def start(self) -> None:
+        """
+        Starts answering requests.
+        """
+        self._thread = threading.Thread(target=self._serve, name="ControlServer", daemon=True)
+        self._thread.start()
+
+    def handle(self, request) -> dict:
+        """
+        Runs a request's command.
+
+        Args:
+            request (dict): The request.
+        Returns:
+            dict: The reply.
+        """
+        args = dict(request)
+        name = args.pop("command", None)
+        if name not in self.commands:
+            return {"ok": False, "error": f"Unknown command '{name}'", "worker_id": self.worker_id}
+        function, on_loop = self.commands[name]
+        try:
+            reply = (self._run_on_loop(function, args) if on_loop else function(**args)) or {}
+        except Exception as err:
+            logging.exception(f"Control command '{name}' failed")
+            return {"ok": False, "error": str(err), "worker_id": self.worker_id}
+        return {"ok": True, "worker_id": self.worker_id, **reply}
+
+    def _serve(self):
+        while True:
+            try:
+                request = self.conn.recv()
+            except (EOFError, OSError):
+                # The console closed its end, so there is no one left to answer
+                return
+            with self._busy:
+                try:
+                    self.conn.send(self.handle(request))
+                except (EOFError, OSError):
+                    return
+
+    def flush(self, timeout=2.0) -> None:
+        """
+        Waits for the request being answered, if any, e.g. so "shutdown" is answered before the process exits.
+        """
+        if self._busy.acquire(timeout=timeout):
+            self._busy.release()
+
+class ControlClient:
+    """
+    The console's end of the pipe to one server process.
+    """
+    def __init__(self, conn):
+        """
+        Args:
+            conn (multiprocessing.connection.Connection): The console's end of the pipe.
+        """
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pipe():
+        """
+        Makes a pipe between the console and a server process.
+
+        Returns:
+            tuple: The ControlClient for the console, and the Connection to give to the server process.
+        """
+        console_end, server_end = multiprocessing.Pipe()
+        return ControlClient(console_end), server_end
+
+    def request(self, command, timeout=5.0, **args) -> dict:
+        """
+        Sends a command and waits for its reply.
+
+        Args:
+            command (str): The command's name.
+            timeout (float): Seconds to wait for the reply.
+            **args: The command's arguments.
+        Returns:
+            dict: The reply. "ok" is False, with an "error", if the process didn't answer.
+        """
+        with self._lock:
+            try:
+                # Replies that came too late for an earlier request are dropped
+                while self.conn.poll():
+                    self.conn.recv()
+                self.conn.send({"command": command, **args})
+                if not self.conn.poll(timeout):
+                    return {"ok": False, "error": "The server process didn't answer in time"}
+                return self.conn.recv()
+            except (EOFError, OSError) as err:
+                return {"ok": False, "error": f"The server process can't be reached: {err}"}
+
+    def close(self) -> None:
+        self.conn.close()
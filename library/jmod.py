@@ -1,4 +1,8 @@
-import os, json, inspect, logging, random
+import os, re, json, inspect, logging, random, threading, functools, contextlib, tempfile, time
+try:
+    import fcntl
+except ImportError: # Windows has no fcntl, so file locking is skipped there
+    fcntl = None
 
 def gen_random_password():
     """
@@ -12,8 +16,60 @@ class data_tables:
         "RootPassword": gen_random_password(),
         "port": 6464,
         "autofind_port": True, # If port is in use, will find a new one
+        "port_range": 100, # How many ports, starting from port, autofind_port tries
+        "server_mode": "threaded", # "threaded" (a thread per connection), "async" (one thread for all), "prefork" (async, forked into several processes) or "pool" (async, in several processes sharing the port)
+        "server_workers": 0, # Worker processes for the "prefork" and "pool" server_modes. 0 uses one per CPU core
+        "settings_poll_interval": 1.0, # Seconds between checks of the settings file for changes
+        "user_index_file": "library/users.db", # SQLite index the FTP server looks users up in
+        "user_cache_size": 1024, # How many users the FTP server keeps in memory
+        "password_hash": "pbkdf2", # How new passwords are hashed, "pbkdf2" or "scrypt"
+        "password_cache_size": 4096, # How many verified logins are remembered, so they skip the slow hash. 0 to disable
+        "password_cache_ttl": 300, # Seconds a verified login is remembered
         "certfile": "library/ssl/certificate.pem",
         "keyfile": "library/ssl/private.key",
+        "tls_key_type": "ecdsa", # Key type of new certificates, "ecdsa" (P-256), "ed25519" or "rsa"
+        "cert_valid_days": 365, # How long new certificates are valid for
+        "cert_renew_days": 30, # Renew the certificate this many days before it expires
+        "cert_check_interval": 3600, # Seconds between checks of the certificate's expiry
+        "tls_min_version": "TLSv1.2", # Oldest TLS version allowed, "TLSv1.2" or "TLSv1.3"
+        "tls_ciphers": "", # OpenSSL cipher list for TLS 1.2. Empty uses OpenSSL's default
+        "tls13_ciphers": "", # OpenSSL ciphersuites for TLS 1.3. Empty uses OpenSSL's default
+        "tls_session_cache": True, # Let data connections resume the control connection's TLS session
+        "tls_session_timeout": 300, # Seconds a TLS session can be resumed for
+        "tls_tickets": True, # Allow TLS session tickets
+        "tls_ktls": True, # Let the kernel do TLS encryption where it and OpenSSL support it, so TLS downloads can use sendfile()
+        "tls_lazy_listings": False, # Allow directory listings over a plaintext data connection. File transfers still need TLS
+        "transfer_buffer_size": 65536, # Bytes sent or received per call on data connections. Users may override it in their entry
+        "read_ahead_size": 1048576, # Bytes read from a file per call when sending it. Users may override it in their entry
+        "socket_sndbuf": 0, # SO_SNDBUF of data connections. 0 keeps the OS default. Users may override it in their entry
+        "socket_rcvbuf": 0, # SO_RCVBUF of data connections. 0 keeps the OS default. Users may override it in their entry
+        "download_limit": 0, # Bytes per second sent by the whole server, shared by the server processes. 0 is no limit
+        "upload_limit": 0, # Bytes per second received by the whole server, shared by the server processes. 0 is no limit
+        "user_download_limit": 0, # Bytes per second sent to each user, shared by the server processes. Users may override it in their entry or permission set
+        "user_upload_limit": 0, # Bytes per second received from each user, shared by the server processes. Users may override it in their entry or permission set
+        "ip_download_limit": 0, # Bytes per second sent to each client IP address, shared by the server processes. 0 is no limit
+        "ip_upload_limit": 0, # Bytes per second received from each client IP address, shared by the server processes. 0 is no limit
+        "max_cons": 512, # Connections the whole server accepts at once. 0 is no limit
+        "max_cons_per_ip": 0, # Connections each client IP address may have open at once, per server process. 0 is no limit
+        "max_sessions_per_user": 0, # Sessions each user may have logged in at once, per server process. Users may override it in their entry or permission set
+        "idle_timeout": 300, # Seconds a client may stay connected without sending a command. 0 never disconnects idle clients
+        "drain_timeout": 600, # Seconds a drained or restarted server lets transfers finish before disconnecting their clients. 0 waits for them
+        "metrics_port": 0, # Port the console serves Prometheus metrics on, at /metrics. 0 doesn't serve them
+        "metrics_host": "127.0.0.1", # Address the metrics are served on. The default only lets this machine scrape them
+        "access_log": "logs/access.log", # File the console writes every session's logins and transfers to. "" doesn't write one
+        "access_log_format": "json", # "json" writes a JSON object per event, "xferlog" writes transfers only, as wu-ftpd's xferlog lines
+        "access_log_max_bytes": 10485760, # Size the access log is rotated at. 0 doesn't rotate it by size
+        "access_log_rotate_interval": 86400, # Seconds the access log is rotated after. 0 doesn't rotate it by time
+        "access_log_backups": 14, # Rotated access logs kept. 0 never rotates the access log
+        "access_log_compress": True, # Gzip rotated access logs
+        "telemetry_enabled": False, # Send error reports and performance traces to Sentry. sentry_sdk is only loaded when this is on
+        "telemetry_dsn": "", # Sentry DSN the telemetry is sent to. Nothing is sent until one is set
+        "telemetry_sample_rates": {"transfer": 0.01, "listing": 0.01, "login": 0.05, "control": 0.0, "default": 0.0}, # Share of FTP commands traced, by category
+        "telemetry_profiles_sample_rate": 0.0, # Share of traced commands that are also profiled
+        "use_sendfile": True, # Send plain downloads with sendfile(), straight from the page cache. Turn off for filesystems that don't support it
+        "plain_data_users": [], # Users whose data connections may skip TLS, e.g. "anonymous". Plain downloads use sendfile()
+        "plain_data_networks": [], # Networks whose clients' data connections may skip TLS, e.g. "10.0.0.0/8"
+        "plain_data_dirs": [], # Directories whose files may be downloaded and listed without TLS on the data connection
         "permission_sets": {},
         "PyTrain_users": {}
     }
@@ -38,8 +94,583 @@ class data_tables:
             "home_dir": home_dir if home_dir != "<>local_user<>" else f"ftp_dir/{username}",
         }
 
-class jmod:    
-    def getvalue(key, json_dir, default=None, dt=None):
+def _copy(value):
+    """
+    Copy a parsed JSON value so callers can't mutate the cached document.
+    Only dicts and lists need copying, everything else in JSON is immutable.
+    """
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+def file_signature(path):
+    """
+    Returns a tuple identifying the current version of a file, or None if it does not exist.
+    Its modification time, size and inode, so a file replaced by a rename is seen to change too.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def new_lock_stats() -> dict:
+    """
+    Returns the counters a store keeps on waiting for its lock, as jmod.lock_stats() reports them.
+    """
+    return {
+        "acquired": 0,
+        "timeouts": 0,
+        "wait_seconds_total": 0.0,
+        "wait_seconds_max": 0.0,
+    }
+
+def record_lock_wait(stats, waited):
+    """
+    Counts a lock taken after waiting for the given number of seconds.
+    """
+    stats["acquired"] += 1
+    stats["wait_seconds_total"] += waited
+    stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+
+def _split_unescaped(text, separator):
+    """
+    Splits text at each separator that isn't escaped with a backslash. Escapes are kept, to be undone last.
+    """
+    parts = []
+    current = []
+    index = 0
+    while index < len(text):
+        if text[index] == "\\" and index + 1 < len(text):
+            current.append(text[index:index + 2])
+            index += 2
+            continue
+        if text[index] == separator:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(text[index])
+        index += 1
+    parts.append("".join(current))
+    return parts
+
+class KeyPath:
+    """
+    A key in the format "parent.child1.child2[0].child3", parsed once into a tuple of steps.
+
+    Each step is either a str (a dict key) or an int (a list index). Use KeyPath.compile()
+    rather than the constructor, as it caches the parsed keys. A dict key with a ".", "[", "]"
+    or "\\" in it (e.g. a username like "john.doe") is escaped with a backslash, see escape().
+    """
+    def __init__(self, key):
+        """
+        Args:
+            key (str): The key in the format "parent.child1.child2[0].child3".
+        """
+        self.key = key
+        steps = []
+        for part in _split_unescaped(key, '.'):
+            # "child2[0][1]" is the dict key "child2" followed by the list indexes 0 and 1
+            name, *indexes = _split_unescaped(part, '[')
+            if name != "" or not indexes:
+                steps.append(re.sub(r"\\(.)", r"\1", name))
+            for index in indexes:
+                steps.append(int(index.rstrip(']')))
+        self.steps = tuple(steps)
+
+    @staticmethod
+    def escape(name) -> str:
+        """
+        Escapes a dict key so it is read as a single step, e.g. f"PyTrain_users.{KeyPath.escape(username)}".
+        """
+        return re.sub(r"([\\.\[\]])", r"\\\1", name)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def compile(key) -> "KeyPath":
+        """
+        Get the parsed KeyPath for a key, from the cache if it was parsed before.
+        """
+        return KeyPath(key)
+
+    def _not_a_key(self):
+        return KeyError(f"Key '{self.key}' is a value, not a key, or it does not exist. Is your Json File setup correctly?")
+
+    def get(self, data, default=None):
+        """
+        Get the value at this key.
+        Args:
+            data: The loaded JSON document.
+            default: The value to return if a dict key or list index is missing.
+        Returns:
+            The value at this key, or default.
+        """
+        value = data
+        for step in self.steps:
+            try:
+                value = value[step]
+            except (KeyError, IndexError):
+                return default
+            except TypeError:
+                # The key is a value. Not a key
+                raise self._not_a_key()
+        return value
+
+    def _parent(self, data, dt=None):
+        """
+        Walks to the container holding the last step, creating missing dicts on the way.
+        Missing keys are copied from dt (a document of defaults with the same layout) if it has them.
+        """
+        value = data
+        for step in self.steps[:-1]:
+            if isinstance(value, dict) and step not in value:
+                value[step] = _copy(dt[step]) if isinstance(dt, dict) and step in dt else {}
+            try:
+                value = value[step]
+                dt = dt[step] if isinstance(dt, (dict, list)) else None
+            except (KeyError, IndexError, TypeError):
+                raise self._not_a_key()
+        return value, dt
+
+    def set(self, data, value):
+        """
+        Set the value at this key, creating missing parent dicts.
+        """
+        parent, _ = self._parent(data)
+        try:
+            parent[self.steps[-1]] = value
+        except (IndexError, TypeError):
+            raise self._not_a_key()
+
+    def append(self, data, value, dt=None):
+        """
+        Append a value to the list at this key. If the key holds a single value it is turned into a list first.
+        Args:
+            data: The loaded JSON document.
+            value: The value to append.
+            dt (dict): A document of defaults used to create missing keys (default=None).
+        """
+        parent, dt = self._parent(data, dt)
+        last = self.steps[-1]
+        if isinstance(parent, dict) and last not in parent:
+            if not isinstance(dt, dict) or last not in dt:
+                raise self._not_a_key()
+            parent[last] = _copy(dt[last])
+        try:
+            if not isinstance(parent[last], list):
+                parent[last] = [parent[last]]
+            parent[last].append(value)
+        except (IndexError, TypeError):
+            raise self._not_a_key()
+
+    def remove(self, data, value):
+        """
+        Remove a value from the list at this key, if it is in it.
+        """
+        target = self.get(data)
+        if isinstance(target, list) and value in target:
+            target.remove(value)
+
+    def delete(self, data) -> bool:
+        """
+        Delete this key, if it exists.
+        Returns:
+            bool: Whether the key existed.
+        """
+        parent = data
+        for step in self.steps[:-1]:
+            try:
+                parent = parent[step]
+            except (KeyError, IndexError):
+                return False
+            except TypeError:
+                raise self._not_a_key()
+        try:
+            del parent[self.steps[-1]]
+        except (KeyError, IndexError):
+            return False
+        except TypeError:
+            raise self._not_a_key()
+        return True
+
+class FileLock:
+    """
+    An advisory lock shared between processes, taken on a sidecar "<file>.lock" file.
+
+    Readers take it shared and writers take it exclusive. It is reentrant within one
+    process, but not thread safe, so callers must serialize threads themselves (JsonStore
+    does this with its own lock). Where fcntl isn't available (Windows) it does nothing.
+    """
+    def __init__(self, path, timeout=10.0):
+        """
+        Args:
+            path (str): The file path of the lock file.
+            timeout (float): Seconds to wait for the lock before raising TimeoutError.
+        """
+        self.path = path
+        self.timeout = timeout
+        self.stats = new_lock_stats()
+        self._fd = None
+        self._pid = None
+        self._exclusive = False
+        self._count = 0
+
+    def _acquire(self, exclusive):
+        if self._fd is None or self._pid != os.getpid():
+            # A forked child shares the parent's open file, and with it the lock, so it needs its own
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+
+        start = time.monotonic()
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(self._fd, operation | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                waited = time.monotonic() - start
+                if waited >= self.timeout:
+                    self.stats["timeouts"] += 1
+                    raise TimeoutError(f"Timed out after {self.timeout}s waiting for lock \"{self.path}\".")
+                time.sleep(min(delay, self.timeout - waited))
+                delay = min(delay * 2, 0.005)
+
+        waited = time.monotonic() - start
+        record_lock_wait(self.stats, waited)
+
+    @contextlib.contextmanager
+    def hold(self, exclusive=False):
+        """
+        Holds the lock for the duration of the with block.
+        Args:
+            exclusive (bool): Take an exclusive (write) lock instead of a shared (read) one.
+        """
+        if fcntl is None:
+            yield
+            return
+
+        previous = self._exclusive
+        if self._count == 0 or (exclusive and not self._exclusive):
+            # Upgrading a shared lock is not atomic, so writers should take the exclusive lock up front
+            self._acquire(exclusive)
+            self._exclusive = exclusive
+        self._count += 1
+        try:
+            yield
+        finally:
+            self._count -= 1
+            if self._count == 0:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                self._exclusive = False
+            elif previous != self._exclusive:
+                # Back to the shared lock the outer block asked for
+                fcntl.flock(self._fd, fcntl.LOCK_SH)
+                self._exclusive = previous
+
+class JsonStore:
+    """
+    Keeps the parsed contents of a JSON file in memory.
+
+    Before every read the file is stat()ed, and it is only re-parsed when its modification
+    time, size or inode changed. Writes go to the file straight away (write-through) and
+    update the cached copy, so the next read doesn't need to parse the file again.
+
+    Writes are atomic: the document is written to a temporary file next to the JSON file,
+    fsynced and renamed over it, so readers see either the old or the new file, never half
+    of one. Inside transaction() writes are held back and done once when it ends.
+
+    Other processes are kept in step with a FileLock: the file is read under a shared lock,
+    and writes and transactions hold the exclusive lock.
+    """
+    def __init__(self, json_dir):
+        """
+        Args:
+            json_dir (str): The file path of the JSON file this store caches.
+        """
+        self.json_dir = json_dir
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(f"{json_dir}.lock")
+        self._data = None
+        self._signature = None
+        self._depth = 0
+        self._dirty = False
+
+    def signature(self):
+        """
+        Returns a tuple identifying the current version of the file, or None if it does not exist.
+        """
+        return file_signature(self.json_dir)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.json_dir)
+
+    @property
+    def stats(self) -> dict:
+        """
+        How often and how long this process waited for the file lock.
+        """
+        return self.file_lock.stats
+
+    def invalidate(self):
+        """
+        Drops the cached document so the next read parses the file again.
+        Inside a transaction this does nothing, as the cache holds the unsaved changes.
+        """
+        with self.lock:
+            if self._depth:
+                return
+            self._data = None
+            self._signature = None
+
+    def load(self, dt=None):
+        """
+        Returns the parsed document, only re-reading the file if it changed on disk.
+        The returned object is the cached one and must not be modified by the caller.
+
+        Args:
+            dt (dict): The dictionary to fill the JSON file with if it does not exist or is empty (default=None).
+        Returns:
+            The parsed JSON document.
+        """
+        with self.lock:
+            if self._depth and self._data is not None:
+                # Inside a transaction, keep working on the same (possibly unsaved) document
+                return self._data
+
+            signature = self.signature()
+            if signature is not None and signature == self._signature:
+                return self._data
+
+            if signature is None:
+                # The file doesn't exist, so create it (and its parent directory) from dt
+                parent_dir = os.path.dirname(self.json_dir)
+                if parent_dir != "":
+                    os.makedirs(parent_dir, exist_ok=True)
+                # A copy, as the cached document is changed in place and dt is usually a shared default
+                self.write(_copy(dt) if dt is not None else {})
+                return self._data
+
+            with self.file_lock.hold():
+                signature = self.signature()
+                with open(self.json_dir, 'r') as f:
+                    data = json.load(f)
+            if not data:
+                # If empty, fill it with an empty dictionary or the provided dt
+                self.write(_copy(dt) if dt else {})
+                return self._data
+
+            self._data = data
+            self._signature = signature
+            return data
+
+    def get(self, key, default=None, dt=None):
+        """
+        Returns the value at a key (see KeyPath), or default if it is missing.
+        The returned object is the cached one and must not be modified by the caller.
+
+        Args:
+            key (str): The key in the format "parent.child1.child2[0].child3".
+            default: The value to return if the key is missing (default=None).
+            dt (dict): The dictionary to fill the JSON file with if it does not exist or is empty (default=None).
+        """
+        return KeyPath.compile(key).get(self.load(dt), default)
+
+    def users_since(self, token):
+        """
+        Returns the users of "PyTrain_users" if the file changed since an earlier call, e.g. to keep a copy of
+        them in step. A JSON file can't tell which users changed, so it is every user or none of them.
+
+        Args:
+            token: The token returned by the earlier call, or None.
+        Returns:
+            A tuple (token, users, complete). If the file changed, users is the whole (cached) table and complete
+            is True. Otherwise users is empty and complete is False.
+        """
+        with self.lock:
+            data = self.load()
+            signature = ["json", *self._signature]
+        if token is not None and list(token) == signature:
+            return signature, {}, False
+        users = data.get("PyTrain_users")
+        return signature, users if isinstance(users, dict) else {}, True
+
+    def update(self, key, mutation, dt=None):
+        """
+        Changes the value at a key under the exclusive lock, and saves it. The whole file is written,
+        unless inside a transaction, which writes it once when it ends.
+
+        Args:
+            key (str): The key the mutation changes, in the format "parent.child1.child2[0].child3".
+            mutation (callable): Called with the document, which it changes in place.
+            dt (dict): The dictionary to fill the JSON file with if it does not exist or is empty (default=None).
+        Returns:
+            What mutation returned.
+        """
+        with self.transaction(dt):
+            result = mutation(self.load())
+            self.write()
+        return result
+
+    def set(self, key, value, dt=None):
+        """
+        Sets the value at a key, creating missing parent dicts, and saves it. The value is stored as is, not copied.
+        """
+        self.update(key, lambda data: KeyPath.compile(key).set(data, value), dt)
+
+    def delete(self, key) -> bool:
+        """
+        Removes a key, if it exists, and saves the change.
+
+        Returns:
+            bool: Whether the key existed.
+        """
+        return self.update(key, KeyPath.compile(key).delete)
+
+    def write(self, data=None):
+        """
+        Writes a document to the JSON file and makes it the cached copy.
+        Inside a transaction the write is deferred until the transaction ends.
+
+        Args:
+            data: The document to write. Defaults to the cached document, for after it was modified in place.
+        """
+        with self.lock:
+            if data is None:
+                data = self._data
+            self._data = data
+            if self._depth:
+                self._dirty = True
+                return
+            try:
+                with self.file_lock.hold(exclusive=True):
+                    self._replace(data)
+            except Exception:
+                # The cache no longer matches what is on disk
+                self.invalidate()
+                raise
+            self._signature = self.signature()
+
+    def _replace(self, data):
+        """
+        Atomically replaces the JSON file with the serialized document.
+        """
+        parent_dir = os.path.dirname(os.path.abspath(self.json_dir))
+        fd, tmp_path = tempfile.mkstemp(dir=parent_dir, prefix=f".{os.path.basename(self.json_dir)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=4, separators=(',', ': '))
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file as 0600, keep the permissions of the file being replaced
+            try:
+                os.chmod(tmp_path, os.stat(self.json_dir).st_mode)
+            except OSError:
+                pass
+            os.replace(tmp_path, self.json_dir)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        if os.name != "nt":
+            # Makes the rename itself durable. Windows can't open directories, so skip it there
+            try:
+                dir_fd = os.open(parent_dir, os.O_RDONLY)
+            except OSError:
+                return
+            try:
+                os.fsync(dir_fd)
+            except OSError:
+                pass
+            finally:
+                os.close(dir_fd)
+
+    @contextlib.contextmanager
+    def transaction(self, dt=None):
+        """
+        Batches every write made inside the with block into a single write when it ends.
+        If the block raises, nothing is written and the cached document is dropped.
+        Transactions can be nested, only the outermost one writes.
+
+        The exclusive file lock is held for the whole block, so the document can't be changed
+        by another process between reading and writing it.
+
+        Args:
+            dt (dict): The dictionary to fill the JSON file with if it does not exist or is empty (default=None).
+        """
+        with self.lock, self.file_lock.hold(exclusive=True):
+            if self._depth == 0:
+                # Start from the latest version on disk
+                self.load(dt)
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._dirty = False
+                    self.invalidate()
+                raise
+            self._depth -= 1
+            if self._depth == 0 and self._dirty:
+                self._dirty = False
+                self.write()
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+class jmod:
+    def store(json_dir):
+        """
+        Get the shared store for a JSON file, creating it on first use.
+        The PYTRAIN_STORAGE environment variable can keep it in SQLite or a read-only snapshot instead, see library.storage.
+        Args:
+            json_dir (str): The file path of the JSON file.
+        Returns:
+            JsonStore, SQLiteStore or SnapshotStore: The store caching that file.
+        """
+        path = os.path.abspath(json_dir)
+        with _stores_lock:
+            store = _stores.get(path)
+            if store is None:
+                # Imported here, as library.storage builds on this module
+                from library.storage import storage
+                store = _stores[path] = storage.open_store(json_dir)
+        return store
+
+    def transaction(json_dir, dt=None):
+        """
+        Batch several jmod changes to a JSON file into a single write.
+        Args:
+            json_dir (str): The file path of the JSON file.
+            dt (dict): The dictionary to write to the JSON file if it does not exist (default=None).
+        Returns:
+            A context manager. Changes made inside the with block are written once when it ends,
+            or discarded if it raises.
+
+        Example:
+            with jmod.transaction(settings_file, dt=data_tables.SETTINGS_DT):
+                for user in new_users:
+                    jmod.setvalue(f"PyTrain_users.{KeyPath.escape(user['username'])}", settings_file, user, dt=data_tables.SETTINGS_DT)
+        """
+        return jmod.store(json_dir).transaction(dt)
+
+    def lock_stats(json_dir) -> dict:
+        """
+        Get how often and how long this process waited for the lock of a JSON file.
+        Args:
+            json_dir (str): The file path of the JSON file.
+        Returns:
+            dict: acquired, timeouts, wait_seconds_total and wait_seconds_max.
+        """
+        return dict(jmod.store(json_dir).stats)
+
+    def getvalue(key, json_dir, default=None, dt=None, copy=True):
         """
         Retrieve the value of a nested key from a JSON file or dictionary.
         Args:
@@ -47,110 +678,66 @@ class jmod:
             json_dir (str): The file path of the JSON file to read from or write to.
             default: The default value to return if the key is not found (default=None).
             dt (dict): The dictionary to write to the JSON file if it does not exist (default=None).
+            copy (bool): Return a copy of dicts and lists. Only pass False if the value is never modified (default=True).
         Returns:
             The value of the key if found, or the default value if not found.
         """
-        # Split the key into parts (assuming key is in the format "parent.child1.child2[0].child3")
-        parts = key.split('.')
-        # Check if the JSON file exists
-        if not os.path.exists(json_dir):
-            try:
-                # If not, create the parent directory if it doesn't exist
-                os.makedirs(os.path.dirname(json_dir), exist_ok=True)
-            except: # If this fails, its a file not a folder.
-                with open(json_dir, 'w+') as f:
-                    json.dump(dt if dt is not None else {}, f, indent=4, separators=(',', ': '))
-            try:
-                if dt is not None:
-                    # If dt is provided, write it to the JSON file
-                    with open(json_dir, 'w') as f:
-                        json.dump(dt, f, indent=4, separators=(',', ': '))
-                else:
-                    # Otherwise, create an empty JSON file
-                    with open(json_dir, 'w') as f:
-                        json.dump({}, f, indent=4, separators=(',', ': '))
-            except Exception as err:
-                # Gets the filename and lineno of who called this function
-                caller = inspect.stack()[1]
-                filename = caller.filename.split('/')[-1]
-                lineno = caller.lineno
-                logging.error(f"Error creating JSON file: {str(err)}. filename: {filename}. lineno: {lineno}", err)
-                return default
-        # Load the JSON file
+        # Read from the cache if the file didn't change, or only the rows of the key for an SQLite store.
+        # A lock timeout is raised, as returning the default would silently swap in the wrong settings (e.g. a default root password)
         try:
-            with open(json_dir, 'r') as f:
-                data = json.load(f)
-        except Exception as err:
-            logging.error(f"Error loading JSON file: {str(err)}", err)
+            value = jmod.store(json_dir).get(key, default, dt)
+        except KeyError:
+            raise KeyError(f"Key '{key}' in \"{json_dir}\" is a value, not a key, or it does not exist. Is your Json File setup correctly?")
+        except (FileNotFoundError, json.JSONDecodeError, TypeError) as err:
+            # Gets the filename and lineno of who called this function
+            caller = inspect.stack()[1]
+            filename = caller.filename.split('/')[-1]
+            lineno = caller.lineno
+            logging.error(f"Error loading JSON file: {str(err)}. filename: {filename}. lineno: {lineno}")
             return default
-        # Check if the JSON data is empty
-        if not data:
-            # If empty, fill it with an empty dictionary or the provided dt
-            data = dt or {}
-            try:
-                with open(json_dir, 'w') as f:
-                    json.dump(data, f, indent=4, separators=(',', ': '))
-            except Exception as err:
-                logging.error(f"Error writing to JSON file: {str(err)}", err)
-                return default
-        # Traverse the nested dictionaries/lists in the JSON data to get the value
-        value = data
-        for part in parts:
-            if part.endswith(']'):  # Check if part is an array index
-                index = int(part[part.index('[') + 1:part.index(']')])  # Extract the array index
-                value = value[index]
-            else:
-                try:
-                    if part in value:
-                        value = value[part]
-                    else:
-                        # If the key doesn't exist, return the default value (default=None)
-                        return default
-                except TypeError:
-                    # The key is a value. Not a key
-                    raise KeyError(f"Key '{key}' in \"{json_dir}\" is a value, not a key, or it does not exist. Is your Json File setup correctly?")
-        return value
+        return _copy(value) if copy else value
 
     def setvalue(key, json_dir, value, default=None, dt=None):
-        # Check if the file at json_dir exists
-        if not os.path.exists(json_dir):
-            # Create parent directories if they don't exist
-            if "/" in json_dir or "\\" in json_dir:
-                os.makedirs(os.path.dirname(json_dir), exist_ok=True)
-            # If its not routing to another directory, it must be in the Current Working Dir so make a file instead
-            # Do so by letting the below code handle it
-            
-            # Create and fill the JSON file with dt if provided
-            if dt is not None:
-                with open(json_dir, 'w') as file:
-                    json.dump(dt, file, indent=4, separators=(',', ': '))
-            elif default is not None:
-                with open(json_dir, 'w') as file:
-                    json.dump(default, file, indent=4, separators=(',', ': '))
-        
+        """
+        Set the value of a nested key in a JSON file, creating missing parent keys.
+        Args:
+            key (str): The key to set in the format "parent.child1.child2[0].child3".
+            json_dir (str): The file path of the JSON file to read from or write to.
+            value: The value to set.
+            default: The value to return if the key could not be set. Also used to create the file if there is no dt (default=None).
+            dt (dict): The dictionary to write to the JSON file if it does not exist (default=None).
+        Returns:
+            The value that was set, or the default value if it could not be set.
+        """
+        # If the file doesn't exist, it is created from dt, or from default if there is no dt
+        store = jmod.store(json_dir)
+        if dt is None and default is None and not store.exists():
+            return default
+
         try:
-            with open(json_dir, 'r+') as file:
-                data = json.load(file)
-                keys = key.split('.')
-                
-                # Traverse the nested structure to access the key
-                nested_data = data
-                for nested_key in keys[:-1]:
-                    nested_data = nested_data.setdefault(nested_key, {})
-                
-                # Set the value of the selected key
-                nested_data[keys[-1]] = value
-                
-                # Move the file pointer to the beginning and rewrite the JSON data
-                file.seek(0)
-                json.dump(data, file, indent=4, separators=(',', ': '))
-                file.truncate()
-                
+            store.set(key, _copy(value), dt if dt is not None else default)
         except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
             return default
-        
+
         return value
 
+    def delvalue(key, json_dir) -> bool:
+        """
+        Delete a nested key from a JSON file.
+        Args:
+            key (str): The key to delete in the format "parent.child1.child2[0].child3".
+            json_dir (str): The file path of the JSON file to change.
+        Returns:
+            True if the key was deleted, False if it did not exist.
+        """
+        store = jmod.store(json_dir)
+        if not store.exists():
+            return False
+        try:
+            return store.delete(key)
+        except KeyError:
+            return False
+
     def addvalue(key, json_dir, value, default=None, dt=None):
         """
         Add a value to a list in a nested key of a JSON file or dictionary.
@@ -163,104 +750,8 @@ class jmod:
         Returns:
             The updated value of the key if added successfully, or the default value if not found.
         """
-        parts = key.split('.')
-        if not os.path.exists(json_dir):
-            try:
-                os.makedirs(os.path.dirname(json_dir), exist_ok=True)
-                if dt is not None:
-                    with open(json_dir, 'w') as f:
-                        json.dump(dt, f, indent=4, separators=(',', ': '))
-                else:
-                    with open(json_dir, 'w') as f:
-                        json.dump({}, f, indent=4, separators=(',', ': '))
-            except Exception as err:
-                logging.error(f"Error creating JSON file: {str(err)}", err)
-                return default
-        try:
-            with open(json_dir, 'r') as f:
-                data = json.load(f)
-        except Exception as err:
-            logging.error(f"Error loading JSON file: {str(err)}", err)
-            return default
-        if not data:
-            data = dt or {}
-            try:
-                with open(json_dir, 'w') as f:
-                    json.dump(data, f, indent=4, separators=(',', ': '))
-            except Exception as err:
-                logging.error(f"Error writing to JSON file: {str(err)}", err)
-                return default
-        
-        # Compare dt with the JSON data and create any missing keys
-        def compare_and_create_keys(parts, data, dt):
-            if len(parts) == 1:
-                key = parts[0]
-                if key.endswith(']'):
-                    index = int(key[key.index('[') + 1:key.index(']')])
-                    if not isinstance(data[index], list):
-                        data[index] = [data[index]]
-                else:
-                    if key not in data:
-                        data[key] = dt[key]
-                        return
-            else:
-                key = parts[0]
-                if key.endswith(']'):
-                    index = int(key[key.index('[') + 1:key.index(']')])
-                    if not isinstance(data[index], list):
-                        data[index] = [data[index]]
-                    compare_and_create_keys(parts[1:], data[index], dt)
-                else:
-                    if key not in data:
-                        data[key] = dt[key] if key in dt else {}
-                    compare_and_create_keys(parts[1:], data[key], dt)
-        
-        if dt is not None:
-            compare_and_create_keys(parts, data, dt)
-
-        # Define a recursive function to traverse the nested dictionaries/lists in the JSON data
-        def _addvalue(parts, value, data):
-            if len(parts) == 1:
-                key = parts[0]
-                if key.endswith(']'):
-                    index = int(key[key.index('[') + 1:key.index(']')])
-                    if not isinstance(data[index], list):
-                        data[index] = [data[index]]
-                    data[index].append(value)
-                else:
-                    if not isinstance(data[key], list):
-                        data[key] = [data[key]]
-                    data[key].append(value)
-            else:
-                key = parts[0]
-                if key.endswith(']'):
-                    index = int(key[key.index('[') + 1:key.index(']')])
-                    if isinstance(data[key], list):
-                        data[key].append(value)
-                else:
-                    key = parts[0]
-                    if key.endswith(']'):
-                        index = int(key[key.index('[') + 1:key.index(']')])
-                        if isinstance(data[index], list):
-                            _addvalue(parts[1:], value, data[index])
-                    else:
-                        if key in data:
-                            _addvalue(parts[1:], value, data[key])
-
-        try:
-            _addvalue(parts, value, data)
-        except Exception as err:
-            logging.error(f"Error adding value to JSON file: {str(err)}", err)
-            return default
-        
-        try:
-            with open(json_dir, 'w') as f:
-                json.dump(data, f, indent=4, separators=(',', ': '))
-        except Exception as err:
-            logging.error(f"Error writing to JSON file: {str(err)}", err)
-            return default
-
-        return data
+        return jmod._mutate(key, json_dir, default, dt, "adding value to",
+                            lambda data: KeyPath.compile(key).append(data, _copy(value), dt))
 
     def remvalue(key, json_dir, value, default=None, dt=None):
         """
@@ -272,105 +763,26 @@ class jmod:
             default: The default value to return if the key is not found (default=None).
             dt (dict): The dictionary to compare against the JSON file and create missing keys (default=None).
         Returns:
-            The updated value of the key if removed successfully, or the default value if not found.
+            True if removed successfully, or the default value if not found.
         """
-        parts = key.split('.')
-        if not os.path.exists(json_dir):
-            try:
-                os.makedirs(os.path.dirname(json_dir), exist_ok=True)
-                if dt is not None:
-                    with open(json_dir, 'w') as f:
-                        json.dump(dt, f, indent=4, separators=(',', ': '))
-                else:
-                    with open(json_dir, 'w') as f:
-                        json.dump({}, f, indent=4, separators=(',', ': '))
-            except Exception as err:
-                logging.error(f"Error creating JSON file: {str(err)}", err)
-                return default
-        try:
-            with open(json_dir, 'r') as f:
-                data = json.load(f)
-        except Exception as err:
-            logging.error(f"Error loading JSON file: {str(err)}", err)
-            return default
-        if not data:
-            data = dt or {}
-            try:
-                with open(json_dir, 'w') as f:
-                    json.dump(data, f, indent=4, separators=(',', ': '))
-            except Exception as err:
-                logging.error(f"Error writing to JSON file: {str(err)}", err)
-                return default
-        
-        # Compare dt with the JSON data and create any missing keys
-        def compare_and_create_keys(parts, data, dt):
-            if len(parts) == 1:
-                key = parts[0]
-                if key.endswith(']'):
-                    index = int(key[key.index('[') + 1:key.index(']')])
-                    if not isinstance(data[index], list):
-                        data[index] = [data[index]]
-                else:
-                    if key not in data:
-                        data[key] = dt[key]
-                        return
-            else:
-                key = parts[0]
-                if key.endswith(']'):
-                    index = int(key[key.index('[') + 1:key.index(']')])
-                    if not isinstance(data[index], list):
-                        data[index] = [data[index]]
-                    compare_and_create_keys(parts[1:], data[index], dt)
-                else:
-                    if key not in data:
-                        data[key] = dt[key] if key in dt else {}
-                    compare_and_create_keys(parts[1:], data[key], dt)
-        
-        if dt is not None:
-            compare_and_create_keys(parts, data, dt)
-
-        # Define a recursive function to traverse the nested dictionaries/lists in the JSON data
-        def _remvalue(parts, value, data):
-            if len(parts) == 1:
-                key = parts[0]
-                if key.endswith(']'):
-                    index = int(key[key.index('[') + 1:key.index(']')])
-                    if isinstance(data[index], list):
-                        if value in data[index]:
-                            data[index].remove(value)
-                else:
-                    if isinstance(data[key], list):
-                        if value in data[key]:
-                            data[key].remove(value)
-            else:
-                key = parts[0]
-                if key.endswith(']'):
-                    index = int(key[key.index('[') + 1:key.index(']')])
-                    ###
-                    if isinstance(data[key], list):
-                        if value in data[key]:
-                            data[key].remove(value)
-                else:
-                    key = parts[0]
-                    if key.endswith(']'):
-                        index = int(key[key.index('[') + 1:key.index(']')])
-                        if isinstance(data[index], list):
-                            _remvalue(parts[1:], value, data[index])
-                    else:
-                        if key in data:
-                            _remvalue(parts[1:], value, data[key])
+        data = jmod._mutate(key, json_dir, default, dt, "removing value from",
+                            lambda data: KeyPath.compile(key).remove(data, value))
+        return True if data is not default else default
 
-        try:
-            _remvalue(parts, value, data)
-        except Exception as err:
-            logging.error(f"Error removing value from JSON file: {str(err)}", err)
-            return default
+    def _mutate(key, json_dir, default, dt, action, mutation):
+        """
+        Applies a mutation to the value at a key and saves it, all under the exclusive lock.
+        Returns a copy of the updated value, or default if any step failed. A lock timeout is raised, as the
+        caller would otherwise take the value as not found, when it was never looked at.
+        """
+        def change(data):
+            mutation(data)
+            return _copy(KeyPath.compile(key).get(data))
 
         try:
-            with open(json_dir, 'w') as f:
-                json.dump(data, f, indent=4, separators=(',', ': '))
+            return jmod.store(json_dir).update(key, change, dt)
+        except TimeoutError:
+            raise
         except Exception as err:
-            logging.error(f"Error writing to JSON file: {str(err)}", err)
+            logging.error(f"Error {action} JSON file: {str(err)}")
             return default
-
-        return True
\ No newline at end of file
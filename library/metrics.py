@@ -0,0 +1,324 @@
+import threading
+import logging
+
+class Metric:
+    """
+    A metric with a value for each combination of its labels.
+
+    Values are kept in a dict keyed by the label values, under a lock, as threaded server
+    connections update them from their own threads.
+    """
+    type = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        """
+        Args:
+            name (str): The metric's name, e.g. "pytrain_logins_total".
+            help (str): What it measures.
+            labels (tuple): The names of its labels.
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def collect(self) -> dict:
+        """
+        Returns:
+            dict: The metric and its values, which can be sent between processes and merged (see merge()).
+        """
+        with self._lock:
+            samples = {key: self._copy(value) for key, value in self._values.items()}
+        return {"type": self.type, "help": self.help, "labels": self.labels, "samples": samples}
+
+    def _copy(self, value):
+        return value
+
+class Counter(Metric):
+    """
+    A value that only goes up, e.g. the number of logins.
+    """
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        if not self.labels:
+            # Shown as 0 before anything happens, rather than missing
+            self._values[()] = 0
+
+    def inc(self, *label_values, amount=1) -> None:
+        """
+        Adds to the value for the label values.
+        """
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+class Gauge(Metric):
+    """
+    A value read when the metrics are collected, e.g. the number of open sessions.
+    """
+    type = "gauge"
+
+    def __init__(self, name, help, function, labels=()):
+        """
+        Args:
+            function (callable): Returns the value, or a dict of label value tuples to values if there are labels.
+        """
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def collect(self) -> dict:
+        values = self.function()
+        samples = values if self.labels else {(): values}
+        return {"type": self.type, "help": self.help, "labels": self.labels, "samples": dict(samples)}
+
+class FunctionCounter(Gauge):
+    """
+    A counter kept by something else, read when the metrics are collected, e.g. the settings lock's waits.
+    """
+    type = "counter"
+
+class Histogram(Metric):
+    """
+    Counts of observed values by bucket, e.g. transfer durations.
+
+    Each value is a list of a count per bucket (not cumulative, so they can be summed across
+    processes), then the sum and the count of the observations.
+    """
+    type = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        """
+        Args:
+            buckets (tuple): The buckets' upper bounds, in increasing order.
+        """
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        if not self.labels:
+            self._values[()] = self._empty()
+
+    def _empty(self):
+        return [0] * (len(self.buckets) + 1) + [0.0, 0]
+
+    def observe(self, value, *label_values) -> None:
+        """
+        Records a value for the label values.
+        """
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = self._empty()
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def collect(self) -> dict:
+        collected = super().collect()
+        collected["buckets"] = self.buckets
+        return collected
+
+    def _copy(self, value):
+        return list(value)
+
+class Registry:
+    """
+    The metrics of a process.
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """
+        Adds a metric.
+
+        Returns:
+            Metric: The metric, so it can be made and registered in one go.
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self) -> dict:
+        """
+        Returns:
+            dict: Every metric's collect(), by name.
+        """
+        return {metric.name: metric.collect() for metric in self.metrics}
+
+def settings_lock_metrics(lock_stats) -> list:
+    """
+    Makes the metrics of a process' waits for the settings lock. The longest wait isn't one, as it can't be added up across processes.
+
+    Args:
+        lock_stats (callable): Returns a dict like jmod.lock_stats().
+    Returns:
+        list: The metrics.
+    """
+    return [
+        FunctionCounter("pytrain_settings_lock_acquisitions_total", "Times the settings lock was taken.", lambda: lock_stats()["acquired"]),
+        FunctionCounter("pytrain_settings_lock_timeouts_total", "Times waiting for the settings lock timed out.", lambda: lock_stats()["timeouts"]),
+        FunctionCounter("pytrain_settings_lock_wait_seconds_total", "Time spent waiting for the settings lock.", lambda: lock_stats()["wait_seconds_total"]),
+    ]
+
+def merge(collections) -> dict:
+    """
+    Adds up the metrics collected from several processes, e.g. the workers of a pool.
+
+    Args:
+        collections (list): Registry.collect() dicts.
+    Returns:
+        dict: A dict like Registry.collect() returns, with the values of each label set summed.
+    """
+    merged = {}
+    for collection in collections:
+        for name, metric in collection.items():
+            target = merged.get(name)
+            if target is None:
+                merged[name] = dict(metric, samples={key: _copy_value(value) for key, value in metric["samples"].items()})
+                continue
+            for key, value in metric["samples"].items():
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = _copy_value(value)
+                elif isinstance(value, list):
+                    target["samples"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+def _copy_value(value):
+    return list(value) if isinstance(value, list) else value
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(collection) -> str:
+    """
+    Formats collected metrics in the Prometheus text format.
+
+    Args:
+        collection (dict): A dict like Registry.collect() returns.
+    Returns:
+        str: The text to serve.
+    """
+    lines = []
+    for name, metric in collection.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric["samples"].items(), key=lambda item: tuple(map(str, item[0]))):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_labels(metric['labels'], key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(tuple(metric["buckets"]) + (float("inf"),), value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(metric['labels'], key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric['labels'], key)} {_number(value[-2])}")
+            lines.append(f"{name}_count{_labels(metric['labels'], key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """
+    Serves metrics over HTTP at /metrics, for Prometheus to scrape.
+    """
+    def __init__(self, collect, port, host="127.0.0.1"):
+        """
+        Args:
+            collect (callable): Returns the metrics to serve, as a dict like Registry.collect() returns.
+            port (int): The port to serve on.
+            host (str): The address to serve on. Only this machine can scrape the default.
+        """
+        self.collect = collect
+        self.port = port
+        self.host = host
+        self._httpd = None
+
+    def start(self) -> None:
+        """
+        Starts serving on a daemon thread.
+
+        Raises:
+            OSError: If the port can't be bound.
+        """
+        # Only imported when the metrics are served, as it is slow to import
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        collect = self.collect
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                try:
+                    body = render(collect()).encode("utf-8")
+                except Exception as err:
+                    logging.exception("Collecting metrics failed")
+                    self.send_error(500, str(err))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the console
+                pass
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name="MetricsServer", daemon=True).start()
+
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+class ServerMetrics:
+    """
+    The metrics of an FTP server process.
+    """
+    transfer_buckets = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+    handshake_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+    reload_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self, sessions=None, lock_stats=None):
+        """
+        Args:
+            sessions (SessionRegistry): The process' sessions, for the session gauges.
+            lock_stats (callable): Returns the settings lock's stats, as jmod.lock_stats() does.
+        """
+        self.registry = Registry()
+        register = self.registry.register
+        self.logins = register(Counter("pytrain_logins_total", "Login attempts, by result (ok, failed or refused).", ("result",)))
+        self.commands = register(Counter("pytrain_commands_total", "FTP commands received, by command.", ("command",)))
+        self.transfers = register(Counter("pytrain_transfers_total", "File transfers, by direction and whether they completed.", ("direction", "result")))
+        self.transfer_bytes = register(Counter("pytrain_transfer_bytes_total", "Bytes of files transferred, by user and direction.", ("user", "direction")))
+        self.transfer_seconds = register(Histogram("pytrain_transfer_duration_seconds", "File transfer durations, by direction.", self.transfer_buckets, ("direction",)))
+        self.handshake_seconds = register(Histogram("pytrain_tls_handshake_seconds", "TLS handshake durations, by channel (control or data).", self.handshake_buckets, ("channel",)))
+        self.reload_seconds = register(Histogram("pytrain_settings_reload_seconds", "Time taken to reload the users and settings.", self.reload_buckets))
+        if sessions is not None:
+            register(Gauge("pytrain_sessions", "Open sessions.", lambda: len(sessions)))
+            register(Gauge("pytrain_logged_in_sessions", "Open sessions that are logged in.", lambda: sessions.stats()["logged_in"]))
+        if lock_stats is not None:
+            for metric in settings_lock_metrics(lock_stats):
+                register(metric)
+
+    def collect(self) -> dict:
+        return self.registry.collect()
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+import threading
+import hashlib
+import base64
+import hmac
+import time
+import os
+
+PBKDF2_ITERATIONS = 200000
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+def hash_password(password, algorithm="pbkdf2") -> str:
+    """
+    Hash a password with a random salt.
+
+    Args:
+        password (str): The plaintext password.
+        algorithm (str): "pbkdf2" (PBKDF2-SHA256) or "scrypt".
+    Returns:
+        str: The hash, in the format "pbkdf2_sha256$<iterations>$<salt>$<hash>"
+             or "scrypt$<n>$<r>$<p>$<salt>$<hash>".
+    """
+    salt = os.urandom(16)
+    if algorithm == "scrypt":
+        digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+    elif algorithm == "pbkdf2":
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, PBKDF2_ITERATIONS)
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}"
+    raise ValueError(f"Unknown password hash algorithm '{algorithm}'. Use 'pbkdf2' or 'scrypt'.")
+
+def is_hashed(stored) -> bool:
+    """
+    Whether a stored password is a hash made by hash_password, rather than plaintext.
+    """
+    return str(stored).startswith(("pbkdf2_sha256$", "scrypt$"))
+
+def verify_password(stored, password) -> bool:
+    """
+    Check a password attempt against a stored password.
+
+    Args:
+        stored (str): The stored password, either a hash made by hash_password or plaintext.
+        password (str): The password attempt.
+    Returns:
+        bool: True if the attempt matches.
+    """
+    stored = str(stored)
+    password = str(password).encode("utf-8")
+    if not is_hashed(stored):
+        # Plaintext passwords from before hashing was supported
+        return hmac.compare_digest(stored.encode("utf-8"), password)
+
+    try:
+        if stored.startswith("scrypt$"):
+            _, n, r, p, salt, digest = stored.split("$")
+            digest = base64.b64decode(digest)
+            attempt = hashlib.scrypt(password, salt=base64.b64decode(salt), n=int(n), r=int(r), p=int(p), dklen=len(digest))
+        else:
+            _, iterations, salt, digest = stored.split("$")
+            digest = base64.b64decode(digest)
+            attempt = hashlib.pbkdf2_hmac("sha256", password, base64.b64decode(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(attempt, digest)
+
+class VerifyCache:
+    """
+    Remembers recently verified (username, password) pairs, so repeated logins skip the slow hash.
+
+    Attempts are keyed by an HMAC with a random per-process key, so plaintext passwords are never
+    kept in memory. An entry is only valid for the stored hash it was verified against, so a
+    password change invalidates it. Entries expire after ttl seconds, and the least recently used
+    ones are dropped beyond max_size. Failed attempts are never cached.
+    """
+    def __init__(self, max_size=4096, ttl=300):
+        """
+        Args:
+            max_size (int): The maximum number of cached credentials. 0 disables the cache.
+            ttl (float): Seconds a verified credential stays valid in the cache.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_key(self, username, password):
+        return (username, hmac.new(self._key, str(password).encode("utf-8"), hashlib.sha256).digest())
+
+    def verify(self, username, stored, password) -> bool:
+        """
+        Check a password attempt against a stored password, using the cache if possible.
+
+        Args:
+            username (str): The user logging in.
+            stored (str): The stored password, either a hash made by hash_password or plaintext.
+            password (str): The password attempt.
+        Returns:
+            bool: True if the attempt matches.
+        """
+        if self.max_size <= 0 or not is_hashed(stored):
+            # Plaintext compares are already cheap
+            return verify_password(stored, password)
+
+        key = self._cache_key(username, password)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached_stored, expires = entry
+                if cached_stored == stored and expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True
+                del self._entries[key]
+            self.misses += 1
+
+        if not verify_password(stored, password):
+            return False
+
+        with self._lock:
+            self._entries[key] = (stored, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return True
@@ -0,0 +1,102 @@
+import threading
+import logging
+import socket
+import os
+
+# systemd passes sockets starting at this file descriptor (SD_LISTEN_FDS_START)
+LISTEN_FDS_START = 3
+
+_inherited = None
+_inherited_lock = threading.Lock()
+
+class ports:
+    def inherited():
+        """
+        Get the listening socket the service manager started us with, systemd-style (LISTEN_FDS / LISTEN_PID).
+        The environment variables are removed once read, so child processes don't claim the socket too.
+
+        Returns:
+            socket.socket: The inherited listening socket, or None if there isn't one.
+        """
+        global _inherited
+        with _inherited_lock:
+            if _inherited is not None:
+                return _inherited
+
+            listen_pid = os.environ.get("LISTEN_PID")
+            listen_fds = os.environ.get("LISTEN_FDS")
+            if listen_pid is None or listen_fds is None:
+                return None
+            for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+                os.environ.pop(name, None)
+            try:
+                if int(listen_pid) != os.getpid() or int(listen_fds) < 1:
+                    return None
+            except ValueError:
+                return None
+
+            if int(listen_fds) > 1:
+                logging.warning(f"Given {listen_fds} sockets by the service manager. Only the first one is used.")
+            _inherited = socket.socket(fileno=LISTEN_FDS_START)
+            return _inherited
+
+    def bind(port, host="0.0.0.0", reuse_port=False, listen=True) -> socket.socket:
+        """
+        Bind a TCP socket to a port.
+
+        Args:
+            port (int): The port to bind.
+            host (str): The address to bind.
+            reuse_port (bool): Set SO_REUSEPORT, so other processes doing the same can bind the port too.
+            listen (bool): Start listening, so the socket is ready to hand to an FTPServer.
+        Returns:
+            socket.socket: The bound socket.
+        Raises:
+            OSError: If the port can't be bound.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if os.name != "nt":
+                # Lets ports left in TIME_WAIT by a previous run be bound straight away
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((host, port))
+            if listen:
+                sock.listen(100)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def allocate(port, port_range=1, host="0.0.0.0", reuse_port=False, listen=True) -> socket.socket:
+        """
+        Get a socket for the FTP server: the inherited one if there is one, otherwise the
+        first port from port to port + port_range - 1 that can be bound.
+
+        The socket is returned already bound, so it can be handed straight to the server
+        without another process taking the port between finding and binding it.
+
+        Args:
+            port (int): The first port to try.
+            port_range (int): How many ports to try.
+            host (str): The address to bind.
+            reuse_port (bool): Set SO_REUSEPORT on the socket.
+            listen (bool): Start listening on the socket.
+        Returns:
+            socket.socket: The bound socket.
+        Raises:
+            OSError: If no port in the range could be bound.
+        """
+        inherited = ports.inherited()
+        if inherited is not None:
+            return inherited
+
+        last_error = None
+        for candidate in range(port, port + max(port_range, 1)):
+            try:
+                return ports.bind(candidate, host=host, reuse_port=reuse_port, listen=listen)
+            except OSError as err:
+                last_error = err
+                print(f"Port '{candidate}' taken.")
+        raise OSError(f"No free port between {port} and {port + max(port_range, 1) - 1}: {last_error}")
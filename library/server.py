@@ -1,91 +1,540 @@
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives import hashes
-from library.jmod import jmod, data_tables
-from cryptography.x509.oid import NameOID
-from cryptography import x509
+from library.jmod import jmod, data_tables, FileLock
+from library.watcher import SettingsWatcher
+from library.usersync import UserSync
+from library.ports import ports
+from library.certs import CertManager
+from library.tls import TLSProfile, PlainDataPolicy, data_commands, ktls_option, ktls_sending
+from library.tuning import TransferTuning
+from library.throttle import Throttle
+from library.sessions import SessionRegistry
+from library.control import ControlServer, ControlClient
+from library.metrics import MetricsServer, ServerMetrics, Counter, Gauge, merge, settings_lock_metrics
+from library.accesslog import AccessLog, AccessLogger
+from library.telemetry import telemetry
 import multiprocessing
-import datetime
+import threading
 import logging
+import socket
+import signal
 import time
-import ssl
 import os
 
-from pyftpdlib.authorizers import DummyAuthorizer
-from pyftpdlib.handlers import FTPHandler
-from pyftpdlib.servers import ThreadedFTPServer
-
 settings_file = "settings.json"
 
-def generate_ssl(certfile_dir, keyfile_dir, hostname="localhost"):
-    # Generate a self-signed certificate if it doesn't exist
-    if not os.path.isfile(certfile_dir) or not os.path.isfile(keyfile_dir):
-        key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-        )
-        os.makedirs(os.path.dirname(certfile_dir), exist_ok=True)
-
-        name = x509.Name([
-            x509.NameAttribute(NameOID.COMMON_NAME, u"{}".format(hostname)),
-        ])
-
-        cert = x509.CertificateBuilder().subject_name(
-            name
-        ).issuer_name(
-            name
-        ).public_key(
-            key.public_key()
-        ).serial_number(
-            x509.random_serial_number()
-        ).not_valid_before(
-            datetime.datetime.utcnow()
-        ).not_valid_after(
-            datetime.datetime.utcnow() + datetime.timedelta(days=365)
-        ).sign(key, hashes.SHA256())
-
-        # Write our certificate out to disk.
-        with open(certfile_dir, "wb") as f:
-            f.write(cert.public_bytes(serialization.Encoding.PEM))
-
-        # Write our key out to disk
-        with open(keyfile_dir, "wb") as f:
-            f.write(key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption(),
-            ))
+# The server engines "server_mode" can select, by their pyftpdlib.servers class. "prefork" is the async engine, forked into
+# "server_workers" processes, and "pool" is the async engine in "server_workers" processes started by the console, sharing
+# the port with SO_REUSEPORT
+server_modes = {
+    "threaded": "ThreadedFTPServer",
+    "async": "FTPServer",
+    "prefork": "FTPServer",
+    "pool": "FTPServer",
+}
 
-class ftps:
-    def run():
-        # Starts the FTP server in a thread
-        THREAD = multiprocessing.Process(
+class ServerPool:
+    """
+    The FTP server processes started by the console.
+
+    Every server_mode runs in one "FTPServer" process, except "pool", which starts "server_workers"
+    processes ("FTPServer-0", "FTPServer-1", ...) that each bind the same port with SO_REUSEPORT, so
+    the kernel spreads connections (and their TLS work) over all CPU cores. Workers that crash are
+    restarted by a supervisor thread until the pool is stopped.
+
+    The port is bound here, before any server process starts, and kept until the pool is killed,
+    so a restarted worker always gets the same port back.
+
+    Each process is started with a pipe to the console (see request()). Drained processes are
+    kept in draining until they exit, apart from workers, so a new server can start meanwhile.
+    pyftpdlib forks the "prefork" mode's children itself, so they have no pipe: that server is
+    drained with SIGTERM instead, which its parent passes on to them (see ftps.main()).
+
+    The access log is written here for all of them, from records they send through a queue
+    (see library.accesslog).
+
+    With "metrics_port" set, the console serves the metrics of every server process, added up,
+    for Prometheus to scrape (see collect_metrics()).
+    """
+    max_restarts = 10
+
+    def __init__(self):
+        self.workers = {}
+        self.controls = {}
+        self.draining = []
+        self.port = None
+        self.size = 0
+        self.prefork = False
+        self.listener = None
+        self._shared_listener = True
+        self.restarts = 0
+        self._running = False
+        self._lock = threading.Lock()
+        self._supervisor = None
+        self.metrics_server = None
+        self.access_log = AccessLog()
+        # The console's own metrics, served alongside the server processes'
+        self.worker_restarts = Counter("pytrain_worker_restarts_total", "Server processes restarted after they crashed.")
+        self.metrics = [
+            Gauge("pytrain_up", "Whether the FTP server is running.", lambda: int(self._running)),
+            Gauge("pytrain_workers", "Server processes that are running.", self.alive_count),
+            Gauge("pytrain_draining_workers", "Drained server processes that are still finishing their sessions.", self.draining_count),
+            self.worker_restarts,
+            # The console writes the settings for the user manager and the users command
+            *settings_lock_metrics(lambda: jmod.lock_stats(settings_file)),
+        ]
+
+    def _server_mode(self) -> str:
+        return jmod.getvalue(key='server_mode', json_dir=settings_file, default='threaded', dt=data_tables.SETTINGS_DT)
+
+    def _is_prefork(self) -> bool:
+        # pyftpdlib only forks on POSIX systems, and runs the async engine in one process elsewhere
+        return self._server_mode() == "prefork" and os.name == "posix"
+
+    def _pool_size(self) -> int:
+        if self._server_mode() != "pool":
+            return 0
+        if not hasattr(socket, "SO_REUSEPORT"):
+            print("SO_REUSEPORT is not supported on this system, so the pool will only have one worker.")
+            return 1
+        workers = jmod.getvalue(key='server_workers', json_dir=settings_file, default=0, dt=data_tables.SETTINGS_DT)
+        return workers or os.cpu_count() or 1
+
+    def _spawn(self, worker_id):
+        control, server_end = ControlClient.pipe()
+        process = multiprocessing.Process(
             target=ftps.main,
-            name="FTPServer"
+            kwargs={
+                "listener": self.listener if self._shared_listener else None,
+                "port": self.port,
+                "worker_id": worker_id,
+                "pool_size": self.size or 1,
+                "control": server_end,
+                "access_log": self.access_log.queue
+            },
+            name="FTPServer" if worker_id is None else f"FTPServer-{worker_id}"
         )
-        THREAD.start()
+        process.start()
+        # The worker has its own copy, and closing this one lets the console notice when it exits
+        server_end.close()
+        old_control = self.controls.get(worker_id)
+        if old_control is not None:
+            old_control.close()
+        self.workers[worker_id] = process
+        self.controls[worker_id] = control
+
+    def request(self, command, timeout=5.0, **args) -> list:
+        """
+        Sends a command to every running server process, through the pipe each was started with.
+
+        Args:
+            command (str): The command's name, e.g. "sessions".
+            timeout (float): Seconds to wait for each process' reply.
+            **args: The command's arguments.
+        Returns:
+            list: The reply dict of each running process.
+        """
+        with self._lock:
+            controls = [
+                (worker_id, control) for worker_id, control in self.controls.items()
+                if self.workers[worker_id].is_alive()
+            ]
+        replies = []
+        for worker_id, control in controls:
+            reply = control.request(command, timeout=timeout, **args)
+            reply.setdefault("worker_id", worker_id)
+            replies.append(reply)
+        return replies
+
+    def start(self):
+        """
+        Starts the FTP server, or every worker of the pool.
+        """
+        with self._lock:
+            self.draining = [process for process in self.draining if process.is_alive()]
+            pool_size = self.size = self._pool_size()
+            self.prefork = self._is_prefork()
+            # Pool workers each bind their own socket, unless the service manager gave us one to share
+            self._shared_listener = not pool_size or ports.inherited() is not None
+            try:
+                # Pool workers listen themselves, so this socket only reserves the port for them
+                self.listener = ftps.allocate_port(reuse_port=not self._shared_listener, listen=self._shared_listener)
+            except OSError as err:
+                print(f"Could not start the FTP server: {err}. Please change the port in the settings file.")
+                return
+            self.port = self.listener.getsockname()[1]
+
+            # Made before the server starts, so it is ready to serve as soon as the console says it has started
+            ftps.cert_manager().ensure()
+            self.access_log.start(**ftps.access_log_settings())
+            if pool_size:
+                for worker_id in range(pool_size):
+                    self._spawn(worker_id)
+            else:
+                self._spawn(None)
+            self.restarts = 0
+            self._running = True
+
+        self._serve_metrics()
+        if self._supervisor is None:
+            self._supervisor = threading.Thread(target=self._supervise, name="FTPServerSupervisor", daemon=True)
+            self._supervisor.start()
         try:
             time.sleep(0.5)
         except:
             pass
-        return THREAD
 
-    def main(use_ssl=True, prvkeyfile=None, certfile=None):
+    def _supervise(self):
+        while True:
+            time.sleep(1)
+            with self._lock:
+                if not self._running:
+                    continue
+                for worker_id, process in list(self.workers.items()):
+                    if process.is_alive() or process.exitcode == 0:
+                        continue
+                    if self.restarts >= self.max_restarts:
+                        continue
+                    self.restarts += 1
+                    self.worker_restarts.inc()
+                    print(f"{process.name} exited with code {process.exitcode}. Restarting it.")
+                    self._spawn(worker_id)
+
+    def collect_metrics(self) -> dict:
+        """
+        Gets the metrics of every running server process, added up, and the console's own.
+
+        The "prefork" mode's processes have no pipe to the console, so only the console's metrics are
+        there. Counters start from 0 in restarted processes, which Prometheus' rate() allows for.
+
+        Returns:
+            dict: The metrics, as library.metrics.Registry.collect() returns them.
+        """
+        collected = [reply["metrics"] for reply in self.request("metrics") if reply.get("ok")]
+        collected.append({metric.name: metric.collect() for metric in self.metrics})
+        return merge(collected)
+
+    def _serve_metrics(self):
+        # Started with the first server, and kept across restarts so scrapes show whether it is up
+        port = jmod.getvalue(key='metrics_port', json_dir=settings_file, default=0, dt=data_tables.SETTINGS_DT)
+        host = jmod.getvalue(key='metrics_host', json_dir=settings_file, default='127.0.0.1', dt=data_tables.SETTINGS_DT)
+        if self.metrics_server is not None:
+            if (self.metrics_server.port, self.metrics_server.host) == (port, host):
+                return
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if not port:
+            return
+        metrics_server = MetricsServer(self.collect_metrics, port, host)
+        try:
+            metrics_server.start()
+        except OSError as err:
+            print(f"Could not serve the metrics on {host}:{port}: {err}")
+            return
+        self.metrics_server = metrics_server
+
+    def alive_count(self) -> int:
+        """
+        Returns the number of server processes that are running.
+        """
+        with self._lock:
+            return sum(1 for process in self.workers.values() if process.is_alive())
+
+    def is_alive(self) -> bool:
+        """
+        Whether any server process is running.
+        """
+        return self.alive_count() > 0
+
+    def draining_count(self) -> int:
+        """
+        Returns the number of drained server processes that are still finishing their sessions.
+        """
+        with self._lock:
+            return sum(1 for process in self.draining if process.is_alive())
+
+    def _release(self):
+        # Forgets the server processes and lets go of the port. Must hold the lock
+        self._running = False
+        for control in self.controls.values():
+            control.close()
+        self.workers = {}
+        self.controls = {}
+        # The inherited socket belongs to the service manager, so it is kept for the next start
+        if self.listener is not None and self.listener is not ports.inherited():
+            self.listener.close()
+        self.listener = None
+
+    def drain(self, timeout=None) -> list:
+        """
+        Asks every server process to stop accepting connections, and to exit once its sessions have ended.
+        The port is let go straight away, so the server can be started again while they finish.
+
+        Args:
+            timeout (int): Seconds to let transfers finish before their clients are disconnected.
+                           Defaults to "drain_timeout" in the settings, which a prefork server always uses. 0 waits for them.
+        Returns:
+            list: The reply of each process, with how many sessions it has left, apart from a prefork server's.
+        """
+        with self._lock:
+            workers, controls, prefork = dict(self.workers), dict(self.controls), self.prefork
+        replies = self._drain(workers, controls, prefork, timeout)
+        with self._lock:
+            self.draining += list(self.workers.values())
+            self._release()
+        return replies
+
+    def _drain(self, workers, controls, prefork, timeout) -> list:
+        # Asks the processes that are still running to drain, returning their replies
+        replies = []
+        for worker_id, process in workers.items():
+            if not process.is_alive():
+                continue
+            if prefork:
+                # The parent of the prefork children drains them, with "drain_timeout" as their deadline, and exits
+                # once they all have. How many sessions they have left is unknown here
+                process.terminate()
+                reply = {"ok": True}
+            else:
+                reply = controls[worker_id].request("drain", deadline=timeout)
+            reply.setdefault("worker_id", worker_id)
+            replies.append(reply)
+        return replies
+
+    def restart(self, timeout=None) -> list:
+        """
+        Replaces the server processes without refusing any connection, e.g. to apply changed settings.
+
+        New processes are started on the port the old ones serve, and once they are serving, the old
+        ones are drained: their transfers go on until they finish (or timeout), and they exit.
+        Processes sharing the console's socket simply start accepting from it too. Pool workers
+        bind their own SO_REUSEPORT sockets, and each old worker accepts what is already queued on
+        its socket before closing it. A changed "port" only takes effect on a full stop and start.
+
+        Args:
+            timeout (int): Seconds to let the old processes' transfers finish. Defaults to "drain_timeout",
+                           which an old prefork server always uses.
+        Returns:
+            list: The reply of each old process, with how many sessions it has left.
+        """
+        with self._lock:
+            running = self._running and self.listener is not None
+            pool_size = self._pool_size()
+            shared_listener = not pool_size or ports.inherited() is not None
+        if not running or shared_listener != self._shared_listener:
+            # The port is bound differently for the new server mode, so it has to be let go first
+            replies = self.drain(timeout)
+            self.start()
+            return replies
+
+        with self._lock:
+            old_workers, old_controls, old_prefork = self.workers, self.controls, self.prefork
+            self.workers, self.controls = {}, {}
+            self.size = pool_size
+            self.prefork = self._is_prefork()
+            ftps.cert_manager().ensure()
+            self.access_log.start(**ftps.access_log_settings())
+            for worker_id in (range(pool_size) if pool_size else [None]):
+                self._spawn(worker_id)
+            new_controls = list(self.controls.values())
+        self._serve_metrics()
+        # A process answers once its server is listening. A prefork server closes its pipe instead, but it shares the
+        # console's listening socket, so connections wait in its backlog until one of the servers accepts them
+        for control in new_controls:
+            control.request("stats", timeout=30.0)
+
+        replies = self._drain(old_workers, old_controls, old_prefork, timeout)
+        for control in old_controls.values():
+            control.close()
+        with self._lock:
+            self.draining += list(old_workers.values())
+        return replies
+
+    def shutdown(self, timeout=10.0) -> list:
+        """
+        Asks every server process to disconnect its clients and exit, and kills those that haven't within timeout.
+
+        Returns:
+            list: The reply of each process.
+        """
+        replies = self.request("shutdown")
+        deadline = time.monotonic() + timeout
+        for process in list(self.workers.values()):
+            process.join(max(0, deadline - time.monotonic()))
+        self.kill()
+        return replies
+
+    def kill(self):
+        """
+        Kills every server process, including drained ones that haven't finished.
+        """
+        with self._lock:
+            processes = list(self.workers.values()) + self.draining
+            for process in processes:
+                if process.is_alive():
+                    process.kill()
+            for process in processes:
+                process.join()
+            self.draining = []
+            self._release()
+        # Writes what they logged before they were killed
+        self.access_log.stop()
+
+class ftps:
+    def run() -> ServerPool:
+        """
+        Starts the FTP server in its own process (or processes, with the "pool" server_mode).
+
+        Returns:
+            ServerPool: The running server processes.
+        Raises:
+            ValueError: If PYTRAIN_STORAGE names an unknown storage backend.
+        """
+        # Opened before any process starts, so an unknown backend fails here rather than in every settings read
+        jmod.store(settings_file)
+        pool = ServerPool()
+        pool.start()
+        return pool
+
+    def allocate_port(reuse_port=False, listen=True) -> socket.socket:
+        """
+        Binds the port to serve on, starting from "port" in the settings.
+        If it is taken and "autofind_port" is set, the next "port_range" ports are tried.
+
+        Args:
+            reuse_port (bool): Set SO_REUSEPORT, so pool workers can bind the port too.
+            listen (bool): Start listening on the socket.
+        Returns:
+            socket.socket: The bound socket, or the one the service manager passed in.
+        Raises:
+            OSError: If no port could be bound.
+        """
+        server_port = jmod.getvalue(key='port', json_dir=settings_file, default=6464, dt=data_tables.SETTINGS_DT)
+        autofind_port = jmod.getvalue(key='autofind_port', json_dir=settings_file, default=True, dt=data_tables.SETTINGS_DT)
+        port_range = jmod.getvalue(key='port_range', json_dir=settings_file, default=100, dt=data_tables.SETTINGS_DT)
+        return ports.allocate(
+            server_port,
+            port_range=port_range if autofind_port else 1,
+            reuse_port=reuse_port,
+            listen=listen
+        )
+
+    def cert_manager(prvkeyfile=None, certfile=None) -> CertManager:
+        """
+        Gets the CertManager for the server's certificate, as set up in the settings.
+
+        Args:
+            prvkeyfile (str): The path of the private key. Defaults to "keyfile" in the settings.
+            certfile (str): The path of the certificate. Defaults to "certfile" in the settings.
+        Returns:
+            CertManager: The certificate manager.
+        """
+        if certfile is None:
+            certfile = jmod.getvalue(key='certfile', json_dir=settings_file, default='library/ssl/certificate.pem', dt=data_tables.SETTINGS_DT)
+        if prvkeyfile is None:
+            prvkeyfile = jmod.getvalue(key='keyfile', json_dir=settings_file, default='library/ssl/private.key', dt=data_tables.SETTINGS_DT)
+        return CertManager(
+            certfile,
+            prvkeyfile,
+            key_type=jmod.getvalue(key='tls_key_type', json_dir=settings_file, default='ecdsa', dt=data_tables.SETTINGS_DT),
+            valid_days=jmod.getvalue(key='cert_valid_days', json_dir=settings_file, default=365, dt=data_tables.SETTINGS_DT),
+            renew_days=jmod.getvalue(key='cert_renew_days', json_dir=settings_file, default=30, dt=data_tables.SETTINGS_DT),
+            check_interval=jmod.getvalue(key='cert_check_interval', json_dir=settings_file, default=3600, dt=data_tables.SETTINGS_DT),
+            profile=ftps.tls_profile(),
+        )
+
+    def tls_profile() -> TLSProfile:
+        """
+        Gets the TLS profile set up in the settings.
+
+        Returns:
+            TLSProfile: The TLS profile.
+        """
+        return TLSProfile(
+            min_version=jmod.getvalue(key='tls_min_version', json_dir=settings_file, default='TLSv1.2', dt=data_tables.SETTINGS_DT),
+            ciphers=jmod.getvalue(key='tls_ciphers', json_dir=settings_file, default='', dt=data_tables.SETTINGS_DT),
+            tls13_ciphers=jmod.getvalue(key='tls13_ciphers', json_dir=settings_file, default='', dt=data_tables.SETTINGS_DT),
+            session_cache=jmod.getvalue(key='tls_session_cache', json_dir=settings_file, default=True, dt=data_tables.SETTINGS_DT),
+            session_timeout=jmod.getvalue(key='tls_session_timeout', json_dir=settings_file, default=300, dt=data_tables.SETTINGS_DT),
+            tickets=jmod.getvalue(key='tls_tickets', json_dir=settings_file, default=True, dt=data_tables.SETTINGS_DT),
+            ktls=jmod.getvalue(key='tls_ktls', json_dir=settings_file, default=True, dt=data_tables.SETTINGS_DT),
+        )
+
+    def data_policy() -> PlainDataPolicy:
+        """
+        Gets the policy for which data connections may skip TLS, as set up in the settings.
+
+        Returns:
+            PlainDataPolicy: The policy.
+        """
+        return PlainDataPolicy(
+            users=jmod.getvalue(key='plain_data_users', json_dir=settings_file, default=[], dt=data_tables.SETTINGS_DT),
+            networks=jmod.getvalue(key='plain_data_networks', json_dir=settings_file, default=[], dt=data_tables.SETTINGS_DT),
+            read_dirs=jmod.getvalue(key='plain_data_dirs', json_dir=settings_file, default=[], dt=data_tables.SETTINGS_DT),
+            listings=jmod.getvalue(key='tls_lazy_listings', json_dir=settings_file, default=False, dt=data_tables.SETTINGS_DT),
+        )
+
+    def transfer_tuning() -> TransferTuning:
+        """
+        Gets the data connection buffer sizes set up in the settings. Users may override them in their entry.
+
+        Returns:
+            TransferTuning: The buffer sizes.
+        """
+        return TransferTuning(**{
+            attribute: jmod.getvalue(key=key, json_dir=settings_file, default=getattr(TransferTuning(), attribute), dt=data_tables.SETTINGS_DT)
+            for key, attribute in TransferTuning.settings.items()
+        })
+
+    def throttle_settings() -> dict:
+        """
+        Gets the bandwidth and session limits set up in the settings.
+
+        Returns:
+            dict: Keyword arguments for Throttle and Throttle.update().
+        """
+        return {
+            attribute: jmod.getvalue(key=key, json_dir=settings_file, default=0, dt=data_tables.SETTINGS_DT)
+            for key, attribute in Throttle.settings.items()
+        }
+
+    def access_log_settings() -> dict:
+        """
+        Gets the access log's file, format and rotation set up in the settings.
+
+        Returns:
+            dict: Keyword arguments for AccessLog.start().
+        """
+        return {
+            argument: jmod.getvalue(key=key, json_dir=settings_file, default=data_tables.SETTINGS_DT[key], dt=data_tables.SETTINGS_DT)
+            for key, argument in AccessLog.settings.items()
+        }
+
+    def main(use_ssl=True, prvkeyfile=None, certfile=None, listener=None, port=None, worker_id=None, pool_size=1, control=None, access_log=None):
         '''
         Not intended to be run as a standalone script. use ftps.run() instead.
         This is a FTP server using pyftpdlib.
+
+        listener is the socket bound by ftps.run(). Workers of the "pool" server_mode are given the
+        port instead, and bind it themselves alongside each other. pool_size is how many workers
+        the pool has, which the server-wide limits are divided between. control is the process'
+        end of the console's pipe (see ServerPool.request), and access_log the queue of the
+        console's access log.
         '''
+        telemetry.init("server")
+        # pyftpdlib (and pyOpenSSL with it) is only imported by the server processes, so the console starts without it
+        from pyftpdlib.handlers import FTPHandler, DTPHandler, FileProducer
+        try:
+            from pyftpdlib.handlers import TLS_FTPHandler, TLS_DTPHandler
+        except ImportError: # pyftpdlib only has TLS support when pyOpenSSL is installed
+            TLS_FTPHandler = TLS_DTPHandler = None
+        from pyftpdlib import servers
+        from library.authorizer import PyTrainAuthorizer
+
+        if use_ssl and TLS_FTPHandler is None:
+            print("pyOpenSSL is not installed, so the FTP server is running without TLS. Install it with 'pip install pyopenssl'.")
+            use_ssl = False
         if use_ssl:
-            # Paths to the certificate and key files
-            certfile = 'library/ssl/certificate.pem' if certfile is None else certfile
-            keyfile = 'library/ssl/private.key' if prvkeyfile is None else prvkeyfile
-            ssl_exist = {
-                "prv": os.path.isfile(certfile),
-                "cert": os.path.isfile(certfile),
-                }
-            os.makedirs("library/ssl/", exist_ok=True)
-            if not ssl_exist["prv"] or not ssl_exist["cert"]:
-                generate_ssl(certfile, keyfile)
+            cert_manager = ftps.cert_manager(prvkeyfile, certfile)
+            cert_manager.ensure()
 
         root_password = jmod.getvalue(
             key='RootPassword',
@@ -94,32 +543,35 @@ class ftps:
             dt=data_tables.SETTINGS_DT
         )
 
-        authorizer = DummyAuthorizer()
-        authorizer.add_user("root", root_password, homedir=".", perm="elradfmw")
-        # Expecting a list of dicts with the following keys: username, password, ftp_dirs, perm
-        user_list = jmod.getvalue(
-            key='PyTrain_users',
+        index_file = jmod.getvalue(key='user_index_file', json_dir=settings_file, default='library/users.db', dt=data_tables.SETTINGS_DT)
+        authorizer = PyTrainAuthorizer(
+            index_file=index_file,
+            cache_size=jmod.getvalue(key='user_cache_size', json_dir=settings_file, default=1024, dt=data_tables.SETTINGS_DT),
+            verify_cache_size=jmod.getvalue(key='password_cache_size', json_dir=settings_file, default=4096, dt=data_tables.SETTINGS_DT),
+            verify_cache_ttl=jmod.getvalue(key='password_cache_ttl', json_dir=settings_file, default=300, dt=data_tables.SETTINGS_DT),
+            hash_algorithm=jmod.getvalue(key='password_hash', json_dir=settings_file, default='pbkdf2', dt=data_tables.SETTINGS_DT),
+        )
+        poll_interval = jmod.getvalue(
+            key='settings_poll_interval',
             json_dir=settings_file,
-            default={},
+            default=1.0,
             dt=data_tables.SETTINGS_DT
         )
-        for user in user_list:
-            user: dict = user_list[user]
-
-            try:
-                os.makedirs(user['home_dir'], exist_ok=True)
-            except PermissionError:
-                print(f"PermissionError: Could not create directory {user['home_dir']}.")
-                continue
-
-            # Adds the user to the authorizer
-            authorizer.add_user(
-                username=user['username'],
-                password=user['password'],
-                homedir=user['home_dir'],
-                perm=user['permissions'],
-                msg_login="Welcome to PyTrain FTP server!"
-            )
+        # Started before the users are read, so changes made after reading them are picked up by the first poll.
+        # reload_users() runs every poll_interval on the IO loop, which is the only limit on how often it checks
+        watcher = SettingsWatcher(settings_file, signature=jmod.store(settings_file).signature)
+        # Pool workers share the user index, so they take turns setting it up under its own lock.
+        # The first one writes what changed since the index was last synced, the others find it up to date.
+        # Building a large index from scratch can take minutes
+        with FileLock(f"{index_file}.lock", timeout=600).hold(exclusive=True):
+            # The user index persists between restarts, so root and anonymous are re-added in case their settings changed
+            for username in ("root", "anonymous"):
+                if authorizer.has_user(username):
+                    authorizer.remove_user(username)
+            authorizer.add_user("root", root_password, homedir=".", perm="elradfmw")
+            user_sync = UserSync(authorizer)
+            # Expecting a dict of dicts keyed by username, with the keys: username, password, home_dir, permissions
+            user_sync.sync(jmod.store(settings_file))
 
         ftpAnonAllowed = jmod.getvalue(
             key='AnonAllowed',
@@ -130,125 +582,449 @@ class ftps:
         if ftpAnonAllowed:
             authorizer.add_anonymous(".", perm="elr")
 
-        connected_users = []
-        class MyFTPHandler(FTPHandler):
+        sessions = SessionRegistry(worker_id)
+        metrics = ServerMetrics(sessions, lock_stats=lambda: jmod.lock_stats(settings_file))
+        access_logger = AccessLogger(access_log, worker_id)
+        class MyFTPHandler(TLS_FTPHandler if use_ssl else FTPHandler):
             """
             Custom FTP handler class that extends the FTPHandler class.
 
             Attributes:
-                None
+                data_policy: The PlainDataPolicy deciding which data connections may skip TLS, or None.
+                transfer_tuning: The TransferTuning of the session's data connections.
+                throttle: The Throttle giving each session its bandwidth and session limits.
+                permission_sets: The "permission_sets" table, which user limits may come from.
 
             Methods:
                 on_connect(): Method called when a client connects to the FTP server. It logs the IP address, port, and whether the connection is secure.
             """
+            data_policy = None
+            transfer_tuning = TransferTuning()
+            throttle = None
+            permission_sets = {}
+            session_limits = None
+            session = None
+            _handshake_started = None
+
             def on_connect(self):
                 """
                 Method called when a client connects to the FTP server.
 
                 It logs the IP address, port, and whether the connection is secure.
                 """
-                is_secure = self.ssl_context is not None
-                # Gets which account is logging in and sets it in the json file
-                logging.info(f"IP \"{self.remote_ip}\" with username \"{self.username}\" has connected on Port \"{self.remote_port}\". Secure: {is_secure}")
+                self.session = sessions.add(self)
+                access_logger.log("connect", self, secure=self.ssl_context is not None)
+
+            def _user_entry(self, username) -> dict:
+                # The user's "PyTrain_users" entry, kept in their authorizer record
+                record = self.authorizer.user_table.get(username) or {}
+                return record.get("pytrain", {})
+
+            def handle_auth_success(self, home, password, msg_login):
+                limits = self.throttle.session(self.username, self.remote_ip, self._user_entry(self.username), self.permission_sets)
+                if limits.max_sessions and sessions.logged_in(self.username) >= limits.max_sessions:
+                    metrics.logins.inc("refused")
+                    access_logger.log("login_refused", self, reason="max_sessions")
+                    self.respond_w_warning("421 Too many sessions for this user. Try again later.")
+                    self.close_when_done()
+                    return
+                self.session_limits = limits
+                super().handle_auth_success(home, password, msg_login)
 
             def on_login(self, username):
-                connected_users.append(username)
+                metrics.logins.inc("ok")
+                access_logger.log("login", self)
+                self.session.username = username
+                # The user's own buffer sizes, if their entry has any
+                self.transfer_tuning = self.transfer_tuning.for_user(self._user_entry(username))
+
+            def on_login_failed(self, username, password):
+                metrics.logins.inc("failed")
+                access_logger.log("login_failed", self, username=username)
+
+            def on_logout(self, username):
+                access_logger.log("logout", self, username=username)
+                self.session.username = None
+                self.session_limits = None
+
+            def on_disconnect(self):
+                # Also called for clients that just drop the connection, unlike on_logout
+                if self.session is not None:
+                    sessions.remove(self.session)
+                    access_logger.log(
+                        "disconnect", self,
+                        username=self.session.username,
+                        seconds=round(time.time() - self.session.started, 3),
+                        bytes_in=self.session.bytes_in,
+                        bytes_out=self.session.bytes_out,
+                    )
+
+            def kick(self):
+                """
+                Disconnects the client, e.g. when the console kicks it. Transfers in progress are cut off.
+                """
+                self.respond_w_warning("421 Disconnected by the server administrator.")
+                self.close_when_done()
+
+            def on_file_sent(self, file):
+                self.session.transfer = None
+
+            def on_file_received(self, file):
+                self.session.transfer = None
+
+            def on_incomplete_file_sent(self, file):
+                self.session.transfer = None
+
+            def on_incomplete_file_received(self, file):
+                self.session.transfer = None
+
+            def pre_process_command(self, line, cmd, arg):
+                self.session.active(cmd if cmd in SessionRegistry.hidden_args else line)
+                # Only commands pyftpdlib knows get here, so there is a bounded number of them
+                metrics.commands.inc(cmd)
+                super().pre_process_command(line, cmd, arg)
+
+            def process_command(self, cmd, *args, **kwargs):
+                # With a plain data policy, PASV/PORT are let through without PROT P, so TLS is required here instead
+                if self.data_policy and cmd in data_commands and not self._prot:
+                    if not self.data_policy.allows(cmd, self.username, self.remote_ip, args[0] if args else None):
+                        msg = "SSL/TLS required on the data channel."
+                        self.respond("550 " + msg)
+                        self.log_cmd(cmd, args[0] if args else "", 550, msg)
+                        return
+                if cmd in ('RETR', 'STOR', 'STOU', 'APPE'):
+                    self.session.transfer = f"{cmd} {args[0]}" if args else cmd
+                with telemetry.command(cmd):
+                    super().process_command(cmd, *args, **kwargs)
+
+            def log_transfer(self, cmd, filename, receive, completed, elapsed, bytes):
+                direction = "upload" if receive else "download"
+                metrics.transfers.inc(direction, "completed" if completed else "incomplete")
+                metrics.transfer_bytes.inc(self.username or "", direction, amount=bytes)
+                metrics.transfer_seconds.observe(elapsed, direction)
+                access_logger.transfer(self, cmd, filename, receive, completed, elapsed, bytes)
+                super().log_transfer(cmd, filename, receive, completed, elapsed, bytes)
+
+            def secure_connection(self, ssl_context):
+                self._handshake_started = time.perf_counter()
+                super().secure_connection(ssl_context)
+
+            def handle_ssl_established(self):
+                if self._handshake_started is not None:
+                    metrics.handshake_seconds.observe(time.perf_counter() - self._handshake_started, "control")
+                    self._handshake_started = None
+                super().handle_ssl_established()
+
+        class MyDTPHandler(TLS_DTPHandler if use_ssl else DTPHandler):
+            """
+            Data connection handler using the session's TransferTuning, throttled by its SessionLimits.
+
+            TLS data connections are sent with sendfile() when the kernel does the encryption (kernel TLS).
+            Plain data connections are always sent with sendfile() by pyftpdlib where the OS has it.
+            """
+            ktls = False
+            _pending_producer = None
+            _pending_close = False
+            _throttler = None
+            _handshake_started = None
+
+            def __init__(self, sock, cmd_channel):
+                self.tuning = cmd_channel.transfer_tuning
+                self.limits = cmd_channel.session_limits
+                self.tuning.apply_socket(sock)
+                super().__init__(sock, cmd_channel)
+                # Bytes per send() and recv() call
+                self.ac_in_buffer_size = self.ac_out_buffer_size = self.tuning.buffer_size
+                if getattr(cmd_channel, "_prot", False):
+                    # OpenSSL writes 16 KiB records whatever the size, and big non-blocking writes it
+                    # can only partly take end up retried, which is slower than sending less at once
+                    self.ac_out_buffer_size = min(self.ac_out_buffer_size, TransferTuning.tls_send_size)
+                if self.limits is not None:
+                    # Smaller calls keep throttled transfers smooth, rather than a burst then a long wait
+                    if self.limits.smallest_rate(True):
+                        self.ac_in_buffer_size = min(self.ac_in_buffer_size, max(4096, self.limits.smallest_rate(True) // 8))
+                    if self.limits.smallest_rate(False):
+                        self.ac_out_buffer_size = min(self.ac_out_buffer_size, max(4096, self.limits.smallest_rate(False) // 8))
 
-            def on_logout(self, username): # Does not count on disconnect. gotta time them out
-                connected_users.remove(username)
+            def send(self, data):
+                sent = super().send(data)
+                if sent:
+                    self.cmd_channel.session.bytes_out += sent
+                    if self.limits is not None:
+                        self._throttle(self.limits.consume(False, sent))
+                return sent
 
-            def get_connected_users(cls):
-                return list(connected_users)
+            def recv(self, buffer_size):
+                chunk = super().recv(buffer_size)
+                if chunk:
+                    self.cmd_channel.session.bytes_in += len(chunk)
+                    if self.limits is not None:
+                        self._throttle(self.limits.consume(True, len(chunk)))
+                return chunk
+
+            def initiate_sendfile(self):
+                # sendfile() doesn't go through send(), so its bytes are counted here
+                before = self.tot_bytes_sent
+                super().initiate_sendfile()
+                self.cmd_channel.session.bytes_out += self.tot_bytes_sent - before
+
+            def _throttle(self, wait):
+                # Stops polling the socket until the session's buckets are out of debt, as pyftpdlib's ThrottledDTPHandler does
+                if wait <= 0 or self._throttler is not None:
+                    return
+                self.del_channel()
+                self._throttler = self.ioloop.call_later(wait, self._unthrottle, _errback=self.handle_error)
+
+            def _unthrottle(self):
+                self._throttler = None
+                self.add_channel(events=self.ioloop.READ if self.receive else self.ioloop.WRITE)
+
+            def close(self):
+                if self._throttler is not None and not self._throttler.cancelled:
+                    self._throttler.cancel()
+                self._throttler = None
+                super().close()
+
+            def push_with_producer(self, producer):
+                if isinstance(producer, FileProducer):
+                    producer = self.tuning.read_ahead(producer)
+                if self.ktls and self._ssl_accepting and self.file_obj is not None:
+                    # Whether the kernel took over the encryption is only known once the handshake is done
+                    self._pending_producer = producer
+                    self._initialized = True
+                    return
+                super().push_with_producer(producer)
+
+            def close_when_done(self):
+                # Must come after the file, so it waits for it too
+                if self._pending_producer is not None:
+                    self._pending_close = True
+                    return
+                super().close_when_done()
+
+            def secure_connection(self, ssl_context):
+                self._handshake_started = time.perf_counter()
+                super().secure_connection(ssl_context)
+
+            def handle_ssl_established(self):
+                if self._handshake_started is not None:
+                    metrics.handshake_seconds.observe(time.perf_counter() - self._handshake_started, "data")
+                    self._handshake_started = None
+                super().handle_ssl_established()
+                producer, self._pending_producer = self._pending_producer, None
+                if producer is not None:
+                    self.push_with_producer(producer)
+                    if self._pending_close:
+                        self.close_when_done()
+
+            def use_sendfile(self):
+                # sendfile() sends the whole file at once, so throttled downloads go through send()
+                if self.limits is not None and self.limits.limited(False):
+                    return False
+                if self.ktls and self._ssl_established and ktls_sending(self.socket):
+                    return DTPHandler.use_sendfile(self)
+                return super().use_sendfile()
 
         handler = MyFTPHandler
         handler.authorizer = authorizer
+        handler.dtp_handler = MyDTPHandler
+        handler.transfer_tuning = ftps.transfer_tuning()
+        if not jmod.getvalue(key='use_sendfile', json_dir=settings_file, default=True, dt=data_tables.SETTINGS_DT):
+            handler.use_sendfile = False
 
         if use_ssl:
             # Create an SSL context and assign it to the handler
-            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-            ssl_context.load_cert_chain(certfile=certfile, keyfile=keyfile)
-            handler.ssl_context = ssl_context
+            cert_manager.load(handler)
 
             handler.tls_control_required = True  # Require TLS for control connection
-            handler.tls_data_required = True  # Require TLS for data connection
+            MyDTPHandler.ktls = cert_manager.profile.ktls and ktls_option() != 0
+            # Some data connections may skip TLS (and its copies through Python), as set in the plain data policy
+            handler.data_policy = ftps.data_policy()
+            handler.tls_data_required = not handler.data_policy  # Require TLS for data connection
 
-        server_port = jmod.getvalue(
-            key='port',
-            json_dir=settings_file,
-            default=6464,
-            dt=data_tables.SETTINGS_DT
-        )
+        server_mode = jmod.getvalue(key='server_mode', json_dir=settings_file, default='threaded', dt=data_tables.SETTINGS_DT)
+        if server_mode not in server_modes:
+            print(f"Unknown server_mode '{server_mode}'. Expected one of {', '.join(server_modes)}. Using 'threaded'.")
+            server_mode = 'threaded'
 
-        def test_serverport(port):
-            server = ThreadedFTPServer(("0.0.0.0", server_port), handler)
-            server.serve_forever(blocking=False)
-            server.close_all()
+        # Whether this process has a socket of its own, rather than sharing the console's
+        own_listener = listener is None
+        if listener is None and port is not None:
+            # A pool worker. SO_REUSEPORT lets every worker bind the same port, and the kernel balances connections between them
+            listener = ports.bind(port, reuse_port=True)
+        elif listener is None:
+            listener = ftps.allocate_port()
+        # The already bound socket is handed over, so the port can't be taken between finding and serving it
+        server_port = listener.getsockname()[1]
+        server = getattr(servers, server_modes[server_mode])(listener, handler)
 
-        autofind_port = jmod.getvalue(key='autofind_port', json_dir=settings_file, default=True, dt=data_tables.SETTINGS_DT)
+        # Limits are kept by each server process, so the server-wide ones are split between them
+        server_workers = jmod.getvalue(key='server_workers', json_dir=settings_file, default=0, dt=data_tables.SETTINGS_DT)
+        if server_mode == "pool":
+            processes = pool_size or 1
+        elif server_mode == "prefork" and os.name == "posix":
+            processes = server_workers or os.cpu_count() or 1
+        else:
+            processes = 1
+        handler.throttle = Throttle(processes=processes, **ftps.throttle_settings())
+        handler.permission_sets = jmod.getvalue(key='permission_sets', json_dir=settings_file, default={}, dt=data_tables.SETTINGS_DT)
+        max_cons = jmod.getvalue(key='max_cons', json_dir=settings_file, default=512, dt=data_tables.SETTINGS_DT)
+        server.max_cons = max(1, max_cons // processes) if max_cons else 0
+        server.max_cons_per_ip = jmod.getvalue(key='max_cons_per_ip', json_dir=settings_file, default=0, dt=data_tables.SETTINGS_DT)
+        # Seconds a client may stay connected without sending a command, before pyftpdlib disconnects it
+        handler.timeout = jmod.getvalue(key='idle_timeout', json_dir=settings_file, default=300, dt=data_tables.SETTINGS_DT) or None
 
-        # Checks if the port is already in use
-        while True:
+        def user_count():
+            # The users of the settings, without root and anonymous
+            return len(authorizer.user_table) - 1 - int(authorizer.has_user("anonymous"))
+
+        # Only the first pool worker announces the server
+        if worker_id in (None, 0):
+            print(f"<--FILE TRANSFER PROTOCAL {'SECURED' if use_ssl else ''} RUNNING ON \"0.0.0.0:{server_port}\" WITH {user_count()} USERS ({server_mode.upper()})-->", flush=True)
+
+        def reload_users(force=False):
+            # Only re-reads the user list if the settings file actually changed, or the console says it did
+            if not watcher.changed() and not force:
+                return
+            started = time.perf_counter()
+
+            # Applies only the users that were added, removed or changed since the last sync to the authorizer.
+            # If the settings can't be read, keep the current users rather than dropping them all
             try:
-                test_serverport(server_port)
-                break # If the port is not in use, it wont except. so we break the loop
-            except:
-                if autofind_port:
-                    server_port += 1
-                    print(f"Port taken. Trying '{server_port}'")
-                    continue
-                else:
-                    break
+                user_sync.sync(jmod.store(settings_file))
+            except TimeoutError as err:
+                # Another process holds the settings lock for long, e.g. importing users. Tried again on the next poll
+                watcher.reset()
+                if force:
+                    raise
+                print(f"Could not reload the users: {err}. Trying again shortly.", flush=True)
+                return
+            except (OSError, ValueError) as err:
+                print(f"Could not reload the users: {err}", flush=True)
+                return
+
+            # Sessions that are already logged in keep their buffer sizes and their user's limits
+            handler.transfer_tuning = ftps.transfer_tuning()
+            handler.throttle.update(**ftps.throttle_settings())
+            handler.permission_sets = jmod.getvalue(key='permission_sets', json_dir=settings_file, default={}, dt=data_tables.SETTINGS_DT)
+            if use_ssl:
+                handler.data_policy = ftps.data_policy()
+                handler.tls_data_required = not handler.data_policy
+            metrics.reload_seconds.observe(time.perf_counter() - started)
+            return {"users": user_count()}
+
+        draining = False
+
+        drain_deadline = None
+
+        def drain(deadline=None):
+            # Closing the listener ends the loop once the connections on it have ended
+            nonlocal draining, drain_deadline
+            if draining:
+                return {"sessions": len(sessions)}
+            draining = True
+            if own_listener and server_mode == "pool":
+                # The kernel gives each SO_REUSEPORT socket its own queue, and resets what is left in it when it is closed,
+                # so the connections already queued for this worker are taken on first
+                while True:
+                    try:
+                        sock, addr = server.socket.accept()
+                    except OSError:
+                        break
+                    server.handle_accepted(sock, addr)
+            server.close()
+            if deadline is None:
+                deadline = jmod.getvalue(key='drain_timeout', json_dir=settings_file, default=600, dt=data_tables.SETTINGS_DT)
+            if deadline:
+                # Transfers still going by then are cut off
+                drain_deadline = time.monotonic() + deadline
+                server.ioloop.call_later(deadline, kick, None)
+            return {"sessions": len(sessions)}
 
+        def kick(target):
+            kicked = sessions.find(target) if target is not None else sessions.find_all()
+            for session in kicked:
+                session_handler = session.handler()
+                if session_handler is not None:
+                    # Each connection is closed by the loop that serves it, which is its own thread's in the threaded mode
+                    session_handler.ioloop.call_later(0, session_handler.kick)
+            return {"kicked": len(kicked)}
 
-        server = ThreadedFTPServer(("0.0.0.0", server_port), handler)
-        print(f"<--FILE TRANSFER PROTOCAL {'SECURED' if use_ssl else ''} RUNNING ON \"0.0.0.0:{server_port}\" WITH {len(user_list)} USERS-->", flush=True)
+        # The console's commands. pyftpdlib forks prefork children itself, so they can't share the pipe, and the
+        # parent only waits for them, so the prefork mode has no control channel. It is drained with SIGTERM instead
+        control_server = None
+        if control is not None and server_mode == "prefork":
+            control.close()
+        elif control is not None:
+            control_server = ControlServer(control, server.ioloop, worker_id)
+            control_server.register("sessions", lambda: {"sessions": sessions.snapshot()})
+            control_server.register("stats", lambda: {"stats": sessions.stats(), "pid": os.getpid()})
+            control_server.register("kick", kick)
+            control_server.register("metrics", lambda: {"metrics": metrics.collect()})
+            control_server.register("reload-users", lambda: reload_users(force=True), on_loop=True)
+            control_server.register("drain", drain, on_loop=True)
+            control_server.register("shutdown", lambda: server.close_all(), on_loop=True)
+            control_server.start()
+        # Threaded connections otherwise sleep until their next timer, e.g. the idle timeout, before noticing a kick or shutdown
+        server.poll_timeout = poll_interval
 
         try:
-            while True:
-                server.serve_forever(blocking=False)
-                # Updates user list
-                user_list = jmod.getvalue(
-                    key='PyTrain_users',
-                    json_dir=settings_file,
-                    dt=data_tables.SETTINGS_DT,
-                    default={}
-                )
-
-                # Updates the authorizer
-                for user in user_list:
-                    user: dict = user_list[user]
-
-                    # Checks if the user is already in the authorizer
-                    os.makedirs(user['home_dir'], exist_ok=True)
-                    if user['username'] not in authorizer.user_table:
-                        # Adds the user to the authorizer
-                        authorizer.add_user(
-                            user['username'],
-                            user['password'],
-                            homedir=user['home_dir'],
-                            perm=user['permissions'],
-                            msg_login="Welcome to PyTrain FTP server!"
-                        )
-                    # If they are not in the json file but are in the authorizer, remove them
-                    if user['username'] in authorizer.user_table and user['username'] not in user_list:
-                        authorizer.remove_user(user['username'])
-
-                    # Checks if the user's permissions are different
-                    if user['username'] in authorizer.user_table and user['username'] in user_list:
-                        if authorizer.user_table[user['username']]['perm'] != user['permissions']:
-                            authorizer.user_table[user['username']]['perm'] = user['permissions']
-
-                        if os.path.isabs(user['home_dir']):
-                            homedir = user['home_dir']
-                        else:
-                            homedir = os.path.join(os.getcwd(), user['home_dir'])
-                        # Checks if the user's home directory is different
-                        if authorizer.user_table[user['username']]['home'] != homedir:
-                            authorizer.user_table[user['username']]['home'] = homedir
+            # The IO loop sleeps in select/epoll until there is work to do, and checks the settings file on a timer
+            def every(seconds, callback, *args):
+                # pyftpdlib cancels a timer whose callback raised, so a single failed reload would stop all later ones
+                def run():
+                    try:
+                        callback(*args)
+                    except Exception:
+                        logging.exception(f"Scheduled {callback.__name__} failed")
+                server.ioloop.call_every(seconds, run)
+
+            every(poll_interval, reload_users)
+            every(poll_interval, sessions.reap)
+            if use_ssl:
+                # Renews the certificate when it is about to expire, and swaps in a renewed one without a restart
+                every(poll_interval, cert_manager.refresh, handler)
+            if server_mode == "prefork" and os.name == "posix":
+                parent_pid = os.getpid()
+                # Shared with the forked workers, which the parent doesn't know the PIDs of
+                drain_requested = multiprocessing.RawValue("b", 0)
+
+                def request_drain(signum, frame):
+                    # The parent sits in os.wait() until every worker has exited, and exits itself once they all exited cleanly,
+                    # which drained workers do. Workers restarted after a crash see the flag too, and drain straight away
+                    drain_requested.value = 1
+
+                def check_parent():
+                    # Workers are forked by this process, so they stop when it is killed from the console
+                    if os.getppid() != parent_pid:
+                        raise KeyboardInterrupt
+                    if drain_requested.value and not draining:
+                        drain()
+
+                signal.signal(signal.SIGTERM, request_drain)
+                server.ioloop.call_every(1.0, check_parent)
+                server.serve_forever(timeout=poll_interval, handle_exit=False, worker_processes=server_workers or None)
+            else:
+                server.serve_forever(timeout=poll_interval, handle_exit=False)
+
+            # The loop ends when "drain" or "shutdown" closed the listener. Threaded connections may still be open
+            while draining:
+                sessions.reap()
+                if not len(sessions):
+                    break
+                if drain_deadline is not None and time.monotonic() > drain_deadline:
+                    # Threaded connections have their own loops, which the timer set by drain() doesn't run on
+                    kick(None)
+                    drain_deadline = None
+                time.sleep(poll_interval)
+            server.close_all()
+            if control_server is not None:
+                control_server.flush()
+            if worker_id in (None, 0):
+                print("--FILE TRANSFER PROTOCAL HAS BEEN STOPPED--", flush=True)
 
         except KeyboardInterrupt:
             server.close_all()
             print("--FILE TRANSFER PROTOCAL HAS BEEN STOPPED--")
-        # Excepts for the port being in use
-        except OSError:
-            print(f"Port {server_port} is in use. Please change the port in the settings file.")
\ No newline at end of file
+        except OSError as err:
+            print(f"The FTP server on port {server_port} stopped: {err}")
\ No newline at end of file
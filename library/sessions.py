@@ -0,0 +1,210 @@
+import threading
+import weakref
+import time
+
+class Session:
+    """
+    One client connection to a server process, from connect to disconnect.
+
+    Its counters are only written by the thread serving the connection, and read by the
+    console's requests, so they aren't locked.
+    """
+    def __init__(self, session_id, handler, worker_id=None):
+        """
+        Args:
+            session_id (str): The session's id, unique across the server's processes.
+            handler (FTPHandler): The control connection's handler.
+            worker_id (int): The pool worker serving the session, or None.
+        """
+        self.id = session_id
+        self.handler = weakref.ref(handler)
+        self.worker_id = worker_id
+        self.username = None
+        self.remote_ip = handler.remote_ip
+        self.remote_port = handler.remote_port
+        self.started = time.time()
+        self.last_active = self.started
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.command = None
+        self.transfer = None
+
+    def active(self, command=None) -> None:
+        """
+        Marks the session as active, e.g. when it sends a command.
+
+        Args:
+            command (str): The command with its argument, if it sent one.
+        """
+        self.last_active = time.time()
+        if command is not None:
+            self.command = command
+
+    def closed(self) -> bool:
+        """
+        Whether the session's connection is gone without it being removed from the registry.
+        """
+        handler = self.handler()
+        return handler is None or handler._closed
+
+    def as_dict(self) -> dict:
+        """
+        Returns:
+            dict: The session's details, which can be sent to the console.
+        """
+        now = time.time()
+        return {
+            "id": self.id,
+            "worker_id": self.worker_id,
+            "username": self.username,
+            "remote_ip": self.remote_ip,
+            "remote_port": self.remote_port,
+            "started": self.started,
+            "duration": now - self.started,
+            "idle": now - self.last_active,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "command": self.command,
+            "transfer": self.transfer,
+        }
+
+class SessionRegistry:
+    """
+    The sessions of a server process, kept from on_connect to on_disconnect.
+
+    pyftpdlib's handlers close connections that are idle for longer than their timeout, which
+    removes them here too. pyftpdlib calls on_disconnect on the server loop's next turn, which a
+    threaded connection's loop may not get to, so closed sessions are skipped when counting and
+    listing, and reap() drops them.
+    """
+    # Commands whose argument is never shown
+    hidden_args = ('PASS',)
+
+    def __init__(self, worker_id=None):
+        """
+        Args:
+            worker_id (int): The pool worker the registry is in, or None.
+        """
+        self.worker_id = worker_id
+        self.started = time.time()
+        # Connections accepted, and bytes moved by sessions that have since closed
+        self.connections = 0
+        self._closed_bytes_in = 0
+        self._closed_bytes_out = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def add(self, handler) -> Session:
+        """
+        Registers a connection that was just accepted.
+
+        Args:
+            handler (FTPHandler): The control connection's handler.
+        Returns:
+            Session: The new session.
+        """
+        with self._lock:
+            self.connections += 1
+            number = self.connections
+            session_id = str(number) if self.worker_id is None else f"{self.worker_id}-{number}"
+            session = Session(session_id, handler, self.worker_id)
+            self._sessions[session_id] = session
+        return session
+
+    def remove(self, session) -> None:
+        """
+        Unregisters a session whose connection closed.
+        """
+        with self._lock:
+            if self._sessions.pop(session.id, None) is not None:
+                self._closed_bytes_in += session.bytes_in
+                self._closed_bytes_out += session.bytes_out
+
+    def get(self, session_id):
+        """
+        Returns:
+            Session: The session with the id, or None.
+        """
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def logged_in(self, username) -> int:
+        """
+        Returns:
+            int: The number of sessions logged in as the user.
+        """
+        with self._lock:
+            return sum(1 for session in self._sessions.values() if session.username == username and not session.closed())
+
+    def reap(self) -> int:
+        """
+        Drops sessions whose connection is gone.
+
+        Returns:
+            int: The number of sessions dropped.
+        """
+        with self._lock:
+            dead = [session for session in self._sessions.values() if session.closed()]
+            for session in dead:
+                del self._sessions[session.id]
+                self._closed_bytes_in += session.bytes_in
+                self._closed_bytes_out += session.bytes_out
+        return len(dead)
+
+    def find(self, target) -> list:
+        """
+        Finds open sessions by id or username.
+
+        Args:
+            target (str): A session id, or a username.
+        Returns:
+            list: The matching sessions.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return [
+            session for session in sessions
+            if (session.id == target or session.username == target) and not session.closed()
+        ]
+
+    def find_all(self) -> list:
+        """
+        Returns:
+            list: Every open session.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return [session for session in sessions if not session.closed()]
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Totals of the process' sessions since it started.
+        """
+        with self._lock:
+            sessions = [session for session in self._sessions.values() if not session.closed()]
+            bytes_in = self._closed_bytes_in + sum(session.bytes_in for session in self._sessions.values())
+            bytes_out = self._closed_bytes_out + sum(session.bytes_out for session in self._sessions.values())
+            connections = self.connections
+        return {
+            "uptime": time.time() - self.started,
+            "connections": connections,
+            "sessions": len(sessions),
+            "logged_in": sum(1 for session in sessions if session.username is not None),
+            "transfers": sum(1 for session in sessions if session.transfer is not None),
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+        }
+
+    def snapshot(self) -> list:
+        """
+        Returns:
+            list: The details of every open session, as dicts.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return [session.as_dict() for session in sessions if not session.closed()]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
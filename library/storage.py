@@ -0,0 +1,687 @@
+from library.jmod import JsonStore, KeyPath, _copy, new_lock_stats, record_lock_wait
+import contextlib
+import threading
+import sqlite3
+import json
+import time
+import os
+
+# The settings key whose entries are each kept in a row of their own by SQLiteStore
+users_key = "PyTrain_users"
+
+# The backends PYTRAIN_STORAGE can choose
+backends = ("json", "sqlite", "snapshot")
+
+_schema = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT, version INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, entry TEXT, version INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS settings_version ON settings (version);
+CREATE INDEX IF NOT EXISTS users_version ON users (version);
+"""
+
+# A key that isn't in the document, as opposed to one that is null
+_missing = object()
+
+class SQLiteStore:
+    """
+    Keeps a settings document in an SQLite database, in WAL mode, with the same interface as JsonStore.
+
+    Each top-level key is a row of the "settings" table, and each user of "PyTrain_users" is a
+    row of the "users" table, keyed (and indexed) by username. get(), set() and delete() only
+    read and write the rows their key goes through, so reading, adding, changing or removing a
+    user costs one row however many users there are, where the JSON file is written out in full.
+    write() is given a whole document, which it compares with every row to write only those
+    that differ.
+
+    Every write bumps a version number kept in the database, and stamps the rows it wrote
+    with it. Deleted rows are kept with a NULL value, so reloading after another process
+    changed the settings only reads the rows newer than the cached version, and signature()
+    (what SettingsWatcher polls) is a single small query. The document is only cached once
+    load() is called, e.g. by the servers, and the console's row reads and writes never load it.
+
+    Readers never wait for writers in WAL mode. Writes and transactions hold SQLite's write
+    lock (BEGIN IMMEDIATE), so the document can't change between reading and writing it.
+    """
+    def __init__(self, db_path, timeout=10.0):
+        """
+        Args:
+            db_path (str): The file path of the database.
+            timeout (float): Seconds to wait for another process' write before raising TimeoutError.
+        """
+        self.path = db_path
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self.stats = new_lock_stats()
+        self._conn = None
+        self._pid = None
+        # The cached document, as of the version in _signature
+        self._data = None
+        self._signature = None
+        # What the rows written in the current write transaction are stamped with
+        self._version = None
+        self._depth = 0
+        self._dirty = False
+
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            # A forked child can't use its parent's connection, so it opens its own
+            parent_dir = os.path.dirname(self.path)
+            if parent_dir != "":
+                os.makedirs(parent_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # In WAL mode this only risks the last writes on a power cut, never a corrupt database
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_schema)
+            # The generation tells a database made afresh from the one the cache was read from
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', ?)", (os.urandom(8).hex(),))
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _read_signature(self, conn):
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        return (meta.get("generation"), meta.get("version"))
+
+    def signature(self):
+        """
+        Returns a tuple identifying the current version of the settings, or None if they can't be read.
+        """
+        with self.lock:
+            try:
+                return self._read_signature(self._connect())
+            except sqlite3.Error:
+                return None
+
+    @contextlib.contextmanager
+    def _reading(self, conn):
+        # Reads the version and the rows in one snapshot of the database
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute("BEGIN")
+        try:
+            yield
+        finally:
+            conn.execute("COMMIT")
+
+    @contextlib.contextmanager
+    def _writing(self, conn):
+        if conn.in_transaction:
+            yield
+            return
+        start = time.monotonic()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as err:
+            if "locked" not in str(err) and "busy" not in str(err):
+                raise
+            self.stats["timeouts"] += 1
+            raise TimeoutError(f"Timed out after {self.timeout}s waiting to write \"{self.path}\".")
+        waited = time.monotonic() - start
+        record_lock_wait(self.stats, waited)
+        self._version = None
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._version = None
+        conn.execute("COMMIT")
+
+    def _next_version(self, conn):
+        """
+        Returns the version to stamp written rows with. Must be called inside a write transaction.
+        """
+        # Rows written in one transaction become visible together, so they share a version, bumped on the first write
+        if self._version is None:
+            self._version = self._read_signature(conn)[1] + 1
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (self._version,))
+        return self._version
+
+    def _is_empty(self, conn) -> bool:
+        return conn.execute("SELECT 1 FROM settings WHERE value IS NOT NULL LIMIT 1").fetchone() is None
+
+    def _fetch(self, conn):
+        """
+        Brings the cached document up to date with the database, reading only the rows changed since it was last read.
+        Callers may still be using the old document, so the parts that changed are replaced rather than modified.
+
+        Returns:
+            The top-level keys and the usernames that changed, or None for both if everything was read.
+        """
+        signature = self._read_signature(conn)
+        if self._data is not None and signature == self._signature:
+            return set(), set()
+
+        if self._data is None or self._signature is None or signature[0] != self._signature[0]:
+            data = {}
+            for key, value in conn.execute("SELECT key, value FROM settings WHERE value IS NOT NULL ORDER BY rowid"):
+                data[key] = json.loads(value)
+            if isinstance(data.get(users_key), dict):
+                data[users_key] = {
+                    username: json.loads(entry)
+                    for username, entry in conn.execute("SELECT username, entry FROM users WHERE entry IS NOT NULL ORDER BY rowid")
+                }
+            self._data = data
+            self._signature = signature
+            return None, None
+
+        since = self._signature[1]
+        data = dict(self._data)
+        changed_keys = set()
+        for key, value in conn.execute("SELECT key, value FROM settings WHERE version > ?", (since,)):
+            changed_keys.add(key)
+            if value is None:
+                data.pop(key, None)
+                continue
+            value = json.loads(value)
+            if key == users_key and isinstance(value, dict):
+                # Only marks that the users are there, they are in their own table
+                value = self._data.get(key) if isinstance(self._data.get(key), dict) else {}
+            data[key] = value
+
+        changed_users = set()
+        if isinstance(data.get(users_key), dict):
+            rows = conn.execute("SELECT username, entry FROM users WHERE version > ?", (since,)).fetchall()
+            if rows:
+                users = data[users_key] = dict(data[users_key])
+                for username, entry in rows:
+                    changed_users.add(username)
+                    if entry is None:
+                        users.pop(username, None)
+                    else:
+                        users[username] = json.loads(entry)
+        self._data = data
+        self._signature = signature
+        return changed_keys, changed_users
+
+    def _read_rows(self, conn, steps):
+        """
+        Reads only the rows a key goes through, as a document of its own: the top-level key's row, and for
+        "PyTrain_users" only the row of the user named by the next step, or every user's for the whole table.
+        """
+        key = steps[0]
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] is None:
+            return {}
+        value = json.loads(row[0])
+        if key == users_key and isinstance(value, dict):
+            if len(steps) == 1:
+                value = {
+                    username: json.loads(entry)
+                    for username, entry in conn.execute("SELECT username, entry FROM users WHERE entry IS NOT NULL ORDER BY rowid")
+                }
+            else:
+                row = conn.execute("SELECT entry FROM users WHERE username = ?", (steps[1],)).fetchone()
+                if row is not None and row[0] is not None:
+                    value = {steps[1]: json.loads(row[0])}
+        return {key: value}
+
+    def _write_settings(self, conn, key, text):
+        conn.execute(
+            "INSERT INTO settings (key, value, version) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, version = excluded.version",
+            (key, text, self._next_version(conn))
+        )
+
+    def _write_users(self, conn, rows):
+        version = self._next_version(conn)
+        conn.executemany(
+            "INSERT INTO users (username, entry, version) VALUES (?, ?, ?) "
+            "ON CONFLICT (username) DO UPDATE SET entry = excluded.entry, version = excluded.version",
+            [(username, text, version) for username, text in rows]
+        )
+
+    def _clear_users(self, conn):
+        conn.execute("UPDATE users SET entry = NULL, version = ? WHERE entry IS NOT NULL", (self._next_version(conn),))
+
+    def _write_key(self, conn, key, value, old):
+        """
+        Writes a top-level key, or deletes it if value is _missing, unless its row already has that value.
+        A "PyTrain_users" dict goes to the users table, where only the users that differ are written.
+        Must be called inside a write transaction.
+
+        Args:
+            old (str): The JSON text in the key's row, or None if there is none.
+        """
+        users_table = old is not None and key == users_key and isinstance(json.loads(old), dict)
+        if key == users_key and isinstance(value, dict):
+            if users_table:
+                saved = dict(conn.execute("SELECT username, entry FROM users WHERE entry IS NOT NULL"))
+            else:
+                # Written as {} to mark that the users are in their own table
+                self._write_settings(conn, key, "{}")
+                self._clear_users(conn)
+                saved = {}
+            rows = []
+            for username, entry in value.items():
+                text = json.dumps(entry)
+                if saved.get(username) != text:
+                    rows.append((username, text))
+            rows.extend((username, None) for username in saved if username not in value)
+            if rows:
+                self._write_users(conn, rows)
+            return
+
+        text = None if value is _missing else json.dumps(value)
+        if text == old:
+            return
+        self._write_settings(conn, key, text)
+        if users_table:
+            self._clear_users(conn)
+
+    def _write_rows(self, conn, steps, data):
+        """
+        Writes back the rows _read_rows() read for a key, after data was changed. Must be called inside a write transaction.
+        """
+        key = steps[0]
+        value = data.get(key, _missing)
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        old = row[0] if row is not None else None
+        if key == users_key and len(steps) > 1 and isinstance(value, dict) and old is not None and isinstance(json.loads(old), dict):
+            # Only this user's row was read, so only it is written
+            username = steps[1]
+            row = conn.execute("SELECT entry FROM users WHERE username = ?", (username,)).fetchone()
+            text = json.dumps(value[username]) if username in value else None
+            if text != (row[0] if row is not None else None):
+                self._write_users(conn, [(username, text)])
+            return
+        self._write_key(conn, key, value, old)
+
+    def _mirror(self, steps, data):
+        # Copies what update() wrote into the transaction's document, so writing that document when it ends doesn't undo it
+        key = steps[0]
+        users = self._data.get(key)
+        if key == users_key and len(steps) > 1 and isinstance(users, dict) and isinstance(data.get(key), dict):
+            if steps[1] in data[key]:
+                users[steps[1]] = data[key][steps[1]]
+            else:
+                users.pop(steps[1], None)
+        elif key in data:
+            self._data[key] = data[key]
+        else:
+            self._data.pop(key, None)
+
+    def invalidate(self):
+        """
+        Drops the cached document so the next read loads every row again.
+        Inside a transaction this does nothing, as the cache holds the unsaved changes.
+        """
+        with self.lock:
+            if self._depth:
+                return
+            self._data = None
+            self._signature = None
+
+    def load(self, dt=None):
+        """
+        Returns the settings document, only reading the rows that changed since the last read.
+        The returned object is the cached one and must not be modified by the caller.
+
+        Args:
+            dt (dict): The dictionary to fill the database with if it is empty (default=None).
+        Returns:
+            The settings document.
+        """
+        with self.lock:
+            if self._depth and self._data is not None:
+                # Inside a transaction, keep working on the same (possibly unsaved) document
+                return self._data
+
+            conn = self._connect()
+            with self._reading(conn):
+                self._fetch(conn)
+            if not self._data and dt:
+                self.write(_copy(dt))
+            return self._data
+
+    def get(self, key, default=None, dt=None):
+        """
+        Returns the value at a key (see KeyPath), or default if it is missing. Unless the document is cached
+        (see load()), only the rows the key goes through are read, e.g. one user's for "PyTrain_users.<username>".
+        The whole user table is read through the cache, so reading it again only reads the users that changed.
+        The returned object may be the cached one and must not be modified by the caller.
+
+        Args:
+            key (str): The key in the format "parent.child1.child2[0].child3".
+            default: The value to return if the key is missing (default=None).
+            dt (dict): The dictionary to fill the database with if it is empty (default=None).
+        """
+        path = KeyPath.compile(key)
+        with self.lock:
+            if self._data is not None or path.steps == (users_key,):
+                return path.get(self.load(dt), default)
+            conn = self._connect()
+            with self._reading(conn):
+                data = self._read_rows(conn, path.steps)
+                empty = not data and dt and self._is_empty(conn)
+            if empty:
+                return path.get(self.load(dt), default)
+            return path.get(data, default)
+
+    def users_since(self, token):
+        """
+        Returns the users of "PyTrain_users" that changed since an earlier call, e.g. to keep a copy of them
+        in step. Only the rows newer than the token's version are read, without loading the document.
+
+        Args:
+            token: The token returned by the earlier call, or None.
+        Returns:
+            A tuple (token, users, complete). users maps each username that changed to their entry, or to
+            None if they were removed. If complete is True, it holds every user instead, as token was None
+            or from another database.
+        """
+        with self.lock:
+            conn = self._connect()
+            with self._reading(conn):
+                generation, version = self._read_signature(conn)
+                if token is not None and list(token)[:2] == ["sqlite", generation]:
+                    rows = conn.execute("SELECT username, entry FROM users WHERE version > ?", (token[2],))
+                    complete = False
+                else:
+                    # The users table only has entries while "PyTrain_users" is a dict, and tombstones otherwise
+                    rows = conn.execute("SELECT username, entry FROM users WHERE entry IS NOT NULL ORDER BY rowid")
+                    complete = True
+                users = {username: json.loads(entry) if entry is not None else None for username, entry in rows}
+        return ["sqlite", generation, version], users, complete
+
+    def update(self, key, mutation, dt=None):
+        """
+        Changes the value at a key under SQLite's write lock, and saves it.
+
+        mutation is given a document of only the rows the key goes through (see get()), and only
+        those rows are written, so changing a user costs the same however many users there are.
+
+        Args:
+            key (str): The key the mutation changes, in the format "parent.child1.child2[0].child3".
+            mutation (callable): Called with the document, which it changes in place.
+            dt (dict): The dictionary to fill the database with if it is empty (default=None).
+        Returns:
+            What mutation returned.
+        """
+        steps = KeyPath.compile(key).steps
+        with self.lock:
+            conn = self._connect()
+            with self._writing(conn):
+                if dt and self._is_empty(conn):
+                    self._flush(conn, _copy(dt))
+                data = self._read_rows(conn, steps)
+                result = mutation(data)
+                self._write_rows(conn, steps, data)
+                if self._depth and self._data is not None:
+                    self._mirror(steps, data)
+            return result
+
+    def set(self, key, value, dt=None):
+        """
+        Sets the value at a key, creating missing parent dicts, and saves it. The value is stored as is, not copied.
+        """
+        self.update(key, lambda data: KeyPath.compile(key).set(data, value), dt)
+
+    def delete(self, key) -> bool:
+        """
+        Removes a key, if it exists, and saves the change.
+
+        Returns:
+            bool: Whether the key existed.
+        """
+        return self.update(key, KeyPath.compile(key).delete)
+
+    def write(self, data=None):
+        """
+        Saves a document, writing only the rows that differ from the database, and makes it the cached copy.
+        Inside a transaction the write is deferred until the transaction ends.
+
+        Args:
+            data: The document to write. Defaults to the cached document, for after it was modified in place.
+        """
+        with self.lock:
+            if data is None:
+                data = self._data
+            self._data = data
+            if self._depth:
+                self._dirty = True
+                return
+            try:
+                conn = self._connect()
+                with self._writing(conn):
+                    self._flush(conn, data)
+            except Exception:
+                # The cache no longer matches what is in the database
+                self.invalidate()
+                raise
+
+    def _flush(self, conn, data):
+        """
+        Writes the rows of data that differ from the database, and makes it the cached document.
+        Must be called inside a write transaction.
+        """
+        saved = dict(conn.execute("SELECT key, value FROM settings WHERE value IS NOT NULL"))
+        for key, old in saved.items():
+            if key not in data:
+                self._write_key(conn, key, _missing, old)
+        for key, value in data.items():
+            self._write_key(conn, key, value, saved.get(key))
+        self._data = data
+        self._signature = self._read_signature(conn)
+
+    @contextlib.contextmanager
+    def transaction(self, dt=None):
+        """
+        Batches every write made inside the with block into a single SQLite transaction.
+        If the block raises, nothing is written and the cached document is dropped.
+        Transactions can be nested, only the outermost one writes.
+
+        SQLite's write lock is held for the whole block, so the settings can't be changed
+        by another process between reading and writing them.
+
+        Args:
+            dt (dict): The dictionary to fill the database with if it is empty (default=None).
+        """
+        with self.lock:
+            conn = self._connect()
+            with self._writing(conn):
+                if self._depth == 0:
+                    # Start from the latest version in the database. The whole document is only read if it is cached
+                    if self._data is not None:
+                        self._fetch(conn)
+                    if dt and self._is_empty(conn):
+                        self._flush(conn, _copy(dt))
+                self._depth += 1
+                try:
+                    yield self
+                except BaseException:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._dirty = False
+                        self.invalidate()
+                    raise
+                self._depth -= 1
+                if self._depth == 0 and self._dirty:
+                    self._dirty = False
+                    try:
+                        self._flush(conn, self._data)
+                    except BaseException:
+                        self.invalidate()
+                        raise
+
+class SnapshotStore:
+    """
+    A read-only copy of the settings, taken from another store the first time they are read.
+
+    It is never read again, so changes made meanwhile aren't seen, and it refuses every write
+    with a PermissionError. This suits servers that should run on a fixed configuration, e.g.
+    from a read-only filesystem, and never pay for watching or reloading the settings.
+    """
+    def __init__(self, source):
+        """
+        Args:
+            source: The JsonStore or SQLiteStore the snapshot is taken from.
+        """
+        self.source = source
+        self.lock = threading.RLock()
+        self.stats = new_lock_stats()
+        self._data = None
+        self._frozen = None
+        self._token = None
+
+    def exists(self) -> bool:
+        return self._frozen is not None or self.source.exists()
+
+    def signature(self):
+        # The snapshot never changes
+        return "snapshot"
+
+    def invalidate(self):
+        pass
+
+    def load(self, dt=None):
+        """
+        Returns the snapshot, taking it on the first call. A missing source is read as dt, without creating it.
+        The returned object is the cached one and must not be modified by the caller.
+        """
+        with self.lock:
+            if self._frozen is None:
+                data = self.source.load(dt) if self.source.exists() else None
+                self._frozen = _copy(data or dt or {})
+                self._data = _copy(self._frozen)
+            return self._data
+
+    def get(self, key, default=None, dt=None):
+        """
+        Returns the value at a key of the snapshot (see KeyPath), or default if it is missing.
+        """
+        return KeyPath.compile(key).get(self.load(dt), default)
+
+    def users_since(self, token):
+        """
+        Returns every user of the snapshot on the first call in a process, and no changes after that.
+        See SQLiteStore.users_since().
+        """
+        with self.lock:
+            if token is not None and token == self._token:
+                return token, {}, False
+            users = self.get(users_key)
+            # Another process' snapshot may have been taken from other settings, so its token never matches
+            self._token = ["snapshot", os.urandom(8).hex()]
+            return self._token, users if isinstance(users, dict) else {}, True
+
+    def update(self, key, mutation, dt=None):
+        raise PermissionError("The settings are a read-only snapshot. Unset PYTRAIN_STORAGE=snapshot to change them.")
+
+    def set(self, key, value, dt=None):
+        self.update(key, None, dt)
+
+    def delete(self, key) -> bool:
+        return self.update(key, None)
+
+    def write(self, data=None):
+        with self.lock:
+            # Undoes what the caller changed in place before writing
+            self._data = _copy(self._frozen) if self._frozen is not None else None
+        raise PermissionError("The settings are a read-only snapshot. Unset PYTRAIN_STORAGE=snapshot to change them.")
+
+    @contextlib.contextmanager
+    def transaction(self, dt=None):
+        """
+        Holds the snapshot's lock for the with block. Writing inside it raises PermissionError.
+        """
+        with self.lock:
+            self.load(dt)
+            yield self
+
+class storage:
+    """
+    Picks where the settings are stored, and copies them between backends.
+
+    The backend is chosen by the PYTRAIN_STORAGE environment variable ("json", "sqlite" or
+    "snapshot"), which the server processes inherit. Without it, settings.json is used, or
+    settings.db if only that exists. The SQLite database of a settings file is the same path
+    with a .db extension.
+    """
+    def sqlite_path(json_dir) -> str:
+        """
+        Returns:
+            str: The path of the SQLite database for a settings file, e.g. "settings.db" for "settings.json".
+        """
+        return os.path.splitext(json_dir)[0] + ".db"
+
+    def backend(json_dir) -> str:
+        """
+        Returns:
+            str: The backend the settings file is stored with, one of backends.
+        """
+        name = os.environ.get("PYTRAIN_STORAGE", "").strip().lower()
+        if name:
+            if name not in backends:
+                raise ValueError(f"Unknown PYTRAIN_STORAGE '{name}'. Use one of {', '.join(backends)}.")
+            return name
+        if not os.path.exists(json_dir) and os.path.exists(storage.sqlite_path(json_dir)):
+            return "sqlite"
+        return "json"
+
+    def open_store(json_dir):
+        """
+        Makes a store for a settings file, of the backend chosen by backend(). Use jmod.store() to get the shared one.
+
+        Args:
+            json_dir (str): The file path of the settings file.
+        Returns:
+            JsonStore, SQLiteStore or SnapshotStore.
+        """
+        name = storage.backend(json_dir)
+        if name == "sqlite":
+            return SQLiteStore(storage.sqlite_path(json_dir))
+        if name == "snapshot":
+            db_path = storage.sqlite_path(json_dir)
+            if not os.path.exists(json_dir) and os.path.exists(db_path):
+                return SnapshotStore(SQLiteStore(db_path))
+            return SnapshotStore(JsonStore(json_dir))
+        return JsonStore(json_dir)
+
+    def open_file(path):
+        """
+        Makes a store for a file to import from or export to, by its extension: .db, .sqlite or .sqlite3 is SQLite, anything else JSON.
+        """
+        if os.path.splitext(path)[1].lower() in (".db", ".sqlite", ".sqlite3"):
+            return SQLiteStore(path)
+        return JsonStore(path)
+
+    def path(store) -> str:
+        """
+        Returns:
+            str: The file a store keeps its settings in.
+        """
+        if isinstance(store, SnapshotStore):
+            store = store.source
+        return store.path if isinstance(store, SQLiteStore) else store.json_dir
+
+    def copy(source, target) -> dict:
+        """
+        Replaces the settings in one store with those of another, e.g. to move from JSON to SQLite.
+
+        Args:
+            source: The store to copy from.
+            target: The store to copy to. Only what differs is written to an SQLite target.
+        Returns:
+            dict: How many "settings" and "users" were copied.
+        Raises:
+            FileNotFoundError: If source has no settings to copy.
+        """
+        if os.path.abspath(storage.path(source)) == os.path.abspath(storage.path(target)):
+            raise ValueError(f"Can't copy \"{storage.path(source)}\" onto itself.")
+        if not source.exists():
+            raise FileNotFoundError(f"There are no settings in \"{storage.path(source)}\".")
+        with source.lock:
+            data = _copy(source.load())
+        with target.transaction():
+            target.write(data)
+        users = data.get(users_key)
+        return {"settings": len(data), "users": len(users) if isinstance(users, dict) else 0}
@@ -0,0 +1,116 @@
+from library.jmod import jmod, data_tables
+import contextlib
+import logging
+
+settings_file = "settings.json"
+
+# The category each FTP command is sampled by. Commands that aren't listed are "control"
+command_categories = {
+    "RETR": "transfer",
+    "STOR": "transfer",
+    "STOU": "transfer",
+    "APPE": "transfer",
+    "LIST": "listing",
+    "NLST": "listing",
+    "MLSD": "listing",
+    "MLST": "listing",
+    "STAT": "listing",
+    "USER": "login",
+    "PASS": "login",
+    "AUTH": "login",
+    "PBSZ": "login",
+    "PROT": "login",
+    "REIN": "login",
+}
+
+# Returned by command() while telemetry is off, so the serving loop doesn't make a new one per command
+_no_transaction = contextlib.nullcontext()
+
+class telemetry:
+    """
+    Error reports and performance traces sent to Sentry, if "telemetry_enabled" is set.
+
+    sentry_sdk is only imported once telemetry is enabled, so it isn't needed otherwise, and
+    hosts without it (or without network access) start without it. Each process that reports
+    calls init() itself.
+    """
+    sdk = None
+
+    def settings() -> dict:
+        """
+        Gets the telemetry settings.
+
+        Returns:
+            dict: "enabled", "dsn", "sample_rates" (by category, with "default" for the others) and "profiles_sample_rate".
+        """
+        def get(key):
+            return jmod.getvalue(key=key, json_dir=settings_file, default=data_tables.SETTINGS_DT[key], dt=data_tables.SETTINGS_DT)
+        return {
+            "enabled": get("telemetry_enabled"),
+            "dsn": get("telemetry_dsn"),
+            "sample_rates": dict(get("telemetry_sample_rates") or {}),
+            "profiles_sample_rate": get("telemetry_profiles_sample_rate"),
+        }
+
+    def init(process="console") -> bool:
+        """
+        Starts sending telemetry from this process, if it is enabled in the settings.
+
+        Args:
+            process (str): What the process is, e.g. "console" or "server", reported with its events.
+        Returns:
+            bool: Whether telemetry is on.
+        """
+        if telemetry.sdk is not None:
+            return True
+        settings = telemetry.settings()
+        if not settings["enabled"] or not settings["dsn"]:
+            return False
+        try:
+            import sentry_sdk
+        except ImportError:
+            print("telemetry_enabled is set, but sentry_sdk is not installed. Install it with 'pip install sentry-sdk'.")
+            return False
+        sample_rates = settings["sample_rates"]
+
+        def traces_sampler(sampling_context):
+            # A trace that was already sampled (or not) is kept that way
+            parent_sampled = sampling_context.get("parent_sampled")
+            if parent_sampled is not None:
+                return parent_sampled
+            op = sampling_context.get("transaction_context", {}).get("op") or ""
+            category = op.split(".", 1)[1] if op.startswith("ftp.") else op
+            return sample_rates.get(category, sample_rates.get("default", 0.0))
+
+        try:
+            sentry_sdk.init(
+                dsn=settings["dsn"],
+                traces_sampler=traces_sampler,
+                profiles_sample_rate=settings["profiles_sample_rate"],
+            )
+        except Exception as err:
+            logging.error(f"Could not start telemetry: {err}")
+            return False
+        sentry_sdk.set_tag("process", process)
+        telemetry.sdk = sentry_sdk
+        return True
+
+    def category(cmd) -> str:
+        """
+        Returns:
+            str: The sampling category of an FTP command, e.g. "transfer" for RETR.
+        """
+        return command_categories.get(cmd, "control")
+
+    def command(cmd):
+        """
+        Traces the handling of an FTP command, sampled by its category's rate.
+
+        Args:
+            cmd (str): The command, e.g. "RETR".
+        Returns:
+            A context manager to run the command in. It does nothing while telemetry is off.
+        """
+        if telemetry.sdk is None:
+            return _no_transaction
+        return telemetry.sdk.start_transaction(op=f"ftp.{telemetry.category(cmd)}", name=cmd)
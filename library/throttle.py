@@ -0,0 +1,235 @@
+import threading
+import logging
+import weakref
+import time
+
+class TokenBucket:
+    """
+    Limits a rate of bytes per second.
+
+    Bytes are always let through, but take tokens from the bucket, which refills at rate and holds
+    at most burst. Once it is empty the bucket goes into debt, and whoever adds to the debt waits
+    until it is paid off. Connections sharing a bucket wait their turn behind each other's debt,
+    so each gets a fair share of the rate rather than the fastest client taking all of it.
+    """
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (int): Bytes per second.
+            burst (int): Most bytes let through at once after being idle. Defaults to one second's worth.
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount) -> float:
+        """
+        Takes amount tokens from the bucket.
+
+        Args:
+            amount (int): Bytes just sent or received.
+        Returns:
+            float: Seconds to wait before sending or receiving more. 0 if the bucket isn't in debt.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class SessionLimits:
+    """
+    The buckets a session's data connections are throttled by, in each direction.
+    """
+    def __init__(self, throttle=None, downloads=(), uploads=(), max_sessions=0):
+        """
+        Args:
+            throttle (Throttle): The Throttle whose global buckets also apply. Looked up on each
+                                 call, as reloading the settings may add or remove them.
+            downloads (list): TokenBuckets for bytes sent to the client.
+            uploads (list): TokenBuckets for bytes received from the client.
+            max_sessions (int): Most sessions the user may have logged in at once. 0 is no limit.
+        """
+        self.throttle = throttle
+        self.downloads = list(downloads)
+        self.uploads = list(uploads)
+        self.max_sessions = max_sessions
+
+    def _buckets(self, receive) -> list:
+        buckets = self.uploads if receive else self.downloads
+        shared = None
+        if self.throttle is not None:
+            shared = self.throttle.uploads if receive else self.throttle.downloads
+        return buckets if shared is None else buckets + [shared]
+
+    def limited(self, receive) -> bool:
+        """
+        Whether the direction is limited at all. Downloads that aren't can use sendfile().
+        """
+        return bool(self._buckets(receive))
+
+    def smallest_rate(self, receive) -> int:
+        """
+        Returns:
+            int: The lowest rate limiting the direction, or 0 if it isn't limited.
+        """
+        return min((bucket.rate for bucket in self._buckets(receive)), default=0)
+
+    def consume(self, receive, amount) -> float:
+        """
+        Takes amount tokens from every bucket of the direction.
+
+        Args:
+            receive (bool): Whether the bytes were received (uploads) rather than sent (downloads).
+            amount (int): Bytes just sent or received.
+        Returns:
+            float: Seconds to wait before sending or receiving more, for the slowest bucket.
+        """
+        return max((bucket.consume(amount) for bucket in self._buckets(receive)), default=0.0)
+
+class Throttle:
+    """
+    Bandwidth limits of the server, and of each user and client IP address.
+
+    The global buckets are shared by every session. Each logged in user and each client IP
+    address also gets buckets of their own, shared by all of their sessions and kept for as long
+    as any of those sessions is open, so reconnecting doesn't refill them.
+
+    Users may have their own "download_limit", "upload_limit" and "max_sessions" in their
+    "PyTrain_users" entry, or in the permission set named by their entry's "permission_set".
+
+    Buckets are per server process, so in the "pool" and "prefork" modes every rate is divided
+    between the processes. A user or IP address whose sessions are all in one process gets that
+    process' share only. max_sessions can't be divided like that, so it is enforced per process:
+    a user may have up to max_sessions sessions in each one.
+    """
+    # Settings keys, and the attribute each one sets
+    settings = {
+        "download_limit": "download_limit",
+        "upload_limit": "upload_limit",
+        "user_download_limit": "user_download_limit",
+        "user_upload_limit": "user_upload_limit",
+        "ip_download_limit": "ip_download_limit",
+        "ip_upload_limit": "ip_upload_limit",
+        "max_sessions_per_user": "max_sessions",
+    }
+    # User entry (and permission set) keys
+    user_keys = ("download_limit", "upload_limit", "max_sessions")
+
+    def __init__(self, download_limit=0, upload_limit=0, user_download_limit=0, user_upload_limit=0,
+                 ip_download_limit=0, ip_upload_limit=0, max_sessions=0, processes=1):
+        """
+        Args:
+            download_limit (int): Bytes per second sent by the whole server. 0 is no limit.
+            upload_limit (int): Bytes per second received by the whole server. 0 is no limit.
+            user_download_limit (int): Bytes per second sent to each user, unless their entry has its own.
+            user_upload_limit (int): Bytes per second received from each user, unless their entry has its own.
+            ip_download_limit (int): Bytes per second sent to each client IP address.
+            ip_upload_limit (int): Bytes per second received from each client IP address.
+            max_sessions (int): Sessions each user may have logged in at once in this process, unless their entry has its own.
+            processes (int): Server processes the rates are divided between.
+        """
+        self.processes = max(1, processes)
+        self.downloads = None
+        self.uploads = None
+        # (kind, key, direction) to TokenBucket. Sessions hold their buckets, so a bucket goes once none use it
+        self._buckets = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self.update(download_limit, upload_limit, user_download_limit, user_upload_limit,
+                    ip_download_limit, ip_upload_limit, max_sessions)
+
+    def update(self, download_limit=0, upload_limit=0, user_download_limit=0, user_upload_limit=0,
+               ip_download_limit=0, ip_upload_limit=0, max_sessions=0) -> None:
+        """
+        Changes the limits, e.g. after the settings are reloaded. The global limits apply to open
+        sessions straight away, the others from the next login.
+        """
+        self.download_limit = download_limit
+        self.upload_limit = upload_limit
+        self.user_download_limit = user_download_limit
+        self.user_upload_limit = user_upload_limit
+        self.ip_download_limit = ip_download_limit
+        self.ip_upload_limit = ip_upload_limit
+        self.max_sessions = max_sessions
+        self.downloads = self._global_bucket(self.downloads, download_limit)
+        self.uploads = self._global_bucket(self.uploads, upload_limit)
+
+    def _rate(self, limit) -> int:
+        # This process' share of a limit
+        if not limit:
+            return 0
+        return max(1, limit // self.processes)
+
+    def _global_bucket(self, bucket, limit):
+        if not limit:
+            return None
+        rate = self._rate(limit)
+        if bucket is None:
+            return TokenBucket(rate)
+        bucket.rate = bucket.burst = rate
+        return bucket
+
+    def _bucket(self, kind, key, direction, limit):
+        rate = self._rate(limit)
+        if not rate:
+            return None
+        with self._lock:
+            bucket = self._buckets.get((kind, key, direction))
+            if bucket is None or bucket.rate != rate:
+                bucket = TokenBucket(rate)
+                self._buckets[(kind, key, direction)] = bucket
+            return bucket
+
+    def user_limits(self, user, permission_sets=None) -> dict:
+        """
+        Gets a user's own limits, from their entry or its permission set.
+
+        Args:
+            user (dict): The user's "PyTrain_users" entry.
+            permission_sets (dict): The "permission_sets" table of the settings.
+        Returns:
+            dict: The keys of user_keys that are set, with int values.
+        """
+        limits = {}
+        perm_set = (permission_sets or {}).get(user.get("permission_set")) or {}
+        for source in (perm_set, user):
+            for key in self.user_keys:
+                value = source.get(key)
+                if value is None:
+                    continue
+                try:
+                    limits[key] = int(value)
+                except (TypeError, ValueError):
+                    logging.error(f"Ignoring {key} of user {user.get('username')}: {value!r} is not a number")
+        return limits
+
+    def session(self, username, remote_ip, user=None, permission_sets=None) -> SessionLimits:
+        """
+        Gets the buckets for a session that just logged in.
+
+        Args:
+            username (str): The logged in user.
+            remote_ip (str): The client's IP address.
+            user (dict): The user's "PyTrain_users" entry, if they have one.
+            permission_sets (dict): The "permission_sets" table of the settings.
+        Returns:
+            SessionLimits: The session's buckets. The session must keep it for as long as it is open.
+        """
+        limits = self.user_limits(user, permission_sets) if user else {}
+        downloads = [
+            self._bucket("user", username, "download", limits.get("download_limit", self.user_download_limit)),
+            self._bucket("ip", remote_ip, "download", self.ip_download_limit),
+        ]
+        uploads = [
+            self._bucket("user", username, "upload", limits.get("upload_limit", self.user_upload_limit)),
+            self._bucket("ip", remote_ip, "upload", self.ip_upload_limit),
+        ]
+        return SessionLimits(
+            self,
+            downloads=[bucket for bucket in downloads if bucket is not None],
+            uploads=[bucket for bucket in uploads if bucket is not None],
+            max_sessions=limits.get("max_sessions", self.max_sessions),
+        )
@@ -0,0 +1,187 @@
+import ipaddress
+import logging
+import socket
+import os
+
+# Versions "tls_min_version" can be set to, and their pyOpenSSL constant names
+tls_versions = {
+    "TLSv1.2": "TLS1_2_VERSION",
+    "TLSv1.3": "TLS1_3_VERSION",
+}
+
+# Linux's kernel TLS socket option level and its transmit option, which Python's socket module doesn't name
+SOL_TLS = getattr(socket, "SOL_TLS", 282)
+TLS_TX = getattr(socket, "TLS_TX", 1)
+
+# FTP commands that open a data connection, and those of them that only list directories
+data_commands = ('LIST', 'NLST', 'MLSD', 'RETR', 'STOR', 'STOU', 'APPE')
+listing_commands = ('LIST', 'NLST', 'MLSD')
+
+def ktls_option() -> int:
+    """
+    Returns:
+        int: OpenSSL's SSL_OP_ENABLE_KTLS, or 0 if the OpenSSL pyOpenSSL uses is older than 3.0 and has no kernel TLS.
+    """
+    from OpenSSL import SSL
+
+    option = getattr(SSL, "OP_ENABLE_KTLS", None)
+    if option is not None:
+        return option
+    # pyOpenSSL doesn't name it, but it is bit 3 from OpenSSL 3.0 on
+    return 1 << 3 if SSL.OPENSSL_VERSION_NUMBER >= 0x30000000 else 0
+
+def ktls_sending(connection) -> bool:
+    """
+    Whether the kernel encrypts what is sent on a TLS connection, so file data can be
+    sent with sendfile() straight from the page cache.
+
+    Args:
+        connection (OpenSSL.SSL.Connection): The connection, after its handshake.
+    Returns:
+        bool: True if kernel TLS is set up for sending.
+    """
+    if os.name != "posix":
+        return False
+    try:
+        # Only answers when OpenSSL handed the connection's send keys to the kernel
+        sock = socket.socket(fileno=os.dup(connection.fileno()))
+    except OSError:
+        return False
+    try:
+        sock.getsockopt(SOL_TLS, TLS_TX, 64)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+class TLSProfile:
+    """
+    The TLS settings applied to the server's pyOpenSSL context.
+
+    FTPS data connections use the same context as the control connection they belong to, so with
+    the session cache and tickets on, a client can resume the control connection's TLS session
+    for each data connection instead of doing a full handshake every time. Pool workers each
+    have their own cache, which is enough, as a data connection is always accepted by the
+    worker that serves its control connection.
+    """
+    def __init__(self, min_version="TLSv1.2", ciphers="", tls13_ciphers="", session_cache=True,
+                 session_timeout=300, tickets=True, ktls=True):
+        """
+        Args:
+            min_version (str): The oldest TLS version allowed, "TLSv1.2" or "TLSv1.3".
+            ciphers (str): OpenSSL cipher list for TLS 1.2 and older. Empty keeps OpenSSL's default.
+            tls13_ciphers (str): OpenSSL ciphersuites for TLS 1.3. Empty keeps OpenSSL's default.
+            session_cache (bool): Keep sessions on the server, so clients can resume them by session ID.
+            session_timeout (int): Seconds a session can be resumed for.
+            tickets (bool): Allow session tickets, so clients can resume without the server's cache.
+            ktls (bool): Let OpenSSL hand encryption to the kernel (kernel TLS) where both support it,
+                         so TLS downloads can use sendfile() too.
+        """
+        if min_version not in tls_versions:
+            raise ValueError(f"Unknown TLS version '{min_version}'. Use one of {', '.join(tls_versions)}.")
+        self.min_version = min_version
+        self.ciphers = ciphers
+        self.tls13_ciphers = tls13_ciphers
+        self.session_cache = session_cache
+        self.session_timeout = session_timeout
+        self.tickets = tickets
+        self.ktls = ktls
+
+    def apply(self, context) -> None:
+        """
+        Applies the profile to a pyOpenSSL context.
+
+        Args:
+            context (OpenSSL.SSL.Context): The context to set up.
+        """
+        from OpenSSL import SSL
+
+        context.set_min_proto_version(getattr(SSL, tls_versions[self.min_version]))
+        if self.ciphers:
+            context.set_cipher_list(self.ciphers.encode("ascii"))
+        if self.tls13_ciphers:
+            if hasattr(context, "set_tls13_ciphersuites"):
+                context.set_tls13_ciphersuites(self.tls13_ciphers.encode("ascii"))
+            else:
+                logging.warning("This version of pyOpenSSL can't set TLS 1.3 ciphersuites, so 'tls13_ciphers' is ignored.")
+
+        if self.session_cache:
+            # Sessions are only resumed within the same session ID context
+            context.set_session_id(b"PyTrain")
+            context.set_session_cache_mode(SSL.SESS_CACHE_SERVER)
+            context.set_timeout(self.session_timeout)
+        else:
+            context.set_session_cache_mode(SSL.SESS_CACHE_OFF)
+        if not self.tickets:
+            context.set_options(SSL.OP_NO_TICKET)
+        if self.ktls and ktls_option():
+            # OpenSSL quietly keeps encrypting by itself if the kernel or cipher can't do it
+            context.set_options(ktls_option())
+
+class PlainDataPolicy:
+    """
+    Decides when a data connection may skip TLS, so the transfer can use sendfile() (zero copy).
+
+    The control connection is always encrypted, so passwords are never sent in plaintext.
+    A data connection may be plain for:
+    - users listed in users (e.g. "anonymous" for a public read-only area),
+    - clients connecting from one of networks (e.g. an internal network),
+    - downloads and listings under one of read_dirs,
+    - any listing, if listings is set (lazy TLS for listings).
+    """
+    def __init__(self, users=(), networks=(), read_dirs=(), listings=False):
+        """
+        Args:
+            users (list): Usernames whose data connections may be plain.
+            networks (list): Networks (e.g. "10.0.0.0/8") whose clients' data connections may be plain.
+            read_dirs (list): Directories whose files may be downloaded and listed over a plain data connection.
+            listings (bool): Whether any directory listing may use a plain data connection.
+        """
+        self.users = set(users)
+        self.networks = []
+        for network in networks:
+            try:
+                self.networks.append(ipaddress.ip_network(network, strict=False))
+            except ValueError as err:
+                logging.error(f"Ignoring plain data network '{network}': {err}")
+        self.read_dirs = [os.path.realpath(path) for path in read_dirs]
+        self.listings = listings
+
+    def __bool__(self):
+        return bool(self.users or self.networks or self.read_dirs or self.listings)
+
+    def _in_network(self, remote_ip) -> bool:
+        if not self.networks:
+            return False
+        try:
+            address = ipaddress.ip_address(remote_ip)
+        except ValueError:
+            return False
+        if getattr(address, "ipv4_mapped", None) is not None:
+            address = address.ipv4_mapped
+        return any(address in network for network in self.networks)
+
+    def _in_read_dir(self, path) -> bool:
+        path = os.path.realpath(path)
+        return any(path == read_dir or path.startswith(read_dir + os.sep) for read_dir in self.read_dirs)
+
+    def allows(self, cmd, username, remote_ip, path=None) -> bool:
+        """
+        Whether a data command may run over a plain data connection.
+
+        Args:
+            cmd (str): The FTP command, e.g. "RETR".
+            username (str): The logged in user.
+            remote_ip (str): The client's IP address.
+            path (str): The filesystem path the command works on.
+        Returns:
+            bool: True if the data connection may be plain.
+        """
+        if username in self.users or self._in_network(remote_ip):
+            return True
+        if cmd in listing_commands and self.listings:
+            return True
+        if cmd in listing_commands + ('RETR',) and path is not None and self._in_read_dir(path):
+            return True
+        return False
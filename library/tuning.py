@@ -0,0 +1,110 @@
+import logging
+import socket
+import os
+
+class TransferTuning:
+    """
+    Buffer sizes for a session's data connections.
+
+    pyftpdlib's defaults (64 KiB reads and sends) suit small files. Large transfers go faster
+    with bigger buffers, as each one takes fewer read(), send() and recv() calls.
+    """
+    # Most bytes sent per call on a TLS data connection
+    tls_send_size = 65536
+
+    # Settings (and user entry) keys, and the attribute each one sets
+    settings = {
+        "transfer_buffer_size": "buffer_size",
+        "read_ahead_size": "read_ahead_size",
+        "socket_sndbuf": "sndbuf",
+        "socket_rcvbuf": "rcvbuf",
+    }
+
+    def __init__(self, buffer_size=65536, read_ahead_size=1048576, sndbuf=0, rcvbuf=0):
+        """
+        Args:
+            buffer_size (int): Bytes sent or received per call on a data connection.
+            read_ahead_size (int): Bytes read from a file per call when sending it.
+            sndbuf (int): SO_SNDBUF of data connections. 0 keeps the OS default (and its autotuning).
+            rcvbuf (int): SO_RCVBUF of data connections. 0 keeps the OS default (and its autotuning).
+        """
+        self.buffer_size = buffer_size
+        self.read_ahead_size = read_ahead_size
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+
+    def for_user(self, user) -> "TransferTuning":
+        """
+        Applies a user's own buffer sizes over these ones.
+
+        Args:
+            user (dict): The user's "PyTrain_users" entry, which may have any of the keys in settings.
+        Returns:
+            TransferTuning: These sizes if the user has none of their own, otherwise a new TransferTuning.
+        """
+        overrides = {}
+        for key, attribute in self.settings.items():
+            value = user.get(key)
+            if value is None:
+                continue
+            try:
+                overrides[attribute] = int(value)
+            except (TypeError, ValueError):
+                logging.error(f"Ignoring {key} of user {user.get('username')}: {value!r} is not a number")
+        if not overrides:
+            return self
+        values = {attribute: getattr(self, attribute) for attribute in self.settings.values()}
+        values.update(overrides)
+        return TransferTuning(**values)
+
+    def apply_socket(self, sock) -> None:
+        """
+        Sets the socket buffer sizes of a data connection.
+        """
+        try:
+            if self.sndbuf:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+            if self.rcvbuf:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        except OSError as err:
+            logging.warning(f"Could not set the data connection's socket buffers: {err}")
+
+    def read_ahead(self, producer) -> "ReadAheadProducer":
+        """
+        Wraps a pyftpdlib FileProducer so it reads the file in read_ahead_size chunks.
+
+        Args:
+            producer (FileProducer): The producer made for a download.
+        Returns:
+            ReadAheadProducer: The producer to send instead.
+        """
+        return ReadAheadProducer(producer, self.read_ahead_size)
+
+class ReadAheadProducer:
+    """
+    A pyftpdlib FileProducer that reads in big chunks, for downloads that don't use sendfile().
+
+    asynchat sends a chunk ac_out_buffer_size bytes at a time, and slices off what was sent each
+    time. TLS sends often only take part of a slice, so chunks are handed out as memoryviews,
+    which slice without copying the rest of the chunk. The OS is also told the file is read
+    from start to end, so it reads further ahead.
+    """
+    def __init__(self, producer, read_ahead_size):
+        """
+        Args:
+            producer (FileProducer): The producer to read through.
+            read_ahead_size (int): Bytes read from the file per call.
+        """
+        self.producer = producer
+        # pyftpdlib's sendfile() path reads the file object straight from the producer
+        self.file = producer.file
+        producer.buffer_size = max(read_ahead_size, producer.buffer_size)
+        if hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(self.file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except (OSError, ValueError, AttributeError):
+                pass
+
+    def more(self):
+        data = self.producer.more()
+        return memoryview(data) if data else data
@@ -1,8 +1,19 @@
-from library.jmod import jmod, data_tables
-import re, os
+from library.jmod import jmod, data_tables, KeyPath
+from library import passwords
+from concurrent.futures import ThreadPoolExecutor
+import re, os, sys, csv, json
 
 settings_file = 'settings.json'
 
+# What usernames and permissions may be, as the user manager's prompts accept them
+username_pattern = re.compile("^[a-zA-Z0-9_.]{3,20}$")
+permissions_pattern = re.compile("^[elradfmwMT]+$")
+# Columns of an imported file that are numbers, e.g. the user's own limits and buffer sizes
+numeric_fields = (
+    "download_limit", "upload_limit", "max_sessions",
+    "transfer_buffer_size", "read_ahead_size", "socket_sndbuf", "socket_rcvbuf",
+)
+
 colours = {
     "red": "\033[91m",
     "green": "\033[92m",
@@ -44,6 +55,8 @@ class userman:
                 userman.list_users(for_cli=True)
             elif command == "5" or command == "help":
                 userman.print_help_msg()
+            elif command == "6" or command == "hashpw":
+                userman.migrate_passwords()
             elif command == "":
                 continue
             else:
@@ -73,16 +86,11 @@ class userman:
             print("Cancelling user creation.")
             return
         
-        user_dt = data_tables.NEW_USER_DT(username, password, perm, homedir)
-        user_list = userman.list_users()
-        user_list[username] = user_dt
-
-        jmod.setvalue(
-            key=f"PyTrain_users",
-            value=user_list,
-            json_dir=settings_file,
-            dt=data_tables.SETTINGS_DT,
-        )
+        try:
+            userman.bulk_upsert([{"username": username, "password": password, "home_dir": homedir, "permissions": perm}])
+        except ValueError as err:
+            print(f'{colours["red"]}{err}{colours["white"]}')
+            return
         print(f'{colours["green"]}User added successfully.{colours["white"]}')
 
     def remove_user(username=None) -> None:
@@ -99,15 +107,9 @@ class userman:
                 print("Cancelling user removal.")
                 return
             
-        user_list = userman.list_users()
-        del user_list[username]
-
-        jmod.setvalue(
-            key=f"PyTrain_users",
-            value=user_list,
-            json_dir=settings_file,
-            dt=data_tables.SETTINGS_DT,
-        )
+        if not userman.bulk_remove([username]):
+            print(f'{colours["yellow"]}The specified user does not exist.{colours["white"]}')
+            return
         print(f'{colours["green"]}User removed successfully.{colours["white"]}')
     
     def edit_user(username=None) -> None:
@@ -124,8 +126,11 @@ class userman:
                 print("Cancelling user editing.")
                 return
 
-        user_list = userman.list_users()
-        user = user_list[username]
+        user = userman.get_user(username)
+        if user is None:
+            print(f'{colours["yellow"]}The specified user does not exist.{colours["white"]}')
+            return False
+        original_username = username
 
         processed_homedir = str(user['home_dir'])
         # Determines if the homedir is an absolute path or a local user directory
@@ -139,7 +144,7 @@ class userman:
                 print(f"Editing user '{username}'")
                 print(f"Current home directory: {processed_homedir}")
                 print(f"Current permissions: {user['permissions']}")
-                print('Type "password" to reveal/change the password.')
+                print('Type "password" to change the password.')
                 print('\nWhich field would you like to edit? (username/homedir/perm/password)')
                 field = input(">>> ").lower()
                 if field not in acceptables:
@@ -147,11 +152,14 @@ class userman:
                     continue
 
                 if field == "password":
-                    print(f"Current password: {user['password']}")
+                    if passwords.is_hashed(user['password']):
+                        print("The current password is stored hashed, so it can't be shown.")
+                    else:
+                        print(f"Current password: {user['password']}")
                     command = input("Would you like to change the password? (y/n) ").lower()
                     if "y" in command:
                         print("Enter the new password.")
-                        user['password'] = userman.get_data.password()
+                        user['password'] = userman.hash_password(userman.get_data.password())
                     else:
                         print("Password not changed.")
                 elif field == "homedir":
@@ -161,11 +169,9 @@ class userman:
                     print("Enter the new permissions.")
                     user['permissions'] = userman.get_data.perms()
                 elif field == "username":
-                    del user_list[username]
                     print("Enter the new username.")
                     username = userman.get_data.username()
-                    user_list[username] = user
-                    user_list[username]['username'] = username
+                    user['username'] = username
                 else:
                     print("Invalid field. Please try again.")
                     continue
@@ -173,18 +179,312 @@ class userman:
                 print("Would you like to save the changes? (y/n)")
                 command = input(">>> ").lower()
                 if command in ["y", "yes", ""]: # Default to yes
-                    jmod.setvalue(
-                        key=f"PyTrain_users",
-                        value=user_list,
-                        json_dir=settings_file,
-                        dt=data_tables.SETTINGS_DT,
-                    )
+                    # Only this user's entry is written
+                    with jmod.transaction(settings_file, dt=data_tables.SETTINGS_DT):
+                        if username != original_username:
+                            jmod.delvalue(userman.user_key(original_username), settings_file)
+                        jmod.setvalue(
+                            key=userman.user_key(username),
+                            value=user,
+                            json_dir=settings_file,
+                            dt=data_tables.SETTINGS_DT,
+                        )
                     print(f'{colours["green"]}User edited successfully.{colours["white"]}')
                     return True
                 else:
                     print("Changes not saved.")
                     return False
 
+    def bulk_upsert(users, workers=None) -> dict:
+        '''
+        Adds or updates many users at once, e.g. from an imported file.
+
+        Every record is checked before anything is changed, so either all of them are saved or none
+        are. Passwords are hashed and home directories made on a pool of threads before the settings
+        are locked, so other processes can still read them meanwhile. The lock is only held to merge
+        the records into the current users and write them, and only the imported users are read and
+        written, not the whole user table.
+
+        Args:
+            users: An iterable of user dicts, with a "username" and optionally "password", "home_dir",
+                   "permissions" and "permission_set", and the user's own limits (e.g. "download_limit").
+                   New users need a password. Existing users keep what a record leaves out.
+            workers: The number of threads. Defaults to one per CPU core.
+
+        Returns:
+            dict: The usernames that were "added" and "updated".
+
+        Raises:
+            ValueError: If any record is invalid, with every problem found.
+        '''
+        users = list(users)
+        permission_sets = jmod.getvalue(key="permission_sets", json_dir=settings_file, default={}, dt=data_tables.SETTINGS_DT)
+        algorithm = jmod.getvalue(key="password_hash", json_dir=settings_file, default="pbkdf2", dt=data_tables.SETTINGS_DT)
+
+        errors = []
+        seen = set()
+        records = []
+        for number, user in enumerate(users, start=1):
+            if not isinstance(user, dict):
+                errors.append(f"Record {number}: expected a user with a username, not a {type(user).__name__}")
+                continue
+            username = user.get("username")
+            username = username.strip() if isinstance(username, str) else ""
+            # JSON files can have numbers, lists or objects anywhere
+            problems = [
+                f"{key} must be text"
+                for key in ("username", "password", "home_dir", "permissions", "permission_set")
+                if user.get(key) is not None and not isinstance(user[key], str)
+            ]
+            if problems:
+                errors.append(f"Record {number} ({username or 'no username'}): {'; '.join(problems)}")
+                continue
+            if not username_pattern.match(username):
+                problems.append("the username must be 3-20 letters, numbers, full stops (periods) or underscores")
+            elif username in seen:
+                problems.append("the username is listed more than once")
+            seen.add(username)
+            # Checked against the user as they are now. Whether they exist is checked again under the lock
+            existing = userman.get_user(username)
+            password = user.get("password") or None
+            if password is None and existing is None:
+                problems.append("new users need a password")
+            elif password is not None and not passwords.is_hashed(password) and len(password) < 4:
+                problems.append("the password must be at least 4 characters long")
+            perm_set = user.get("permission_set") or None
+            if perm_set is not None and perm_set not in permission_sets:
+                problems.append(f"there is no permission set '{perm_set}'")
+            permissions = user.get("permissions") or None
+            if permissions is None and perm_set in permission_sets:
+                permissions = permission_sets[perm_set]["permissions"]
+            if permissions is not None and not permissions_pattern.match(permissions):
+                problems.append(f"invalid permissions '{permissions}'")
+            extras = {}
+            for key, value in user.items():
+                if key is None:
+                    # csv.DictReader puts the fields past the header's under None
+                    problems.append("the row has more fields than the header")
+                    continue
+                if key in ("username", "password", "home_dir", "permissions") or value in (None, ""):
+                    continue
+                if key in numeric_fields:
+                    try:
+                        value = int(value)
+                    except (TypeError, ValueError):
+                        problems.append(f"{key} must be a number")
+                        continue
+                extras[key] = value
+            if problems:
+                errors.append(f"Record {number} ({username or 'no username'}): {'; '.join(problems)}")
+                continue
+            home_dir = userman.resolve_homedir(username, user.get("home_dir"))
+            if home_dir is None and existing is None:
+                home_dir = f"ftp_dir/{username}"
+            records.append((username, password, home_dir, permissions, extras))
+        if errors:
+            raise ValueError("\n".join(errors))
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            # hashlib lets go of the GIL while hashing, so the threads hash in parallel
+            hashes = list(executor.map(
+                lambda password: password if password is None or passwords.is_hashed(password) else passwords.hash_password(password, algorithm=algorithm),
+                [password for _, password, _, _, _ in records]
+            ))
+            home_dirs = {home_dir for _, _, home_dir, _, _ in records if home_dir is not None}
+            dir_errors = [
+                f"Could not make the home directory {home_dir}: {err}"
+                for home_dir, err in zip(home_dirs, executor.map(userman._make_dir, home_dirs)) if err is not None
+            ]
+        if dir_errors:
+            raise ValueError("\n".join(dir_errors))
+
+        with jmod.transaction(settings_file, dt=data_tables.SETTINGS_DT):
+            # Read again under the lock, so users changed meanwhile by another process are kept
+            entries = {}
+            added, updated = [], []
+            for (username, _, home_dir, permissions, extras), password in zip(records, hashes):
+                existing = userman.get_user(username)
+                if existing is None:
+                    if password is None:
+                        errors.append(f"{username}: new users need a password (it was removed while importing)")
+                        continue
+                    if home_dir is None:
+                        home_dir = f"ftp_dir/{username}"
+                        err = userman._make_dir(home_dir)
+                        if err is not None:
+                            errors.append(f"Could not make the home directory {home_dir}: {err}")
+                            continue
+                    entries[username] = dict(data_tables.NEW_USER_DT(username, password, permissions, home_dir), **extras)
+                    added.append(username)
+                    continue
+                existing.update(extras)
+                if password is not None:
+                    existing["password"] = password
+                if home_dir is not None:
+                    existing["home_dir"] = home_dir
+                if permissions is not None:
+                    existing["permissions"] = permissions
+                entries[username] = existing
+                updated.append(username)
+            if errors:
+                # Leaves the transaction without writing anything
+                raise ValueError("\n".join(errors))
+
+            for username, entry in entries.items():
+                jmod.setvalue(
+                    key=userman.user_key(username),
+                    value=entry,
+                    json_dir=settings_file,
+                    dt=data_tables.SETTINGS_DT,
+                )
+        return {"added": added, "updated": updated}
+
+    def bulk_remove(usernames) -> list:
+        '''
+        Removes many users at once, writing the settings once. Only their entries are read and written.
+
+        Args:
+            usernames: An iterable of usernames. Those that don't exist are skipped.
+
+        Returns:
+            list: The usernames that were removed.
+        '''
+        removed = []
+        with jmod.transaction(settings_file, dt=data_tables.SETTINGS_DT):
+            for username in usernames:
+                if jmod.delvalue(userman.user_key(username), settings_file):
+                    removed.append(username)
+        return removed
+
+    def read_users_file(path) -> list:
+        '''
+        Reads users to import from a CSV file with a header row (e.g. "username,password,home_dir,permissions"),
+        or a JSON file of a list of users or a "PyTrain_users" style dict keyed by username.
+
+        Args:
+            path: The file's path. "-" reads CSV from standard input.
+
+        Returns:
+            list: The user dicts, for bulk_upsert().
+        '''
+        if path == "-":
+            return list(csv.DictReader(sys.stdin))
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            if path.lower().endswith(".json"):
+                data = json.load(f)
+                if isinstance(data, dict):
+                    # Anything that isn't a user is left for bulk_upsert() to report
+                    return [dict(user, username=user.get("username", username)) if isinstance(user, dict) else user for username, user in data.items()]
+                if not isinstance(data, list):
+                    raise ValueError(f"{path} must have a list of users, or users keyed by username.")
+                return data
+            return list(csv.DictReader(f))
+
+    def resolve_homedir(username, homedir):
+        '''
+        Turns a home directory as it is typed or imported into the one to store.
+
+        Args:
+            username: The user's username.
+            homedir: The home directory. "local" is a directory named after the user, and a leading "~"
+                     is the current working directory. None keeps the user's current one.
+
+        Returns:
+            str: The home directory, or None.
+        '''
+        if homedir is None or homedir == "":
+            return None
+        if not isinstance(homedir, str):
+            raise ValueError(f"The home directory must be text, not {homedir!r}.")
+        if homedir in ("local", "<>local_user<>"):
+            return f"ftp_dir/{username}"
+        if homedir.startswith("~"):
+            return os.path.join(os.getcwd(), homedir[1:].lstrip("/\\"))
+        return homedir
+
+    def _make_dir(path):
+        # Returns the error rather than raising, so every directory is tried
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as err:
+            return err
+        return None
+
+    def hash_password(password) -> str:
+        '''
+        Hashes a password with the algorithm set by "password_hash" in the settings.
+
+        Args:
+            password: The plaintext password.
+
+        Returns:
+            str: The salted hash to store in place of the password.
+        '''
+        algorithm = jmod.getvalue(
+            key="password_hash",
+            json_dir=settings_file,
+            default="pbkdf2",
+            dt=data_tables.SETTINGS_DT
+        )
+        return passwords.hash_password(password, algorithm=algorithm)
+
+    def migrate_passwords() -> int:
+        '''
+        Replaces every plaintext password in the settings file with a salted hash.
+        Users keep logging in with the same passwords.
+
+        The passwords are hashed from a copy of the users, without holding the settings lock, as that can take
+        minutes for many users. They are then saved in one short transaction, except for users whose password
+        was changed (or who were removed) in the meantime.
+
+        Returns:
+            int: The number of passwords that were hashed.
+        '''
+        hashed = {}
+        for username, user in userman.list_users().items():
+            # Malformed entries are left as they are
+            if isinstance(user, dict) and isinstance(user.get('password'), str) and not passwords.is_hashed(user['password']):
+                hashed[username] = (user['password'], userman.hash_password(user['password']))
+
+        migrated = 0
+        with jmod.transaction(settings_file, dt=data_tables.SETTINGS_DT):
+            for username, (password, hashed_password) in hashed.items():
+                user = userman.get_user(username)
+                if not isinstance(user, dict) or user.get('password') != password:
+                    continue
+                jmod.setvalue(
+                    key=f"{userman.user_key(username)}.password",
+                    value=hashed_password,
+                    json_dir=settings_file,
+                    dt=data_tables.SETTINGS_DT,
+                )
+                migrated += 1
+        print(f'{colours["green"]}Hashed {migrated} plaintext password(s).{colours["white"]}')
+        return migrated
+
+    def user_key(username) -> str:
+        '''
+        The settings key of a user's entry, e.g. "PyTrain_users.john\\.doe" for "john.doe".
+        '''
+        return f"PyTrain_users.{KeyPath.escape(username)}"
+
+    def get_user(username):
+        '''
+        Reads one user's entry, without reading every user from an SQLite store.
+
+        Args:
+            username: The username of the user.
+
+        Returns:
+            dict: A copy of the user's entry, or None if there is no such user.
+        '''
+        return jmod.getvalue(
+            key=userman.user_key(username),
+            json_dir=settings_file,
+            default=None,
+            dt=data_tables.SETTINGS_DT
+        )
+
     def list_users(for_cli=False) -> dict:
         '''
         Lists all users on the FTP server.
@@ -225,6 +525,7 @@ class userman:
 
         print("4. List users: Lists all users on the FTP server.")
         print("5. Help: Prints this help message.")
+        print("6. Hash passwords: Replaces plaintext passwords saved by older versions with hashes.")
 
     class get_data:
         '''
@@ -251,15 +552,12 @@ class userman:
                     continue
                 else:
                     if only_existing is True:
-                        try:
-                            userlist = userman.list_users()
-                            userlist[username]
-                        except KeyError:
+                        if userman.get_user(username) is None:
                             print("The specified user does not exist.")
                             continue
                         return username
                     else:
-                        if username in dict(jmod.getvalue(json_dir=settings_file, dt=data_tables.SETTINGS_DT, key="PyTrain_users", default={})).keys():
+                        if userman.get_user(username) is not None:
                             print("The specified user already exists. Please try again.")
                             continue
                     return username
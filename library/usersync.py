@@ -0,0 +1,227 @@
+from library import passwords
+from library.jmod import KeyPath
+from library.storage import users_key
+import contextlib
+import logging
+import hmac
+import os
+
+def _without_password(user):
+    return {key: value for key, value in user.items() if key != "password"}
+
+class UserSync:
+    """
+    Keeps an authorizer's user table in step with the "PyTrain_users" table of the settings.
+
+    sync() asks the settings store for the users that changed since the last sync, by the token
+    the store gave it then, and only the users that were added, removed or changed are touched.
+    An SQLite store answers from its row versions, so a reload costs O(changes) however many
+    users there are. A JSON file has no row versions, so once it changed every user is compared,
+    in one pass over the user table.
+
+    Each authorizer record also stores the settings entry it was made from (under "pytrain"),
+    which is what users are compared with, so no other copy of the users is kept. A persistent
+    user table (PyTrainAuthorizer's UserIndex) also keeps the token of its last sync, so on start
+    only the users that changed while the server was stopped are read and written.
+
+    Authorizers with a stored_password() method (PyTrainAuthorizer) only store password hashes,
+    also in that copy of the entry. A plaintext password in the settings then matches the
+    stored hash if it verifies against it, which costs one slow hash per such user, once per process.
+    """
+    def __init__(self, authorizer, msg_login="Welcome to PyTrain FTP server!"):
+        """
+        Args:
+            authorizer: The pyftpdlib authorizer to keep up to date.
+            msg_login (str): The login message given to added users.
+        """
+        self.authorizer = authorizer
+        self.msg_login = msg_login
+        self._stored_password = getattr(authorizer, "stored_password", str)
+        # The token of this process' last sync, and the users it couldn't load, to try again on the next one
+        self._token = None
+        self._failed = set()
+        # Plaintext passwords that verified against their stored hash, by a keyed digest rather than the password
+        self._digest_key = os.urandom(16)
+        self._verified = {}
+
+    def _make_record(self, username, user) -> dict:
+        """
+        Builds the authorizer's user_table record for a settings entry, as DummyAuthorizer.add_user would.
+        Raises KeyError, TypeError or ValueError if the entry is malformed.
+        """
+        if not isinstance(user, dict):
+            raise TypeError(f"its entry is a {type(user).__name__}, not an object")
+        for field in ("password", "permissions", "home_dir"):
+            if not isinstance(user[field], str):
+                raise TypeError(f"its {field} is a {type(user[field]).__name__}, not a string")
+        for perm in user['permissions']:
+            if perm not in self.authorizer.read_perms + self.authorizer.write_perms:
+                raise ValueError(f"no such permission {perm!r}")
+        password = self._stored_password(user['password'])
+        return {
+            'pwd': password,
+            'home': os.path.realpath(user['home_dir']),
+            'perm': user['permissions'],
+            'operms': {},
+            'msg_login': self.msg_login,
+            'msg_quit': "Goodbye.",
+            'pytrain': dict(user, password=password),
+        }
+
+    def _same_password(self, username, old, new) -> bool:
+        if old == new:
+            return True
+        # The record may have the hash stored for a plaintext password that is still in the settings
+        if not (isinstance(new, str) and passwords.is_hashed(old) and not passwords.is_hashed(new)):
+            return False
+        digest = hmac.new(self._digest_key, new.encode(), "sha256").digest()
+        if self._verified.get(username) == (old, digest):
+            return True
+        if not passwords.verify_password(old, new):
+            return False
+        self._verified[username] = (old, digest)
+        return True
+
+    def _compare(self, username, record, user, changes):
+        # Adds a user whose record is in the table to the lists of what their settings entry changes
+        if self._stored_password is not str and record["pwd"] and not passwords.is_hashed(record["pwd"]):
+            # Records from before passwords were hashed in the index are written again
+            changes["password"].append(username)
+            return
+        if not isinstance(user, dict):
+            # Malformed. Reported, and the old record kept, by apply()
+            changes["other"].append(username)
+            return
+        old_user = record["pytrain"]
+        if old_user == user:
+            return
+        changed = False
+        for field in ("permissions", "home_dir"):
+            if old_user.get(field) != user.get(field):
+                changes[field].append(username)
+                changed = True
+        if not self._same_password(username, old_user.get("password"), user.get("password")):
+            changes["password"].append(username)
+            changed = True
+        if not changed and _without_password(old_user) != _without_password(user):
+            changes["other"].append(username)
+
+    def diff(self, users, complete=True) -> dict:
+        """
+        Compares users against their records in the authorizer.
+
+        Args:
+            users (dict): The "PyTrain_users" table, keyed by username. If complete is False, only the users
+                          that changed, with None for those that were removed.
+            complete (bool): Whether users is the whole table, so users that aren't in it were removed.
+        Returns:
+            dict: Lists of usernames under "added", "removed", "permissions", "home_dir", "password"
+                  and "other" (any other field of their entry, e.g. buffer sizes).
+        """
+        changes = {"added": [], "removed": [], "permissions": [], "home_dir": [], "password": [], "other": []}
+        user_table = self.authorizer.user_table
+        if complete:
+            # One pass over the records, rather than a lookup per user. Those without a settings entry are root and anonymous
+            seen = set()
+            for username, record in user_table.items():
+                if "pytrain" not in record:
+                    continue
+                if username not in users:
+                    changes["removed"].append(username)
+                    continue
+                seen.add(username)
+                self._compare(username, record, users[username], changes)
+            changes["added"] = [username for username in users if username not in seen]
+            return changes
+
+        for username, user in users.items():
+            record = user_table.get(username)
+            if user is None:
+                if record is not None and "pytrain" in record:
+                    changes["removed"].append(username)
+            elif record is None or "pytrain" not in record:
+                changes["added"].append(username)
+            else:
+                self._compare(username, record, user, changes)
+        return changes
+
+    def apply(self, users, complete=True) -> dict:
+        """
+        Applies the differences between users and their records to the authorizer.
+
+        Args:
+            users (dict): The "PyTrain_users" table, or only the users that changed, as given to diff().
+            complete (bool): Whether users is the whole table, so users that aren't in it were removed.
+        Returns:
+            dict: The changes that were applied, as returned by diff().
+        """
+        changes = self.diff(users, complete)
+        user_table = self.authorizer.user_table
+        updated = set(changes["permissions"] + changes["password"] + changes["home_dir"] + changes["other"])
+        # Only new users and moved home directories need the filesystem
+        needs_dir = set(changes["added"] + changes["home_dir"])
+
+        # Writes every change in one go if the user table supports it (UserIndex)
+        batch = getattr(user_table, "batch", contextlib.nullcontext)
+        with batch():
+            for username in changes["removed"]:
+                try:
+                    del user_table[username]
+                except KeyError:
+                    # Already gone, e.g. removed by another pool worker sharing the user index
+                    pass
+                self._failed.discard(username)
+                self._verified.pop(username, None)
+
+            for username in changes["added"] + sorted(updated):
+                user = users[username]
+                try:
+                    record = self._make_record(username, user)
+                    if username in needs_dir:
+                        os.makedirs(user['home_dir'], exist_ok=True)
+                    user_table[username] = record
+                except (KeyError, OSError, TypeError, ValueError) as err:
+                    # Tried again on the next sync. A malformed entry only skips its user
+                    problem = f"its entry has no {err}" if isinstance(err, KeyError) else err
+                    print(f"Could not load user {username}: {problem}")
+                    self._failed.add(username)
+                    continue
+                self._failed.discard(username)
+
+        if changes["added"] or changes["removed"] or updated:
+            logging.info(
+                f"Users reloaded: {len(changes['added'])} added, {len(changes['removed'])} removed, {len(updated)} updated."
+            )
+        return changes
+
+    def sync(self, store) -> dict:
+        """
+        Applies the users that changed in a settings store since the last sync. Every user is compared on the
+        first sync of a user table that doesn't keep a token, or has one from other settings.
+
+        Args:
+            store: The settings store, see jmod.store().
+        Returns:
+            dict: The changes that were applied, as returned by diff().
+        """
+        user_table = self.authorizer.user_table
+        token = self._token
+        if token is None and hasattr(user_table, "get_meta"):
+            token = user_table.get_meta("settings_token")
+        token, users, complete = store.users_since(token)
+        if not complete and self._failed:
+            # They may have failed for reasons outside the settings, e.g. permissions on their home directory
+            users = dict(users)
+            for username in self._failed - users.keys():
+                users[username] = store.get(f"{users_key}.{KeyPath.escape(username)}")
+        # Other processes sharing the user table may have written these records already, so cached ones are stale
+        forget = getattr(user_table, "forget", None)
+        if forget is not None:
+            forget(None if complete else users)
+
+        changes = self.apply(users, complete)
+        if hasattr(user_table, "set_meta") and not self._failed:
+            # Not saved while users are failing, so a restart tries them again with the changes since the saved token
+            user_table.set_meta("settings_token", token)
+        self._token = token
+        return changes
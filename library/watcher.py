@@ -0,0 +1,46 @@
+from library.jmod import file_signature
+import logging
+
+# Differs from any signature, including None for a missing file
+_unknown = object()
+
+class SettingsWatcher:
+    """
+    Watches a settings file for changes without re-reading it.
+
+    The file is only stat()ed, each time the caller checks it, e.g. once per poll of the
+    server's loop. A change is reported when its modification time, size or inode differs
+    from the last seen value, which also catches the file being replaced by a rename.
+
+    Settings that aren't kept in a single file (e.g. an SQLiteStore) give their own signature
+    function, which is called instead of stat().
+    """
+    def __init__(self, path, signature=None):
+        """
+        Args:
+            path (str): The file path of the settings file to watch.
+            signature (callable): Returns a value that changes whenever the settings do. Defaults to stat()ing path.
+        """
+        self.path = path
+        self.signature = signature or (lambda: file_signature(self.path))
+        self._signature = self.signature()
+
+    def changed(self) -> bool:
+        """
+        Checks if the settings file changed since the last call.
+
+        Returns:
+            bool: True if the file was modified, created, replaced or removed.
+        """
+        signature = self.signature()
+        if signature == self._signature:
+            return False
+        logging.debug(f"Settings file \"{self.path}\" changed on disk.")
+        self._signature = signature
+        return True
+
+    def reset(self) -> None:
+        """
+        Makes the next check report a change, e.g. when the last one couldn't be applied.
+        """
+        self._signature = _unknown
@@ -0,0 +1,24 @@
+import sys
+import os
+import pytest
+
+# The tests import the project's modules as the console does, from the project directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library import passwords
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs a test in an empty directory, as the settings file and home directories are relative to it.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("PYTRAIN_STORAGE", raising=False)
+    return tmp_path
+
+@pytest.fixture
+def fast_hashes(monkeypatch):
+    """
+    Hashes passwords with few iterations, so tests that hash many of them stay quick.
+    """
+    monkeypatch.setattr(passwords, "PBKDF2_ITERATIONS", 1000)
@@ -0,0 +1,69 @@
+from library.jmod import jmod, FileLock
+import multiprocessing
+import threading
+import pytest
+
+def _increment(json_dir, times):
+    for _ in range(times):
+        with jmod.transaction(json_dir, dt={}):
+            jmod.setvalue("count", json_dir, jmod.getvalue("count", json_dir, default=0) + 1)
+
+def test_transactions_of_several_processes_lose_no_writes(workdir):
+    json_dir = str(workdir / "settings.json")
+    processes = [multiprocessing.Process(target=_increment, args=(json_dir, 10)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    jmod.store(json_dir).invalidate()
+    assert jmod.getvalue("count", json_dir) == 40
+
+def test_transactions_of_several_threads_lose_no_writes(workdir):
+    json_dir = str(workdir / "settings.json")
+    threads = [threading.Thread(target=_increment, args=(json_dir, 10)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert jmod.getvalue("count", json_dir) == 40
+
+def test_file_lock_times_out_while_another_holds_it(workdir):
+    path = str(workdir / "settings.json.lock")
+    holder = FileLock(path)
+    waiter = FileLock(path, timeout=0.05)
+    with holder.hold(exclusive=True):
+        with pytest.raises(TimeoutError):
+            with waiter.hold():
+                pass
+    assert waiter.stats["timeouts"] == 1
+    with waiter.hold():
+        pass
+    assert waiter.stats["acquired"] == 1
+
+def test_shared_holders_do_not_block_each_other(workdir):
+    path = str(workdir / "settings.json.lock")
+    with FileLock(path).hold():
+        with FileLock(path, timeout=0.05).hold():
+            pass
+
+def test_getvalue_raises_lock_timeouts_rather_than_returning_the_default(workdir):
+    json_dir = str(workdir / "settings.json")
+    jmod.setvalue("RootPassword", json_dir, "secret", dt={})
+    store = jmod.store(json_dir)
+    store.file_lock.timeout = 0.05
+    store.invalidate()
+    with FileLock(f"{json_dir}.lock").hold(exclusive=True):
+        with pytest.raises(TimeoutError):
+            jmod.getvalue("RootPassword", json_dir, default="password")
+    assert jmod.getvalue("RootPassword", json_dir, default="password") == "secret"
+
+@pytest.mark.parametrize("mutate", [jmod.addvalue, jmod.remvalue])
+def test_list_changes_raise_lock_timeouts_rather_than_returning_the_default(workdir, mutate):
+    json_dir = str(workdir / "settings.json")
+    jmod.setvalue("banned", json_dir, ["10.0.0.1"], dt={})
+    jmod.store(json_dir).file_lock.timeout = 0.05
+    with FileLock(f"{json_dir}.lock").hold(exclusive=True):
+        with pytest.raises(TimeoutError):
+            mutate("banned", json_dir, "10.0.0.1", default="not found")
+    assert mutate("banned", json_dir, "10.0.0.1", default="not found") != "not found"
@@ -0,0 +1,92 @@
+from library.jmod import KeyPath
+import pytest
+
+@pytest.mark.parametrize("key, steps", [
+    ("port", ("port",)),
+    ("a.b.c", ("a", "b", "c")),
+    ("a[0]", ("a", 0)),
+    ("a[0][1].b", ("a", 0, 1, "b")),
+    ("a[-1]", ("a", -1)),
+    ("[2]", (2,)),
+    ("a..b", ("a", "", "b")),
+])
+def test_parsing(key, steps):
+    assert KeyPath(key).steps == steps
+
+@pytest.mark.parametrize("key, steps", [
+    (r"PyTrain_users.john\.doe", ("PyTrain_users", "john.doe")),
+    (r"a\[0\]", ("a[0]",)),
+    (r"a\\.b", ("a\\", "b")),
+    (r"sets.read\.only[1]", ("sets", "read.only", 1)),
+])
+def test_escaped_keys(key, steps):
+    assert KeyPath(key).steps == steps
+
+@pytest.mark.parametrize("name", ["john.doe", "a[0]", "back\\slash", "plain", ""])
+def test_escape_round_trips(name):
+    assert KeyPath(f"PyTrain_users.{KeyPath.escape(name)}").steps == ("PyTrain_users", name)
+
+def test_get():
+    data = {"a": {"b": [10, {"c": "x"}]}, "john.doe": 1}
+    assert KeyPath("a.b[0]").get(data) == 10
+    assert KeyPath("a.b[1].c").get(data) == "x"
+    assert KeyPath("a.b[-1].c").get(data) == "x"
+    assert KeyPath(KeyPath.escape("john.doe")).get(data) == 1
+
+def test_get_missing_keys_give_the_default():
+    data = {"a": {"b": [10]}}
+    assert KeyPath("a.missing.c").get(data, "default") == "default"
+    assert KeyPath("missing").get(data) is None
+    assert KeyPath("a.b[5]").get(data, 0) == 0
+
+def test_get_through_a_value_raises():
+    with pytest.raises(KeyError):
+        KeyPath("a.b.c").get({"a": {"b": 1}})
+
+def test_set_creates_missing_parents():
+    data = {}
+    KeyPath(r"PyTrain_users.john\.doe.password").set(data, "hash")
+    assert data == {"PyTrain_users": {"john.doe": {"password": "hash"}}}
+
+def test_set_list_index():
+    data = {"a": [1, 2]}
+    KeyPath("a[1]").set(data, 3)
+    assert data == {"a": [1, 3]}
+
+@pytest.mark.parametrize("key", ["a[5]", "a[0].b", "s.b"])
+def test_set_through_a_value_or_missing_index_raises(key):
+    with pytest.raises(KeyError):
+        KeyPath(key).set({"a": [1], "s": "text"}, 0)
+
+def test_append():
+    data = {"a": {"list": [1], "single": 1}}
+    KeyPath("a.list").append(data, 2)
+    KeyPath("a.single").append(data, 2)
+    assert data == {"a": {"list": [1, 2], "single": [1, 2]}}
+
+def test_append_creates_missing_keys_from_the_defaults():
+    data = {}
+    KeyPath("a.list").append(data, 2, dt={"a": {"list": [1]}})
+    assert data == {"a": {"list": [1, 2]}}
+    with pytest.raises(KeyError):
+        KeyPath("a.other").append(data, 2)
+
+def test_append_copies_the_defaults():
+    dt = {"a": {"list": [1]}}
+    KeyPath("a.list").append({}, 2, dt=dt)
+    assert dt == {"a": {"list": [1]}}
+
+def test_remove():
+    data = {"a": [1, 2, 1]}
+    KeyPath("a").remove(data, 1)
+    KeyPath("a").remove(data, 5)
+    KeyPath("missing").remove(data, 1)
+    assert data == {"a": [2, 1]}
+
+def test_compile_reuses_parsed_keys():
+    KeyPath.compile.cache_clear()
+    first = KeyPath.compile("reused.key[0]")
+    assert KeyPath.compile("reused.key[0]") is first
+    info = KeyPath.compile.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+    assert KeyPath.compile("other.key") is not first
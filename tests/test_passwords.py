@@ -0,0 +1,51 @@
+from library.passwords import hash_password, is_hashed, verify_password, VerifyCache
+import pytest
+
+@pytest.mark.parametrize("algorithm", ["pbkdf2", "scrypt"])
+def test_hashes_verify_only_their_password(algorithm, fast_hashes):
+    stored = hash_password("correct horse", algorithm)
+    assert is_hashed(stored)
+    assert verify_password(stored, "correct horse")
+    assert not verify_password(stored, "correct horse ")
+
+def test_hashes_are_salted(fast_hashes):
+    assert hash_password("same") != hash_password("same")
+
+def test_plaintext_passwords_still_verify():
+    assert not is_hashed("hunter2")
+    assert verify_password("hunter2", "hunter2")
+    assert not verify_password("hunter2", "hunter3")
+
+def test_malformed_hashes_never_verify():
+    assert not verify_password("pbkdf2_sha256$x$y", "")
+    assert not verify_password("scrypt$not$a$valid$hash$!", "anything")
+
+def test_unknown_algorithm():
+    with pytest.raises(ValueError):
+        hash_password("pw", "md5")
+
+def test_verify_cache_skips_the_hash_once_verified(fast_hashes):
+    cache = VerifyCache()
+    stored = hash_password("pw")
+    assert cache.verify("alice", stored, "pw")
+    assert cache.verify("alice", stored, "pw")
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_verify_cache_never_caches_failures(fast_hashes):
+    cache = VerifyCache()
+    stored = hash_password("pw")
+    assert not cache.verify("alice", stored, "wrong")
+    assert not cache.verify("alice", stored, "wrong")
+    assert cache.hits == 0
+
+def test_verify_cache_forgets_a_changed_password(fast_hashes):
+    cache = VerifyCache()
+    assert cache.verify("alice", hash_password("pw"), "pw")
+    assert not cache.verify("alice", hash_password("new"), "pw")
+
+def test_verify_cache_entries_expire(fast_hashes):
+    cache = VerifyCache(ttl=0)
+    stored = hash_password("pw")
+    assert cache.verify("alice", stored, "pw")
+    assert cache.verify("alice", stored, "pw")
+    assert cache.hits == 0
@@ -0,0 +1,121 @@
+from library.storage import storage, SQLiteStore, SnapshotStore, users_key
+from library.jmod import JsonStore
+import pytest
+
+def make_settings():
+    return {
+        "port": 6464,
+        "permission_sets": {"read": {"permissions": "elr"}},
+        users_key: {
+            "alice": {"username": "alice", "password": "hash-a", "home_dir": "ftp_dir/alice", "permissions": "elradfmw"},
+            "bob": {"username": "bob", "password": "hash-b", "home_dir": "ftp_dir/bob", "permissions": "elr"},
+        },
+    }
+
+def test_sqlite_round_trip(workdir):
+    SQLiteStore(str(workdir / "settings.db")).write(make_settings())
+    assert SQLiteStore(str(workdir / "settings.db")).load() == make_settings()
+
+def test_sqlite_reload_sees_another_stores_changes(workdir):
+    writer = SQLiteStore(str(workdir / "settings.db"))
+    writer.write(make_settings())
+    reader = SQLiteStore(str(workdir / "settings.db"))
+    reader.load()
+    signature = reader.signature()
+
+    with writer.transaction():
+        data = writer.load()
+        data[users_key]["alice"]["password"] = "hash-a2"
+        del data[users_key]["bob"]
+        data[users_key]["carol"] = {"username": "carol", "password": "hash-c", "home_dir": "ftp_dir/carol", "permissions": "elr"}
+        data["port"] = 7000
+        writer.write()
+
+    assert reader.signature() != signature
+    data = reader.load()
+    assert sorted(data[users_key]) == ["alice", "carol"]
+    assert data[users_key]["alice"]["password"] == "hash-a2"
+    assert data["port"] == 7000
+
+def test_sqlite_transaction_discards_changes_when_it_raises(workdir):
+    store = SQLiteStore(str(workdir / "settings.db"))
+    store.write(make_settings())
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.load()["port"] = 1
+            store.write()
+            raise RuntimeError
+    assert SQLiteStore(str(workdir / "settings.db")).load()["port"] == 6464
+
+def test_copy_between_json_and_sqlite(workdir):
+    source = JsonStore(str(workdir / "settings.json"))
+    source.write(make_settings())
+    counts = storage.copy(source, storage.open_file(str(workdir / "settings.db")))
+    assert counts == {"settings": 3, "users": 2}
+    assert SQLiteStore(str(workdir / "settings.db")).load() == make_settings()
+
+def test_snapshot_refuses_writes(workdir):
+    source = JsonStore(str(workdir / "settings.json"))
+    source.write(make_settings())
+    snapshot = SnapshotStore(source)
+    snapshot.load()["port"] = 1
+    with pytest.raises(PermissionError):
+        snapshot.write()
+    assert snapshot.load() == make_settings()
+
+def test_backend_rejects_unknown_names(workdir, monkeypatch):
+    monkeypatch.setenv("PYTRAIN_STORAGE", "yaml")
+    with pytest.raises(ValueError):
+        storage.backend("settings.json")
+    monkeypatch.setenv("PYTRAIN_STORAGE", "SQLite")
+    assert storage.backend("settings.json") == "sqlite"
+
+@pytest.fixture(params=["settings.json", "settings.db"])
+def store(request, workdir):
+    store = storage.open_file(str(workdir / request.param))
+    store.write(make_settings())
+    store.invalidate()
+    return store
+
+def test_get_set_and_delete_keys(store):
+    assert store.get(f"{users_key}.alice.permissions") == "elradfmw"
+    assert store.get(f"{users_key}.nobody", "missing") == "missing"
+    store.set(f"{users_key}.john\\.doe", {"username": "john.doe", "password": "hash-j"})
+    store.set(f"{users_key}.bob.password", "hash-b2")
+    store.set("port", 7000)
+    assert store.delete(f"{users_key}.alice")
+    assert not store.delete(f"{users_key}.alice")
+    store.invalidate()
+    users = store.load()[users_key]
+    assert sorted(users) == ["bob", "john.doe"]
+    assert users["bob"] == dict(make_settings()[users_key]["bob"], password="hash-b2")
+    assert store.load()["port"] == 7000
+
+def test_update_inside_a_transaction_is_not_undone_by_writing_the_document(store):
+    with store.transaction():
+        store.load()["port"] = 7000
+        store.write()
+        store.set(f"{users_key}.bob.password", "hash-b2")
+    store.invalidate()
+    assert store.load()["port"] == 7000
+    assert store.load()[users_key]["bob"]["password"] == "hash-b2"
+
+def test_sqlite_row_changes_only_touch_their_rows(workdir):
+    store = SQLiteStore(str(workdir / "settings.db"))
+    store.write(make_settings())
+    store.invalidate()
+    reader = SQLiteStore(str(workdir / "settings.db"))
+    reader.load()
+
+    store.set(f"{users_key}.bob.password", "hash-b2")
+    store.delete(f"{users_key}.alice")
+    assert store.get(f"{users_key}.bob.password") == "hash-b2"
+    # Only cached by load()
+    assert store._data is None
+    conn = store._connect()
+    version = store.signature()[1]
+    assert conn.execute("SELECT username FROM users WHERE version = ? ORDER BY username", (version,)).fetchall() == [("alice",)]
+    assert conn.execute("SELECT count(*) FROM settings WHERE version = ?", (version,)).fetchone() == (0,)
+
+    assert sorted(reader.load()[users_key]) == ["bob"]
+    assert reader.load()[users_key]["bob"]["password"] == "hash-b2"
@@ -0,0 +1,22 @@
+from library.throttle import Throttle
+
+def test_every_rate_is_divided_between_the_processes():
+    throttle = Throttle(download_limit=4000, user_download_limit=2000, ip_upload_limit=1000, max_sessions=3, processes=4)
+    limits = throttle.session("alice", "10.0.0.1")
+    assert throttle.downloads.rate == 1000
+    assert sorted(bucket.rate for bucket in limits.downloads) == [500]
+    assert [bucket.rate for bucket in limits.uploads] == [250]
+    # Enforced in each process
+    assert limits.max_sessions == 3
+
+def test_a_users_own_limit_is_divided_too():
+    throttle = Throttle(user_upload_limit=2000, processes=2)
+    limits = throttle.session("alice", "10.0.0.1", user={"username": "alice", "upload_limit": 900})
+    assert limits.smallest_rate(receive=True) == 450
+    assert not limits.limited(receive=False)
+
+def test_sessions_share_their_users_bucket():
+    throttle = Throttle(user_download_limit=1000, processes=2)
+    first = throttle.session("alice", "10.0.0.1")
+    second = throttle.session("alice", "10.0.0.2")
+    assert first.downloads[0] is second.downloads[0]
@@ -0,0 +1,85 @@
+from library.passwords import is_hashed, verify_password
+from library.userman import userman, settings_file
+from library.jmod import jmod, data_tables
+import pytest
+
+def test_bulk_upsert_adds_users_with_hashed_passwords(workdir, fast_hashes):
+    result = userman.bulk_upsert([
+        {"username": "alice", "password": "pass-a", "permissions": "elr"},
+        {"username": "bob", "password": "pass-b", "home_dir": "local"},
+    ], workers=2)
+    assert sorted(result["added"]) == ["alice", "bob"]
+    users = userman.list_users()
+    for username, password in (("alice", "pass-a"), ("bob", "pass-b")):
+        assert is_hashed(users[username]["password"])
+        assert verify_password(users[username]["password"], password)
+    assert (workdir / "ftp_dir" / "bob").is_dir()
+
+def test_bulk_upsert_keeps_what_an_update_leaves_out(workdir, fast_hashes):
+    userman.bulk_upsert([{"username": "alice", "password": "pass1", "permissions": "elr"}])
+    stored = userman.list_users()["alice"]["password"]
+    result = userman.bulk_upsert([{"username": "alice", "permissions": "elradfmw"}])
+    assert result["updated"] == ["alice"]
+    user = userman.list_users()["alice"]
+    assert user["permissions"] == "elradfmw"
+    assert user["password"] == stored
+
+@pytest.mark.parametrize("record, error", [
+    ({"username": "alice", "password": 1234}, "password must be text"),
+    ({"username": "alice", "password": "pass1", "home_dir": ["a"]}, "home_dir must be text"),
+    ({"username": "alice"}, "password"),
+    ({"username": "", "password": "pass1"}, "username"),
+    ("alice", "not a str"),
+])
+def test_bulk_upsert_reports_invalid_records(workdir, fast_hashes, record, error):
+    with pytest.raises(ValueError, match=error):
+        userman.bulk_upsert([record])
+
+def test_bulk_upsert_saves_nothing_if_any_record_is_invalid(workdir, fast_hashes):
+    with pytest.raises(ValueError) as raised:
+        userman.bulk_upsert([
+            {"username": "alice", "password": "pass1"},
+            {"username": "bob", "password": None, "permissions": 7},
+            {"username": "alice", "password": "again"},
+        ])
+    assert "Record 2" in str(raised.value) and "Record 3" in str(raised.value)
+    assert "alice" not in userman.list_users()
+
+def test_read_users_file_reports_rows_with_extra_fields(workdir, fast_hashes):
+    (workdir / "users.csv").write_text("username,password\nalice,pass1,extra\n")
+    with pytest.raises(ValueError, match="more fields than the header"):
+        userman.bulk_upsert(userman.read_users_file("users.csv"))
+
+def test_users_are_read_and_written_by_their_own_rows_in_sqlite(workdir, fast_hashes, monkeypatch):
+    monkeypatch.setenv("PYTRAIN_STORAGE", "sqlite")
+    userman.bulk_upsert([
+        {"username": "john.doe", "password": "pass1", "permissions": "elr"},
+        {"username": "alice", "password": "pass-a"},
+    ])
+    userman.bulk_upsert([{"username": "john.doe", "permissions": "elradfmw"}])
+    assert userman.get_user("john.doe")["permissions"] == "elradfmw"
+    assert userman.bulk_remove(["alice", "nobody"]) == ["alice"]
+    assert sorted(userman.list_users()) == ["john.doe"]
+    assert not (workdir / "settings.json").exists()
+
+def test_migrate_passwords_hashes_only_plaintext_passwords(workdir, fast_hashes, monkeypatch):
+    jmod.setvalue(key="PyTrain_users", value={
+        "alice": {"username": "alice", "password": "pass-a", "permissions": "elr", "home_dir": "ftp_dir/alice"},
+        "bob": {"username": "bob", "password": "pass-b", "permissions": "elr", "home_dir": "ftp_dir/bob"},
+        "carol": {"username": "carol", "permissions": "elr", "home_dir": "ftp_dir/carol"},
+        "dave": "broken",
+    }, json_dir=settings_file, dt=data_tables.SETTINGS_DT)
+
+    hash_password = userman.hash_password
+    def change_bob_while_hashing(password):
+        # Another process changes bob's password after the copy was read
+        if password == "pass-b":
+            jmod.setvalue(key="PyTrain_users.bob.password", value="pass-b2", json_dir=settings_file, dt=data_tables.SETTINGS_DT)
+        return hash_password(password)
+    monkeypatch.setattr(userman, "hash_password", change_bob_while_hashing)
+
+    assert userman.migrate_passwords() == 1
+    users = userman.list_users()
+    assert verify_password(users["alice"]["password"], "pass-a") and is_hashed(users["alice"]["password"])
+    assert users["bob"]["password"] == "pass-b2"
+    assert "password" not in users["carol"] and users["dave"] == "broken"
@@ -0,0 +1,91 @@
+from pyftpdlib.authorizers import DummyAuthorizer
+from library.authorizer import PyTrainAuthorizer
+from library.usersync import UserSync
+from library.storage import storage, SQLiteStore, users_key
+import pytest
+
+def _user(username, **fields):
+    return dict({"username": username, "password": "pass1", "permissions": "elr", "home_dir": f"ftp_dir/{username}"}, **fields)
+
+@pytest.mark.parametrize("entry", [
+    "not an object",
+    ["alice"],
+    {"username": "bad", "password": "pass1", "home_dir": "ftp_dir/bad"},
+    {"username": "bad", "password": "pass1", "permissions": None, "home_dir": "ftp_dir/bad"},
+    {"username": "bad", "password": "pass1", "permissions": ["e", "l"], "home_dir": "ftp_dir/bad"},
+    {"username": "bad", "password": 1234, "permissions": "elr", "home_dir": "ftp_dir/bad"},
+    {"username": "bad", "password": "pass1", "permissions": "elr"},
+    {"username": "bad", "password": "pass1", "permissions": "xyz", "home_dir": "ftp_dir/bad"},
+])
+def test_a_malformed_entry_only_skips_its_user(workdir, fast_hashes, entry):
+    sync = UserSync(PyTrainAuthorizer(str(workdir / "users.db")))
+    changes = sync.apply({"alice": _user("alice"), "bad": entry, "carol": _user("carol")})
+    assert changes["added"] == ["alice", "bad", "carol"]
+    assert sync.authorizer.has_user("alice") and sync.authorizer.has_user("carol")
+    assert not sync.authorizer.has_user("bad")
+    assert (workdir / "ftp_dir" / "alice").is_dir() and not (workdir / "ftp_dir" / "bad").exists()
+
+def test_a_user_whose_entry_breaks_keeps_its_record(workdir):
+    sync = UserSync(DummyAuthorizer())
+    sync.apply({"alice": _user("alice"), "bob": _user("bob")})
+    changes = sync.apply({"alice": ["broken"], "bob": _user("bob", permissions="elradfmw")})
+    assert changes["other"] == ["alice"] and changes["permissions"] == ["bob"]
+    assert sync.authorizer.get_perms("alice") == "elr"
+    assert sync.authorizer.get_perms("bob") == "elradfmw"
+    # Fixed in the settings, it is picked up by the next reload
+    sync.apply({"alice": _user("alice", permissions="elrw"), "bob": _user("bob", permissions="elradfmw")})
+    assert sync.authorizer.get_perms("alice") == "elrw"
+
+@pytest.fixture(params=["settings.json", "settings.db"])
+def settings(request, workdir):
+    store = storage.open_file(str(workdir / request.param))
+    store.write({users_key: {"alice": _user("alice"), "bob": _user("bob")}})
+    return store
+
+def test_sync_applies_only_what_changed(settings, workdir, fast_hashes):
+    sync = UserSync(PyTrainAuthorizer(str(workdir / "users.db")))
+    assert sync.sync(settings)["added"] == ["alice", "bob"]
+    assert sync.sync(settings)["added"] == []
+
+    settings.set(f"{users_key}.bob.permissions", "elradfmw")
+    settings.delete(f"{users_key}.alice")
+    settings.set(f"{users_key}.carol", _user("carol"))
+    changes = sync.sync(settings)
+    assert changes["added"] == ["carol"] and changes["removed"] == ["alice"] and changes["permissions"] == ["bob"]
+    assert sync.authorizer.get_perms("bob") == "elradfmw"
+    assert not sync.authorizer.has_user("alice")
+
+def test_sqlite_sync_only_reads_the_changed_rows(workdir, fast_hashes):
+    settings = SQLiteStore(str(workdir / "settings.db"))
+    settings.write({users_key: {"alice": _user("alice"), "bob": _user("bob")}})
+    sync = UserSync(PyTrainAuthorizer(str(workdir / "users.db")))
+    sync.sync(settings)
+    settings.set(f"{users_key}.bob.permissions", "elradfmw")
+    token, users, complete = settings.users_since(sync._token)
+    assert users == {"bob": _user("bob", permissions="elradfmw")} and not complete
+
+def test_a_restarted_sync_resumes_from_the_saved_token(settings, workdir, fast_hashes):
+    UserSync(PyTrainAuthorizer(str(workdir / "users.db"))).sync(settings)
+    settings.set(f"{users_key}.carol", _user("carol"))
+    # Another process, or the same one after a restart, with a fresh store
+    settings = storage.open_file(getattr(settings, "json_dir", None) or settings.path)
+    sync = UserSync(PyTrainAuthorizer(str(workdir / "users.db")))
+    changes = sync.sync(settings)
+    assert changes["added"] == ["carol"] and changes["password"] == []
+    assert sync.sync(settings)["added"] == []
+
+def test_a_failed_user_is_tried_again(workdir, fast_hashes):
+    settings = SQLiteStore(str(workdir / "settings.db"))
+    settings.write({users_key: {"alice": _user("alice"), "bob": _user("bob")}})
+    # A file in the way of bob's home directory
+    (workdir / "ftp_dir").mkdir()
+    (workdir / "ftp_dir" / "bob").write_text("")
+    sync = UserSync(PyTrainAuthorizer(str(workdir / "users.db")))
+    sync.sync(settings)
+    assert sync.authorizer.has_user("alice") and not sync.authorizer.has_user("bob")
+    # Not saved while a user is failing, so a restart tries them again too
+    assert sync.authorizer.user_table.get_meta("settings_token") is None
+
+    (workdir / "ftp_dir" / "bob").unlink()
+    assert sync.sync(settings)["added"] == ["bob"]
+    assert sync.authorizer.user_table.get_meta("settings_token") == sync._token